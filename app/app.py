@@ -16,4 +16,5 @@ from backend.app import app
 from waitress import serve
 
 if __name__ == '__main__':
-    serve(app, host='0.0.0.0', port=5000)
+    # each open task progress stream holds a thread for the lifetime of the task
+    serve(app, host='0.0.0.0', port=5000, threads=int(os.environ.get("WAITRESS_THREADS", 16)))
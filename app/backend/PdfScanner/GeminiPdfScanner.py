@@ -1,6 +1,7 @@
 import asyncio
 import os
 
+from backend import usage
 from backend.PdfScanner.pdfobject import PDFObject
 from backend.models import ModelProvider, Cohere, GeminiModel
 from backend.PdfScanner import PDFScannerInterface  # Adjust the import path as needed
@@ -62,10 +63,12 @@ class GeminiPDFScanner(PDFScannerInterface):
                 print(f"Processing PDF file...")  # Print each PDF processing step
 
                 # Use the image scanner to extract the full PDF content from binary data.
-                extracted_content = await self.image_scanner.call_model(
-                    prompt=prompt,
-                    pdf_data=pdf_data,  # Pass raw binary PDF data
-                )
+                with usage.stage('scan'):
+                    extracted_content = await self.image_scanner.call_model(
+                        prompt=prompt,
+                        pdf_data=pdf_data,  # Pass raw binary PDF data
+                        cache_prefix=True,  # The prompt is the same for every PDF
+                    )
                 # Use the image scanner to extract the full PDF content using bytes.
                 pdf_obj = await self._process_pdf_text(extracted_content, validate)
                 pdf_objects.append(pdf_obj)
@@ -73,10 +76,12 @@ class GeminiPDFScanner(PDFScannerInterface):
             for pdf_path in list_of_pdfs:
                 print(f"Processing PDF: {pdf_path}")  # Print the current PDF file being processed
                 # Use the image scanner to extract the full PDF content without modification.
-                extracted_content = await self.image_scanner.call_model(
-                    prompt=prompt,
-                    pdf_path=pdf_path,
-                )
+                with usage.stage('scan'):
+                    extracted_content = await self.image_scanner.call_model(
+                        prompt=prompt,
+                        pdf_path=pdf_path,
+                        cache_prefix=True,
+                    )
                 # Process the extracted text to obtain question–answer pairs.
                 pdf_obj = await self._process_pdf_text(extracted_content, validate)
                 pdf_objects.append(pdf_obj)
@@ -143,10 +148,11 @@ class GeminiPDFScanner(PDFScannerInterface):
         if question == "":
             return False
 
-        response = await self.text_processor.call_model(
-            prompt,
-            accept_func=lambda x: any(s in x.lower() for s in ['yes', 'no'])
-        )
+        with usage.stage('validate'):
+            response = await self.text_processor.call_model(
+                prompt,
+                accept_func=lambda x: any(s in x.lower() for s in ['yes', 'no'])
+            )
 
         if response is None:
             return False
@@ -1,52 +1,83 @@
 from collections import Counter
-from typing import Dict, Union
+from typing import Dict, Optional, Union
 import asyncio
 from backend.models import ModelProvider,Cohere
 import backend.validation as validation
+from backend import usage
 
+# Kept out of the per-question prompt so every request for every question starts with
+# the same prefix, which the provider can cache
+ANSWER_PREAMBLE = "Solve the question you are given. At the end of your reasoning give me the final answer " \
+                  "in the EXACTLY format 'Final answer: <answer>'. Do **NOT** output your answer " \
+                  "with ',' separating the numbers every magnitude of 1000. DO NOT USE MARKDOWN. " \
+                  "Avoid using units in your Final answer unless it is ambiguous. For example, if the question asks for the number of feet, do not include 'feet' in your answer."
+
+
+# The most characters kept of a response's answer, so a response that rambles past its
+# final answer, or has none, does not carry its whole reasoning into the comparisons
+MAX_ANSWER_CHARS = 1000
+FINAL_ANSWER = 'Final answer:'
 
-def extract_answer(text: str) -> str:
-    """Extract the final answer from the model's response."""
-    ans = text.split('Final answer:')[-1].replace('*', '').strip()
-    return ans
 
+def extract_answer(text: str) -> str:
+    """
+    Extract the final answer from the model's response.
 
-async def majority_vote(prompt: str, n: int, model: ModelProvider) -> Dict[str, Dict[str, Union[int, float]]]:
+    The response is searched from its end for the last 'Final answer:', and only the text
+    after it is copied. A response without one is kept from its end, where the comparator
+    looks for a boxed answer or an "answer is" phrase, but from its last box at the latest,
+    since the comparator takes the answer from that box.
+    """
+    idx = text.rfind(FINAL_ANSWER)
+    if idx >= 0:
+        start = idx + len(FINAL_ANSWER)
+        ans = text[start:start + MAX_ANSWER_CHARS]
+    else:
+        start = max(len(text) - MAX_ANSWER_CHARS, 0)
+        box = max(text.rfind(command) for command in validation.BOX_COMMANDS)
+        if box >= 0:
+            start = min(start, box)
+        ans = text[start:start + MAX_ANSWER_CHARS]
+    return ans.replace('*', '').strip()
+
+
+async def majority_vote(prompt: str, n: int, model: ModelProvider, preamble: Optional[str] = None) -> Dict[str, Dict[str, Union[int, float]]]:
     """
     Get multiple model responses and return a dictionary with both counts and frequencies.
 
+    The responses are sampled with `ModelProvider.call_model_n`, so providers that return
+    several candidates per request need fewer requests than responses.
+
     Args:
         prompt: The prompt to send to the model
         n: Number of times to query the model
+        preamble: The system message sent with the prompt
 
     Returns:
         Dictionary with answers as keys and nested dictionaries containing:
             - count: number of times this answer appeared
             - frequency: fraction of times this answer appeared (count/n)
     """
-    coroutines = [
-        model.call_model(
-            prompt, 
-            temperature=1
-        )
-        for _ in range(n)
-    ]
-
     try:
-        # Run coroutines concurrently with progress bar
-        results = await asyncio.gather(*coroutines, return_exceptions=True)
-        
-        # Filter out exceptions and extract answers
-        valid_results = [r for r in results if not isinstance(r, Exception)]
+        with usage.stage('answer'):
+            valid_results = await model.call_model_n(
+                prompt,
+                n,
+                preamble=preamble,
+                temperature=1,
+                cache_prefix=True
+            )
         
         if not valid_results:
             return {}
             
         answers = [extract_answer(r) for r in valid_results]
+        # Only the answers are kept, so the reasoning texts can be freed
+        del valid_results
         counts = Counter(answers)
 
         # Create dictionary with counts and frequencies
-        total_responses = len(valid_results)
+        total_responses = len(answers)
         result_dict = {
             answer: {
                 'count': count,
@@ -60,7 +91,23 @@ async def majority_vote(prompt: str, n: int, model: ModelProvider) -> Dict[str,
         return {}
 
 
-async def generate_answers(question: str, n: int, model: ModelProvider) -> Dict[str, int | float]:
+def _merge_votes(*votes: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Combines the results of several `majority_vote` calls for the same prompt."""
+    counts = Counter()
+    for vote in votes:
+        counts.update({answer: stats['count'] for answer, stats in vote.items()})
+    total_responses = sum(counts.values())
+    return {
+        answer: {'count': count, 'frequency': count / total_responses}
+        for answer, count in counts.items()
+    }
+
+
+async def generate_answers(question: str,
+                           n: int,
+                           model: ModelProvider,
+                           comparator: Optional[validation.LLMAnswerComparator] = None,
+                           first_pass: int = 0) -> Dict[str, int | float]:
     """
     Generate multiple model responses for a given question and return normalized answer frequencies.
 
@@ -71,19 +118,30 @@ async def generate_answers(question: str, n: int, model: ModelProvider) -> Dict[
         question: The math question to generate answers for.
         n: The number of model calls to make.
         model: An instance of a ModelProvider used to generate answers.
+        comparator: The comparator grouping the answers, shared by the questions of a task. Defaults
+            to one deciding unsettled comparisons with `model`, so they reuse its client.
+        first_pass: If between 0 and n, this many responses are sampled first, and the remaining
+            ones only if they do not all give the same answer. 0 always samples n responses.
 
     Returns:
         Dictionary with representative answers as keys and their estimated confidence percentage as values.
         If no answers are generated or an error occurs, returns a fallback dictionary.
     """
     try:
-        prompt = f"Solve this question:\n Question: {question}\n at the end of your reasoning give me the final answer " \
-                 f"in the EXACTLY format 'Final answer: <answer>'. Do **NOT** output your answer " \
-                 f"with ',' separating the numbers every magnitude of 1000. DO NOT USE MARKDOWN." \
-                 f"Avoid using units in your Final answer unless it is ambiguous. For example, if the question asks for the number of feet, do not include 'feet' in your answer."
-
-        comparator = validation.LLMAnswerComparator(tolerance=1e-5)
-        result_dict = await majority_vote(prompt, n, model)
+        prompt = f"Question: {question}"
+
+        if comparator is None:
+            comparator = validation.LLMAnswerComparator(tolerance=1e-5, model=model)
+        if 0 < first_pass < n:
+            result_dict = await majority_vote(prompt, first_pass, model, preamble=ANSWER_PREAMBLE)
+            if len(result_dict) == 1 and next(iter(result_dict.values()))['count'] == first_pass:
+                # Unanimous, so the question is easy enough to settle with the first pass
+                n = first_pass
+            else:
+                rest = await majority_vote(prompt, n - first_pass, model, preamble=ANSWER_PREAMBLE)
+                result_dict = _merge_votes(result_dict, rest)
+        else:
+            result_dict = await majority_vote(prompt, n, model, preamble=ANSWER_PREAMBLE)
 
         # List of unique answers
         unique_answers = list(result_dict.keys())
@@ -93,26 +151,9 @@ async def generate_answers(question: str, n: int, model: ModelProvider) -> Dict[
             return {"no answers generated": 0}
 
 
-        # Initialize 2D matrix for equivalence checks
-        unique_answers_matrix = [[None] * num_answers for _ in range(num_answers)]
-        equivalence_tasks = []
-
-        # Populate matrix with coroutines (only for i < j)
-        for i in range(num_answers):
-            for j in range(i + 1, num_answers):
-                task = comparator.llm_answers_equivalent_full(unique_answers[i], unique_answers[j])
-                unique_answers_matrix[i][j] = task
-                equivalence_tasks.append(task)
-
-        # Await all equivalence checks concurrently
-        results = await asyncio.gather(*equivalence_tasks)
-
-        # Fill in matrix with actual results
-        index = 0
-        for i in range(num_answers):
-            for j in range(i + 1, num_answers):
-                unique_answers_matrix[i][j] = results[index].status == validation.Equality.EQUAL
-                index += 1
+        # Equivalence of every pair (only for i < j); pairs the deterministic checks cannot
+        # settle are decided by one LLM call for the whole question
+        unique_answers_matrix = await comparator.equivalence_matrix(unique_answers)
 
         # Create groups of equivalent answers
         answer_groups = []
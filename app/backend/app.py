@@ -3,20 +3,26 @@ import datetime
 import secrets
 import re
 import ssl
+import threading
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import jwt
-from werkzeug.security import generate_password_hash, check_password_hash
 
 import backend.database as dao
 import backend.database.db_factory as db_factory
+from backend.auth_cache import UserCache, RevocationCache, claims_for_user, user_from_claims, hash_token
+from backend.password_hasher import PasswordHasher, HasherBusyError
+from backend.progress import stream_progress
+from backend.usage import prometheus_text
+from backend.scheduler import SchedulerBusyError, job_fingerprint, scheduler_from_env
 
 import os
 from dotenv import load_dotenv
 import redis
 import json
-from backend.task import generate_exam_task, generate_and_save_exam_task
+from backend.celery_app import celery, GENERATE_EXAM_TASK, GENERATE_AND_SAVE_EXAM_TASK
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -32,6 +38,14 @@ CORS(app, resources={
 
 load_dotenv()
 
+# Number of reverse proxies in front of the app. Their X-Forwarded-* headers are trusted
+# for that many hops, so request.remote_addr is the client's address rather than the
+# last proxy's (guests are told apart by it). Leave at 0 when clients connect directly,
+# or they could spoof their address.
+proxy_count = int(os.environ.get("PROXY_COUNT", 0))
+if proxy_count > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count, x_proto=proxy_count, x_host=proxy_count)
+
 redis_url = os.environ.get("REDIS_URL")
 pattern = r"rediss://default:(?P<A>[^@]+)@(?P<B>[^:]+):(?P<C>[^/]+)/"
 match = re.search(pattern, redis_url)
@@ -57,23 +71,73 @@ redis_client = redis.Redis(
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = datetime.timedelta(minutes=15)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = datetime.timedelta(days=7)
 db = db_factory.get_db_instance()
+user_cache = UserCache(
+    db,
+    redis_client,
+    local_ttl=float(os.environ.get("USER_CACHE_LOCAL_TTL", 30)),
+    redis_ttl=int(os.environ.get("USER_CACHE_REDIS_TTL", 300))
+)
+revoked_tokens = RevocationCache(redis_client)
+# Callers wait for their hash on a request thread, so the workers and the queue together
+# stay well below WAITRESS_THREADS and a login burst cannot take every request thread
+password_hasher = PasswordHasher(
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 2)),
+    max_queue=int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 4)),
+    iterations=int(os.environ["PASSWORD_HASH_ITERATIONS"]) if os.environ.get("PASSWORD_HASH_ITERATIONS") else None
+)
+
+
+def hasher_busy_response():
+    """
+    Build the response returned when the password hashing queue is full.
+
+    Returns:
+        A 503 JSON response asking the client to retry shortly.
+    """
+    response = jsonify({'message': 'Server is busy, please try again shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+job_scheduler = scheduler_from_env(redis_client, celery)
+
+
+def scheduler_busy_response(error):
+    """
+    Build the response returned when an exam generation job is not admitted.
+
+    Args:
+        error: The SchedulerBusyError raised on submission.
+
+    Returns:
+        A 429 JSON response asking the client to retry later.
+    """
+    response = jsonify({'message': str(error)})
+    response.headers['Retry-After'] = '30'
+    return response, 429
 
 # Token generation functions
-def generate_access_token(user_id):
+def generate_access_token(user_id, username, email, auth_provider):
     """
     Generate a short-lived JWT access token for a given user.
 
-    The token includes the user ID, issued-at time, expiration time, and a type field.
-    It is signed using the HS256 algorithm and a secret key from the environment.
+    The token includes the user claims that route handlers need (ID, username,
+    email, auth provider), so authenticated requests do not have to look the
+    user up in the database. It also carries the issued-at time, expiration
+    time, and a type field, and is signed using the HS256 algorithm and a
+    secret key from the environment.
 
     Args:
         user_id: The ID of the user for whom the token is generated.
+        username: The username of the user.
+        email: The email of the user.
+        auth_provider: The authentication provider of the account.
 
     Returns:
         A JWT access token as a string.
     """
     return jwt.encode({
-        'user_id': user_id,
+        **claims_for_user(user_id, username, email, auth_provider),
         'exp': datetime.datetime.now(datetime.timezone.utc) + app.config['JWT_ACCESS_TOKEN_EXPIRES'],
         'iat': datetime.datetime.now(datetime.timezone.utc),
         'type': 'access'
@@ -85,7 +149,8 @@ def generate_refresh_token(user_id: int) -> str:
     Generate a long-lived refresh token for a given user and store it in the database.
 
     This function creates a secure hex token, sets its expiration time, and attempts
-    to persist it to the database. If storing fails, the error is printed but the token is still returned.
+    to persist its SHA-256 digest to the database. If storing fails, the error is printed
+    but the token is still returned.
 
     Args:
         user_id: The ID of the user for whom the refresh token is generated.
@@ -99,7 +164,7 @@ def generate_refresh_token(user_id: int) -> str:
     expires_at = datetime.datetime.now(datetime.timezone.utc) + app.config['JWT_REFRESH_TOKEN_EXPIRES']
 
     try:
-        db.create_refresh_token(user_id, token_value, expires_at)
+        db.create_refresh_token(user_id, hash_token(token_value), expires_at)
     except (dao.DatabaseError, dao.DataError) as e:
         # XXX: right now there is no explicit handling of a db error when
         #      creating a token, so we might end up with a situation where
@@ -109,19 +174,29 @@ def generate_refresh_token(user_id: int) -> str:
 
 
 # Token verification decorator
-def token_required(f):
+def token_required(f=None, *, fresh=False):
     """
         Decorator to enforce JWT access token authentication on protected routes.
 
         - Extracts the token from the Authorization header (Bearer scheme).
         - Verifies the token's signature and expiration.
         - Ensures the token is of type "access".
-        - Fetches the corresponding user from the database and passes it to the route handler.
+        - Builds the current user from the token claims and passes it to the route handler.
+
+        Use `@token_required(fresh=True)` on routes that must not act on claims that may
+        have gone stale since the token was issued (e.g. a renamed user), which includes
+        every route that changes user data. Those routes, and tokens issued without user
+        claims, resolve the user through the user cache. Claims of a deleted user are
+        rejected everywhere.
+        The password hash is never part of the current user.
 
         Returns:
             A decorated function that rejects unauthorized requests with appropriate error messages,
             or calls the wrapped route handler with the current user as the first argument.
         """
+    if f is None:
+        return lambda func: token_required(func, fresh=fresh)
+
     @wraps(f)
     def decorated(*args, **kwargs):
         # Skip token validation for OPTIONS requests (CORS preflight)
@@ -148,8 +223,12 @@ def token_required(f):
             if data.get('type') != 'access':
                 return jsonify({'message': 'Invalid token type!'}), 401
                 
-            # Get the user
-            current_user = db.get_user(user_id=data['user_id'])
+            # Get the user, from the token claims when possible
+            current_user = None if fresh else user_from_claims(data)
+            if current_user is not None and revoked_tokens.is_user_revoked(current_user[0]):
+                return jsonify({'message': 'User not found!'}), 401
+            if current_user is None:
+                current_user = user_cache.get_user(data['user_id'])
             
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 401
@@ -194,7 +273,10 @@ def signup():
         return jsonify({'message': 'User already exists!'}), 409
     
     # Generate hashed password
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except HasherBusyError:
+        return hasher_busy_response()
 
     try:
         auth_provider = 'local'
@@ -203,7 +285,7 @@ def signup():
         return jsonify({'message': 'Username or email already in use!'}), 409   
     
     # Generate tokens
-    access_token = generate_access_token(new_id)
+    access_token = generate_access_token(new_id, data['username'], data['email'], auth_provider)
     refresh_token = generate_refresh_token(new_id)
     
     return jsonify({
@@ -242,14 +324,17 @@ def login():
         return jsonify({'message': 'Invalid credentials!'}), 401
     
     # Verify password
-    if not check_password_hash(password, data['password']):
-        return jsonify({'message': 'Invalid credentials!'}), 401
+    try:
+        if not password_hasher.verify(password, data['password']):
+            return jsonify({'message': 'Invalid credentials!'}), 401
+    except HasherBusyError:
+        return hasher_busy_response()
     
     # Update last login time
     db.set_last_login(username, datetime.datetime.now(datetime.timezone.utc))
     
     # Generate tokens
-    access_token = generate_access_token(user_id)
+    access_token = generate_access_token(user_id, username, email, auth_provider)
     refresh_token = generate_refresh_token(user_id)
     
     return jsonify({
@@ -289,6 +374,7 @@ def google_auth():
         if auth_provider == 'local' and not oauth_id:
             # Keep auth_provider as 'local' as requested
             db.set_oauth_id(user_id, data['oauth_id'])
+            user_cache.invalidate(user_id)
         
         # Update last login time
         db.set_last_login(username, datetime.datetime.now(datetime.timezone.utc))
@@ -308,7 +394,7 @@ def google_auth():
             return jsonify({'message': 'Error creating user!'}), 500
     
     # Generate tokens
-    access_token = generate_access_token(user_id)
+    access_token = generate_access_token(user_id, username, data['email'], auth_provider)
     refresh_token = generate_refresh_token(user_id)
     
     return jsonify({
@@ -327,7 +413,8 @@ def refresh():
     Rotates JWT tokens using a valid, non-expired refresh token.
 
     Validates the refresh token and issues a new access and refresh token.
-    Revokes the old refresh token if it is expired.
+    Revokes the old refresh token if it is expired. Tokens found in the Redis
+    revocation cache are rejected without a database lookup.
 
     Returns:
         JSON response with new tokens, or error message if token is invalid or expired.
@@ -337,8 +424,12 @@ def refresh():
     if not data.get('refresh_token'):
         return jsonify({'message': 'Refresh token is required!'}), 400
     
+    token_hash = hash_token(data['refresh_token'])
+    if revoked_tokens.is_revoked(token_hash):
+        return jsonify({'message': 'Invalid refresh token!'}), 401
+
     # Find the refresh token in the database
-    token_record = db.get_refresh_token(data['refresh_token'], False)
+    token_record = db.get_refresh_token(token_hash, False)
     
     if not token_record:
         return jsonify({'message': 'Invalid refresh token!'}), 401
@@ -349,17 +440,17 @@ def refresh():
     
     # Check if token is expired
     if expires_at < datetime.datetime.now(datetime.timezone.utc):
-        db.set_revoked_status(data['refresh_token'], True)
+        db.set_revoked_status(token_hash, True)
         return jsonify({'message': 'Refresh token has expired!'}), 401
     
     # Get user
-    user = db.get_user(user_id=user_id)
+    user = user_cache.get_user(user_id)
     
     if not user:
         return jsonify({'message': 'User not found!'}), 401
     
     # Generate new access token
-    access_token = generate_access_token(user_id)
+    access_token = generate_access_token(user_id, user[1], user[2], user[4])
     
     # Token rotation: generate new refresh token
     new_refresh_token = generate_refresh_token(user_id)
@@ -375,7 +466,8 @@ def logout():
     """
     Logs out the user by revoking the provided refresh token.
 
-    Marks the refresh token as revoked in the database to prevent future use.
+    Marks the refresh token as revoked in the database and in the Redis
+    revocation cache to prevent future use.
 
     Returns:
         JSON response confirming logout or error message if token is invalid.
@@ -385,12 +477,16 @@ def logout():
     if not data.get('refresh_token'):
         return jsonify({'message': 'Refresh token is required!'}), 400
     
+    token_hash = hash_token(data['refresh_token'])
+    if revoked_tokens.is_revoked(token_hash):
+        return jsonify({'message': 'Invalid refresh token!'}), 400
+
     # Revoke the refresh token
-    token_record = db.get_refresh_token(data['refresh_token'], False)
-    # token_record = RefreshToken.query.filter_by(token=data['refresh_token']).first()
+    token_record = db.get_refresh_token(token_hash, False)
     
     if token_record:
-        db.set_revoked_status(data['refresh_token'], True)
+        db.set_revoked_status(token_hash, True)
+        revoked_tokens.revoke(token_hash, token_record[1])
     else:
         return jsonify({'message': 'Invalid refresh token!'}), 400
 
@@ -400,7 +496,7 @@ def logout():
 
 # Protected route example
 @app.route('/api/user/profile', methods=['GET'])
-@token_required
+@token_required(fresh=True)
 def get_profile(current_user):
     """
     Get the authenticated user's profile information.
@@ -417,7 +513,7 @@ def get_profile(current_user):
 
 
 @app.route('/api/user/username', methods=['PATCH'])
-@token_required
+@token_required(fresh=True)
 def update_username(current_user):
     """
     Update the authenticated user's username.
@@ -437,6 +533,7 @@ def update_username(current_user):
 
     try:
         db.update_username(user_id, new_username)
+        user_cache.invalidate(user_id)
         return jsonify({
             'message': 'Username updated successfully.',
             'username': new_username
@@ -446,7 +543,7 @@ def update_username(current_user):
 
 
 @app.route('/api/user/password', methods=['PATCH'])
-@token_required
+@token_required(fresh=True)
 def update_password(current_user):
     """
     Update the user's password after verifying the old one.
@@ -472,20 +569,23 @@ def update_password(current_user):
 
         stored_password = user[3]  # Assuming password is at index 3
 
-        if not check_password_hash(stored_password, old_password):
+        if not password_hasher.verify(stored_password, old_password):
             return jsonify({'message': 'Old password is incorrect.'}), 401
 
-        hashed_password = generate_password_hash(new_password, method='pbkdf2:sha256')
+        hashed_password = password_hasher.hash(new_password)
         db.update_password(user_id, hashed_password)
+        user_cache.invalidate(user_id)
 
         return jsonify({'message': 'Password updated successfully!'}), 200
 
+    except HasherBusyError:
+        return hasher_busy_response()
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
 
 @app.route('/api/user/account', methods=['DELETE'])
-@token_required
+@token_required(fresh=True)
 def delete_account(current_user):
     """
     Deletes the authenticated user's account from the database.
@@ -497,6 +597,9 @@ def delete_account(current_user):
 
     try:
         db.delete_user_account(user_id)
+        user_cache.invalidate(user_id)
+        # Access tokens already issued carry the user in their claims until they expire
+        revoked_tokens.revoke_user(user_id, int(app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds()))
         return jsonify({'message': 'Account deleted successfully.'}), 200
     except Exception as e:
         return jsonify({'message': str(e)}), 500
@@ -552,9 +655,44 @@ def generate_exam():
     except Exception as e:
         return jsonify({'message': f'Error reading files: {str(e)}'}), 500
 
-    # Enqueue the exam generation task using Celery
-    task = generate_exam_task.delay(pdf_data_list, num_questions, title, description)
-    return jsonify({'task_id': task.id}), 202
+    # Queue the exam generation job; guests are told apart by their address (see
+    # `PROXY_COUNT` when the app is behind a reverse proxy). A repeated
+    # request (e.g. a double submit) returns the task id of the first one.
+    owner = f"guest:{request.remote_addr}"
+    try:
+        task_id = job_scheduler.submit(
+            owner,
+            'guest',
+            GENERATE_EXAM_TASK,
+            (pdf_data_list, num_questions, title, description),
+            fingerprint=job_fingerprint(owner, pdf_data_list, num_questions, title, description)
+        )
+    except SchedulerBusyError as e:
+        return scheduler_busy_response(e)
+    return jsonify({'task_id': task_id}), 202
+
+
+def task_status(task_id):
+    """
+    Read the current state of an asynchronous exam generation task from the result backend.
+
+    Args:
+        task_id: ID of the Celery task
+
+    Returns:
+        A dictionary with the task state and its result, progress metadata or error.
+    """
+    task = celery.AsyncResult(task_id)
+    if task.state == 'PENDING':
+        return {'state': task.state, 'result': 'Pending...'}
+    elif task.state != 'FAILURE':
+        return {'state': task.state, 'result': task.result}
+    try:
+        json.dumps(task.result)
+        status = task.result
+    except TypeError:
+        status = str(task.result)
+    return {'state': task.state, 'result': status}
 
 
 @app.route('/api/task/<task_id>', methods=['GET'])
@@ -568,24 +706,80 @@ def get_task_status(task_id):
     Returns:
         JSON response with task state and result or error.
     """
-    from backend.task import celery  # Import the Celery instance
-    task = celery.AsyncResult(task_id)
-    if task.state == 'PENDING':
-        response = {'state': task.state, 'result': 'Pending...'}
-    elif task.state != 'FAILURE':
-        response = {'state': task.state, 'result': task.result}
-    else:
-        try:
-            json.dumps(task.result)
-            status = task.result
-        except TypeError:
-            status = str(task.result)
-        response = {'state': task.state, 'result': status}
-    return jsonify(response)
+    return jsonify(task_status(task_id))
+
+
+# Each open progress stream holds a waitress thread, so only a few are served at a time,
+# well below WAITRESS_THREADS; other clients poll `/api/task/<task_id>` instead
+progress_streams = threading.BoundedSemaphore(int(os.environ.get("SSE_MAX_STREAMS", 4)))
+
+
+@app.route('/api/task/<task_id>/events', methods=['GET'])
+def stream_task_status(task_id):
+    """
+    Stream the progress of an asynchronous exam generation task as Server-Sent Events.
+
+    The first event is the current task status; after that, every stage transition
+    published by the worker is forwarded as it happens, and the stream ends after the
+    final result (or failure). Events have the same shape as `/api/task/<task_id>`.
+
+    Streams are closed after `SSE_MAX_DURATION_SECONDS`, and the client reconnects.
+    At most `SSE_MAX_STREAMS` streams are open at a time.
+
+    Args:
+        task_id: ID of the Celery task
+
+    Returns:
+        A `text/event-stream` response, or 503 if too many streams are open, in which
+        case the client polls `/api/task/<task_id>` instead.
+    """
+    if not progress_streams.acquire(blocking=False):
+        response = jsonify({'message': 'Too many progress streams are open, poll the task status instead.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    try:
+        events = stream_progress(
+            redis_client,
+            task_id,
+            lambda: task_status(task_id),
+            heartbeat=float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15)),
+            max_duration=float(os.environ.get("SSE_MAX_DURATION_SECONDS", 60))
+        )
+        response = Response(
+            stream_with_context(events),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    except Exception:
+        progress_streams.release()
+        raise
+    # Called by the server once the stream is closed, whether it finished or the client left
+    response.call_on_close(progress_streams.release)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Export metrics in the Prometheus text format: the LLM call, token and latency totals
+    of all workers, and the password hashing queue depth and latency of this process.
+
+    Returns:
+        A `text/plain` response with the metrics, or 503 if Redis is unavailable.
+    """
+    try:
+        text = prometheus_text(redis_client) + password_hasher.prometheus_text()
+        return Response(text, mimetype='text/plain; version=0.0.4')
+    except redis.RedisError:
+        return jsonify({'error': 'Metrics are unavailable'}), 503
 
 
 @app.route('/api/exam/generate/save', methods=['POST', 'OPTIONS'])
-@token_required
+@token_required(fresh=True)
 def generate_and_save_exam(current_user):
     """
     Generate and save an exam for a logged-in user.
@@ -640,22 +834,33 @@ def generate_and_save_exam(current_user):
     except Exception as e:
         return jsonify({'message': f'Error reading files: {str(e)}'}), 500
 
-    # Enqueue the exam generation and save task using Celery
-    task = generate_and_save_exam_task.delay(
-        pdf_data_list, 
-        num_questions, 
-        title, 
-        description, 
-        color, 
-        privacy, 
-        current_user[1]  # username
-    )
-    
-    return jsonify({'task_id': task.id}), 202
+    # Queue the exam generation and save job. A repeated request (e.g. a double submit)
+    # returns the task id of the first one.
+    owner = f"user:{current_user[0]}"
+    try:
+        task_id = job_scheduler.submit(
+            owner,
+            'user',
+            GENERATE_AND_SAVE_EXAM_TASK,
+            (
+                pdf_data_list,
+                num_questions,
+                title,
+                description,
+                color,
+                privacy,
+                current_user[1]  # username
+            ),
+            fingerprint=job_fingerprint(owner, pdf_data_list, num_questions, title, description, color, privacy)
+        )
+    except SchedulerBusyError as e:
+        return scheduler_busy_response(e)
+
+    return jsonify({'task_id': task_id}), 202
 
 
 @app.route('/api/exam/generate/save-after', methods=['POST'])
-@token_required
+@token_required(fresh=True)
 def save_exam_after_generate(current_user):
     """
     Save a pre-generated exam to the database manually.
@@ -894,7 +1099,7 @@ def get_exams_personal(current_user):
     
 
 @app.route("/api/favourite", methods=["POST"])
-@token_required
+@token_required(fresh=True)
 def fav(current_user):
     """
     Mark or unmark an exam as a favourite for the authenticated user.
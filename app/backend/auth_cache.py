@@ -0,0 +1,257 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from backend.database import DataAccessObject
+
+# Layout of the user tuples handed to route handlers. It mirrors the row
+# returned by DataAccessObject.get_user so handlers can keep indexing into it,
+# but the password hash and timestamps are never cached.
+CachedUser = tuple[int, str, str, None, str, Optional[str], None, None, None]
+
+
+def hash_token(token: str) -> str:
+    """
+    Compute the digest under which a refresh token is stored and looked up.
+
+    Args:
+        token: The refresh token handed to the client.
+
+    Returns:
+        The fixed-size (64 character) SHA-256 hex digest of the token.
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def claims_for_user(user_id: int, username: str, email: str, auth_provider: str) -> dict:
+    """
+    Build the user claims embedded in an access token.
+
+    Args:
+        user_id: The database id of the user.
+        username: The username of the user.
+        email: The email of the user.
+        auth_provider: The authentication provider of the account.
+
+    Returns:
+        A dictionary of claims to merge into the JWT payload.
+    """
+    return {
+        'user_id': user_id,
+        'username': username,
+        'email': email,
+        'auth_provider': auth_provider
+    }
+
+
+def user_from_claims(claims: dict) -> Optional[CachedUser]:
+    """
+    Rebuild a user tuple from the claims of a decoded access token.
+
+    Args:
+        claims: The decoded JWT payload.
+
+    Returns:
+        A user tuple, or None if the token predates user claims and only carries the id.
+    """
+    if 'username' not in claims:
+        return None
+    return (claims['user_id'], claims['username'], claims.get('email'), None,
+            claims.get('auth_provider'), None, None, None, None)
+
+
+class UserCache:
+    """
+    Two-level (in-process + Redis) read-through cache of user records.
+
+    Entries only hold the fields route handlers read (id, username, email,
+    auth provider and oauth id). The in-process level has a short TTL so that
+    other web processes observe invalidations quickly; the Redis level is
+    shared and is deleted explicitly whenever a user record changes.
+    """
+
+    def __init__(self,
+                 db: DataAccessObject,
+                 redis_client: redis.Redis,
+                 local_ttl: float = 30.0,
+                 redis_ttl: int = 300,
+                 prefix: str = "user"):
+        """
+        Args:
+            db: The data access object used on a cache miss.
+            redis_client: The shared Redis client.
+            local_ttl: Seconds an entry stays in the in-process cache.
+            redis_ttl: Seconds an entry stays in Redis.
+            prefix: Key prefix for Redis entries.
+        """
+        self.db = db
+        self.redis_client = redis_client
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._local: dict[int, tuple[float, CachedUser]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    @staticmethod
+    def _from_row(row: tuple) -> CachedUser:
+        return (row[0], row[1], row[2], None, row[4], row[5], None, None, None)
+
+    def get_user(self, user_id: int) -> Optional[CachedUser]:
+        """
+        Fetch a user through the cache, falling back to the database.
+
+        Redis errors are treated as cache misses so that an unavailable cache
+        never locks users out.
+
+        Args:
+            user_id: The database id of the user.
+
+        Returns:
+            The cached user tuple, or None if no such user exists.
+
+        Raises:
+            DatabaseError: The database lookup on a cache miss failed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(user_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        try:
+            cached = self.redis_client.get(self._key(user_id))
+        except redis.RedisError:
+            cached = None
+
+        if cached:
+            user = tuple(json.loads(cached))
+        else:
+            row = self.db.get_user(user_id=user_id)
+            if not row:
+                return None
+            user = self._from_row(row)
+            try:
+                self.redis_client.setex(self._key(user_id), self.redis_ttl, json.dumps(user))
+            except redis.RedisError:
+                pass
+
+        with self._lock:
+            self._local[user_id] = (now + self.local_ttl, user)
+        return user
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drop a user from both cache levels. Call after any change to the user record.
+
+        Args:
+            user_id: The database id of the user.
+        """
+        with self._lock:
+            self._local.pop(user_id, None)
+        try:
+            self.redis_client.delete(self._key(user_id))
+        except redis.RedisError:
+            pass
+
+
+class RevocationCache:
+    """
+    Redis-backed set of revoked refresh-token digests and deleted users.
+
+    Each revoked digest is its own key that expires together with the token,
+    so the set never outgrows the live tokens and a revoked token can be
+    rejected without a database round-trip. A deleted user is kept for as long
+    as the access tokens issued before the deletion can still be valid.
+    """
+
+    def __init__(self, redis_client: redis.Redis, prefix: str = "revoked_rt", user_prefix: str = "deleted_user"):
+        """
+        Args:
+            redis_client: The shared Redis client.
+            prefix: Key prefix for revoked digests.
+            user_prefix: Key prefix for deleted users.
+        """
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.user_prefix = user_prefix
+
+    def _key(self, token_hash: str) -> str:
+        return f"{self.prefix}:{token_hash}"
+
+    def revoke(self, token_hash: str, expires_at: datetime.datetime) -> None:
+        """
+        Record a digest as revoked until the token would have expired anyway.
+
+        Args:
+            token_hash: The digest of the revoked token.
+            expires_at: The expiry time of the token, as a datetime or an ISO
+                        formatted string (SQLite returns the latter).
+        """
+        if isinstance(expires_at, str):
+            expires_at = datetime.datetime.fromisoformat(expires_at)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+        remaining = int((expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        if remaining <= 0:
+            return
+        try:
+            self.redis_client.setex(self._key(token_hash), remaining, 1)
+        except redis.RedisError:
+            pass
+
+    def is_revoked(self, token_hash: str) -> bool:
+        """
+        Check whether a digest is known to be revoked.
+
+        A False result is not authoritative: the database remains the source
+        of truth for tokens that are not in the cache.
+
+        Args:
+            token_hash: The digest of the token.
+
+        Returns:
+            True if the token is known to be revoked.
+        """
+        try:
+            return bool(self.redis_client.exists(self._key(token_hash)))
+        except redis.RedisError:
+            return False
+
+    def revoke_user(self, user_id: int, ttl: int) -> None:
+        """
+        Record a user as deleted, so access tokens built from claims alone are rejected.
+
+        Args:
+            user_id: The database id of the deleted user.
+            ttl: Seconds the user's access tokens can remain valid.
+        """
+        try:
+            self.redis_client.setex(f"{self.user_prefix}:{user_id}", ttl, 1)
+        except redis.RedisError:
+            pass
+
+    def is_user_revoked(self, user_id: int) -> bool:
+        """
+        Check whether a user is known to be deleted.
+
+        A False result is not authoritative; routes that change the user record
+        look the user up instead of trusting the token claims.
+
+        Args:
+            user_id: The database id of the user.
+
+        Returns:
+            True if the user was deleted.
+        """
+        try:
+            return bool(self.redis_client.exists(f"{self.user_prefix}:{user_id}"))
+        except redis.RedisError:
+            return False
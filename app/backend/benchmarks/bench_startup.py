@@ -0,0 +1,60 @@
+"""
+Import time and memory of the modules each process loads at startup.
+
+The web process imports `backend.celery_app` to enqueue tasks and read their results,
+the workers import `backend.task`, and the comparison pool's workers additionally
+import sympy and its parsers. Each import is timed in a fresh interpreter, so nothing
+is shared between measurements.
+
+Run from the `app` directory:
+
+    python -m backend.benchmarks.bench_startup
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# What each kind of process imports before it handles work
+PROCESSES = {
+    "web (task handles)": ["backend.celery_app", "backend.scheduler", "backend.progress", "backend.usage"],
+    "celery worker": ["backend.task"],
+    "comparison worker": ["backend.validation", "sympy", "sympy.parsing.sympy_parser", "sympy.parsing.latex"],
+}
+
+_PROBE = """
+import importlib, json, resource, sys, time
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+    "sympy": "sympy" in sys.modules,
+}))
+"""
+
+
+def measure(modules: list[str]) -> dict:
+    """Returns the import time, the growth of peak memory and whether sympy got loaded, in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE, *modules], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per process kind; the fastest is reported")
+    args = parser.parse_args()
+
+    for name, modules in PROCESSES.items():
+        best = min((measure(modules) for _ in range(args.repeat)), key=lambda run: run["seconds"])
+        sympy_loaded = "loads sympy" if best["sympy"] else "no sympy"
+        print(f"{name:20} {best['seconds'] * 1000:8.1f} ms  {best['rss_mb']:6.1f} MB  ({sympy_loaded})")
+
+
+if __name__ == "__main__":
+    main()
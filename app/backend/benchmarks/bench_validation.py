@@ -0,0 +1,124 @@
+"""
+Microbenchmarks of the deterministic answer comparison of one question.
+
+`generate_answers` compares every pair of unique answers, so each answer takes part in
+n - 1 comparisons. This times all pairs of the answers used in `tests/test_validation.py`
+with the comparator's memo (each answer extracted, normalized and parsed once) and
+without it (`cache_size=0`), the throughput of `normalize_answer_string` alone, and the
+string and numeric stages of a question's answers pair by pair against `bulk_compare`.
+
+Run from the `app` directory:
+
+    python -m backend.benchmarks.bench_validation
+"""
+import argparse
+import itertools
+import time
+
+from backend.validation import LLMAnswerComparator
+
+# The answers compared in tests/test_validation.py
+ANSWERS = [
+    "\\frac{10}{2}",
+    "5",
+    "7 \\frac{3}{4}",
+    "7.75",
+    "3+4j",
+    "3",
+    "3.01",
+    "The expression is 4.3",
+    "The expression is 2 + 2.3",
+    "The expression is 2 + 2.1",
+]
+
+
+# Typical model answers: plain numbers dominate, then LaTeX, units and prose
+NORMALIZE_INPUTS = ANSWERS + [
+    "42",
+    "-17",
+    "3.14159",
+    "1,234,567",
+    "\\frac{3}{4}",
+    "\\sqrt2",
+    "\\left( 1, 2 \\right)",
+    "5 \\text{ cm}",
+    "12 feet",
+    "45^\\circ",
+    "\\$1.50",
+    "2 million",
+    "x \\in (0, 1)",
+    "7 3/4",
+]
+
+
+def compare_all_pairs(comparator: LLMAnswerComparator, answers: list[str]) -> None:
+    for a, b in itertools.combinations(answers, 2):
+        comparator._llm_answers_equivalent(a, b)
+
+
+def bench(cache_size: int, repeat: int) -> float:
+    """Returns the best time in seconds to compare all pairs with a fresh comparator."""
+    best = float("inf")
+    for _ in range(repeat):
+        comparator = LLMAnswerComparator(tolerance=1e-5, cache_size=cache_size)
+        started = time.perf_counter()
+        compare_all_pairs(comparator, ANSWERS)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_normalize(repeat: int, rounds: int = 200) -> float:
+    """Returns the best normalize_answer_string throughput in calls per second, without the memo."""
+    comparator = LLMAnswerComparator(tolerance=1e-5, cache_size=0)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for answer in NORMALIZE_INPUTS:
+                comparator.normalize_answer_string(answer)
+        best = min(best, time.perf_counter() - started)
+    return rounds * len(NORMALIZE_INPUTS) / best
+
+
+# The unique answers of a question where the samples disagree numerically
+NUMERIC_ANSWERS = [str(value) for value in range(40)] + [f"{value}.5" for value in range(20)]
+
+
+def bench_bulk(repeat: int) -> tuple[float, float]:
+    """Returns the best times in seconds to resolve the cheap stages of all pairs, pair by pair and in bulk."""
+    comparator = LLMAnswerComparator(tolerance=1e-5)
+    pairwise = bulk = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for a, b in itertools.combinations(NUMERIC_ANSWERS, 2):
+            comparator._cheap_stages(a, b)
+        pairwise = min(pairwise, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        comparator.bulk_compare(NUMERIC_ANSWERS)
+        bulk = min(bulk, time.perf_counter() - started)
+    return pairwise, bulk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant; the best is reported")
+    args = parser.parse_args()
+
+    pairs = len(ANSWERS) * (len(ANSWERS) - 1) // 2
+    # Warm up sympy's parsers so neither variant pays for the imports
+    bench(256, 1)
+
+    uncached = bench(0, args.repeat)
+    cached = bench(256, args.repeat)
+    print(f"{len(ANSWERS)} answers, {pairs} pairs")
+    print(f"without memo: {uncached * 1000:8.1f} ms")
+    print(f"with memo:    {cached * 1000:8.1f} ms  ({uncached / cached:.1f}x)")
+    print(f"normalize_answer_string: {bench_normalize(args.repeat):,.0f} calls/s")
+    pairwise, bulk = bench_bulk(args.repeat)
+    print(f"{len(NUMERIC_ANSWERS)} numeric answers, pair by pair: {pairwise * 1000:6.2f} ms")
+    print(f"{len(NUMERIC_ANSWERS)} numeric answers, bulk:         {bulk * 1000:6.2f} ms  ({pairwise / bulk:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+The Celery app, without its tasks.
+
+The web process only enqueues tasks, by name (see `JobScheduler`), and reads their
+results, so it imports this module rather than `backend.task`, which pulls in the
+whole generation pipeline (model clients, PDF scanning, sympy). The workers load
+the tasks through `include`.
+"""
+import os
+
+from celery import Celery
+from dotenv import load_dotenv
+
+# Registered task names, for enqueueing a task without importing its module
+GENERATE_EXAM_TASK = 'backend.task.generate_exam_task'
+GENERATE_AND_SAVE_EXAM_TASK = 'backend.task.generate_and_save_exam_task'
+
+load_dotenv()
+celery = Celery(
+    "task",
+    broker=os.environ.get("REDIS_URL"),
+    backend=os.environ.get("REDIS_URL"),
+    broker_use_ssl={"ssl_cert_reqs": "CERT_NONE"},  # Use CERT_NONE instead of "NONE"
+    include=["backend.task"]
+)
+
+celery.conf.update(
+    worker_disable_remote_control=True,
+    # No time limits: the threads pool the workers use does not enforce them, so the
+    # tasks put deadlines on their model calls instead (see `backend.task`)
+    result_expires=3600,
+    # Each pipeline stage has its own queue so its workers can be scaled independently
+    # (see supervisord.conf). The work is network-bound, so workers use the threads pool.
+    task_default_queue='generate',
+    task_routes={
+        GENERATE_EXAM_TASK: {'queue': 'generate'},
+        GENERATE_AND_SAVE_EXAM_TASK: {'queue': 'generate'},
+        'backend.task.plan_questions_task': {'queue': 'generate'},
+        'backend.task.generate_pdf_questions_task': {'queue': 'generate'},
+        'backend.task.scan_pdf_task': {'queue': 'scan'},
+        'backend.task.answer_question_task': {'queue': 'answer'},
+        'backend.task.assemble_exam_task': {'queue': 'persist'},
+        'backend.task.refill_question_bank_task': {'queue': 'refill'},
+        'backend.task.purge_refresh_tokens_task': {'queue': 'persist'},
+        'backend.task.sweep_job_scheduler_task': {'queue': 'persist'},
+    },
+    # Tasks take seconds to minutes, so a worker only reserves what it is running, and a
+    # task is only acknowledged once it finishes so a lost worker's tasks are redelivered.
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    beat_schedule={
+        'purge-refresh-tokens': {
+            'task': 'backend.task.purge_refresh_tokens_task',
+            'schedule': float(os.environ.get("REFRESH_TOKEN_SWEEP_INTERVAL", 3600)),
+        },
+        'sweep-job-scheduler': {
+            'task': 'backend.task.sweep_job_scheduler_task',
+            'schedule': float(os.environ.get("SCHEDULER_SWEEP_INTERVAL", 15)),
+        },
+    }
+)
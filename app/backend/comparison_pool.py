@@ -0,0 +1,237 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ComparisonError(Exception):
+    """Exception raised when a pooled computation does not complete: it raised, ran past its deadline or its worker died."""
+    pass
+
+
+def _worker_main(conn, warm_modules: tuple[str, ...], max_memory_kb: int, max_cpu_seconds: float) -> None:
+    # Imports done before the first job, so no job pays for them
+    for module in warm_modules:
+        importlib.import_module(module)
+    conn.send('ready')
+
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            outcome = ('ok', fn(*args))
+        except Exception as e:
+            outcome = ('error', f"{type(e).__name__}: {e}")
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        exhausted = usage.ru_maxrss > max_memory_kb or usage.ru_utime + usage.ru_stime > max_cpu_seconds
+        conn.send(outcome + (exhausted,))
+        if exhausted:
+            return
+
+
+class _Worker:
+    def __init__(self, context, warm_modules, max_memory_kb, max_cpu_seconds):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, warm_modules, max_memory_kb, max_cpu_seconds),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.ready = False
+
+    def wait_ready(self, timeout: float) -> None:
+        if not self.ready:
+            if not self.conn.poll(timeout):
+                raise ComparisonError("Comparison worker did not start in time")
+            self.conn.recv()
+            self.ready = True
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ComparisonPool:
+    """
+    A pool of worker processes that run CPU-bound computations with a deadline.
+
+    Symbolic comparisons (sympy `simplify`, `N`, ...) of a pathological answer can run
+    for minutes. Running them in a worker process keeps them off the event loop and the
+    GIL, and a computation that misses its deadline is stopped by killing its worker,
+    which a thread could not be. Workers are started (and `warm_modules` imported) when
+    the pool is created, and replaced after `max_tasks` computations or once they have
+    used `max_memory_mb` of memory or `max_cpu_seconds` of CPU time, so leaks and caches
+    in long-lived workers stay bounded. A worker that cannot be replaced leaves an empty
+    slot in the pool, which is filled by the next computation that takes it.
+
+    `run` blocks the calling thread; call it through `asyncio.to_thread` from async code.
+    """
+
+    def __init__(self,
+                 max_workers: int = 2,
+                 timeout: float = 5.0,
+                 max_tasks: int = 500,
+                 max_memory_mb: int = 512,
+                 max_cpu_seconds: float = 600.0,
+                 warm_modules: tuple[str, ...] = (),
+                 start_timeout: float = 60.0,
+                 acquire_timeout: float = 60.0):
+        """
+        Starts the worker processes.
+
+        Args:
+            max_workers (int): Number of worker processes.
+            timeout (float): Default seconds a computation may run before it is stopped.
+            max_tasks (int): Computations after which a worker is replaced.
+            max_memory_mb (int): Peak resident memory after which a worker is replaced.
+            max_cpu_seconds (float): CPU time after which a worker is replaced.
+            warm_modules (tuple[str, ...]): Modules each worker imports before taking work.
+            start_timeout (float): Seconds a worker may take to start.
+            acquire_timeout (float): Seconds a computation may wait for a free worker.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.max_memory_kb = max_memory_mb * 1024
+        self.max_cpu_seconds = max_cpu_seconds
+        self.warm_modules = tuple(warm_modules)
+        self.start_timeout = start_timeout
+        self.acquire_timeout = acquire_timeout
+
+        # Spawned rather than forked, since the pool is created in multi-threaded workers
+        self._context = multiprocessing.get_context("spawn")
+        # Idle workers, and None for slots whose worker has to be started
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {'completed': 0, 'timeouts': 0, 'crashes': 0, 'recycled': 0}
+        for _ in range(max_workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.warm_modules, self.max_memory_kb, self.max_cpu_seconds)
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """
+        Runs `fn(*args)` in a worker process and returns its result.
+
+        Args:
+            fn (Callable): A module-level (picklable) function.
+            *args: Its picklable arguments.
+            timeout (Optional[float]): Seconds the computation may run; defaults to the pool's timeout.
+
+        Returns:
+            The return value of `fn`.
+
+        Raises:
+            ComparisonError: `fn` raised, the computation ran past its deadline, its worker
+                             died or did not start, or no worker became free in time.
+            RuntimeError: The pool is shut down.
+        """
+        if self._closed:
+            raise RuntimeError("The comparison pool is shut down")
+        timeout = self.timeout if timeout is None else timeout
+
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise ComparisonError(f"No comparison worker became free within {self.acquire_timeout}s")
+        # The worker is replaced unless the computation completes
+        replace = True
+        try:
+            if worker is None:
+                worker = self._spawn()
+            worker.wait_ready(self.start_timeout)
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(timeout):
+                self._count('timeouts')
+                raise ComparisonError(f"Computation did not finish within {timeout}s")
+
+            status, value, exhausted = worker.conn.recv()
+            worker.tasks += 1
+            self._count('completed')
+            replace = exhausted or worker.tasks >= self.max_tasks
+            if replace:
+                self._count('recycled')
+            if status == 'error':
+                raise ComparisonError(f"Computation raised {value}")
+            return value
+        except (EOFError, OSError) as e:
+            self._count('crashes')
+            raise ComparisonError("Comparison worker died") from e
+        finally:
+            if replace:
+                worker = self._replace(worker)
+            self._idle.put(worker)
+
+    def _replace(self, worker: Optional[_Worker]) -> Optional[_Worker]:
+        """Stops a worker and starts its replacement, or returns None if that fails."""
+        try:
+            if worker is not None:
+                worker.stop()
+            return self._spawn()
+        except Exception:
+            logger.exception("Could not replace a comparison worker")
+            return None
+
+    def stats(self) -> dict:
+        """Returns the numbers of completed, timed out and crashed computations and of recycled workers."""
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes once their computations in progress have finished."""
+        self._closed = True
+        for _ in range(self.max_workers):
+            worker = self._idle.get()
+            if worker is not None:
+                worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def comparison_pool() -> ComparisonPool:
+    """
+    Returns the comparison pool of this process, starting it on first use.
+
+    The pool is configured from `COMPARISON_POOL_WORKERS`, `COMPARISON_TIMEOUT`,
+    `COMPARISON_WORKER_MAX_TASKS`, `COMPARISON_WORKER_MAX_MEMORY_MB` and
+    `COMPARISON_WORKER_MAX_CPU_SECONDS`, and its workers pre-import `backend.validation`
+    and the sympy modules it imports lazily.
+
+    Returns:
+        ComparisonPool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            env = os.environ.get
+            _pool = ComparisonPool(
+                max_workers=int(env("COMPARISON_POOL_WORKERS", 2)),
+                timeout=float(env("COMPARISON_TIMEOUT", 5)),
+                max_tasks=int(env("COMPARISON_WORKER_MAX_TASKS", 500)),
+                max_memory_mb=int(env("COMPARISON_WORKER_MAX_MEMORY_MB", 512)),
+                max_cpu_seconds=float(env("COMPARISON_WORKER_MAX_CPU_SECONDS", 600)),
+                warm_modules=("backend.validation", "sympy", "sympy.parsing.sympy_parser", "sympy.parsing.latex")
+            )
+        return _pool
@@ -109,9 +109,13 @@ class DataAccessObject(ABC):
     ) -> None:
         """Insert the given refresh token into the database.
 
+        Callers store the fixed-size SHA-256 digest of the token rather than
+        the token itself, so that lookups go through a compact index and a
+        leaked table does not expose usable tokens.
+
         Args:
             user_id: The database id of the given user.
-            token: The value of the refresh token.
+            token: The stored value of the refresh token (its digest).
             expires_at: The expiry time of the token.
 
         Raises:
@@ -159,6 +163,31 @@ class DataAccessObject(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def delete_expired_refresh_tokens(self,
+        before: datetime,
+        batch_size: int = 1000
+    ) -> int:
+        """Delete one batch of refresh tokens that expired before the given
+        time or have been revoked.
+
+        Deleting in bounded batches keeps each transaction short, so a
+        sweeper can call this repeatedly until it returns fewer than
+        batch_size rows.
+
+        Args:
+            before: Tokens expiring before this time are deleted.
+            batch_size: The maximum number of tokens deleted by this call.
+
+        Returns:
+            The number of deleted tokens.
+
+        Raises:
+            DatabaseError: An error related to the database occurred.
+            DataError: An error related to the processed data occurred.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def set_oauth_id(self, user_id: str, oauth_id: str) -> None:
         """Set the oauth_id of the user given by the user_id to the
@@ -424,6 +453,86 @@ class DataAccessObject(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def add_bank_questions(self,
+        source: str,
+        questions: list[tuple[str, dict[str, float]]]
+    ) -> int:
+        """Add generated questions and their answers to the question bank
+        of a source PDF. Questions already in the bank of the source are
+        skipped.
+
+        Args:
+            source: The SHA-256 hex digest of the source PDF.
+            questions: (question, answers) pairs, where answers maps each
+                       answer to its confidence.
+
+        Returns:
+            The number of questions added.
+
+        Raises:
+            DatabaseError: An error related to the database occurred.
+            DataError: An error related to the processed data occurred.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_bank_questions(self,
+        source: str,
+        count: int
+    ) -> list[tuple[str, dict[str, float]]]:
+        """Draw up to count unused questions from the question bank of a
+        source PDF and mark them as used, so that no other exam draws them.
+
+        Args:
+            source: The SHA-256 hex digest of the source PDF.
+            count: The maximum number of questions to draw.
+
+        Returns:
+            The drawn (question, answers) pairs.
+
+        Raises:
+            DatabaseError: An error related to the database occurred.
+            DataError: An error related to the processed data occurred.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def return_bank_questions(self,
+        source: str,
+        questions: list[str]
+    ) -> int:
+        """Return questions drawn with take_bank_questions to the question
+        bank of a source PDF, so that later exams can draw them again.
+
+        Args:
+            source: The SHA-256 hex digest of the source PDF.
+            questions: The drawn questions.
+
+        Returns:
+            The number of questions returned.
+
+        Raises:
+            DatabaseError: An error related to the database occurred.
+            DataError: An error related to the processed data occurred.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_bank_questions(self, source: str) -> int:
+        """Count the unused questions in the question bank of a source PDF.
+
+        Args:
+            source: The SHA-256 hex digest of the source PDF.
+
+        Returns:
+            The number of unused questions.
+
+        Raises:
+            DatabaseError: An error related to the database occurred.
+        """
+        raise NotImplementedError
+
 class DatabaseError(Exception):
     """Exception raised for errors that are related to the database."""
     pass
@@ -15,13 +15,17 @@ CREATE TABLE IF NOT EXISTS "User" (
 CREATE TABLE IF NOT EXISTS "RefreshToken" (
     id SERIAL PRIMARY KEY,  -- Changed INTEGER to SERIAL
     user_id INTEGER,  -- Renamed 'user' to 'user_id' to avoid keyword conflict
-    token TEXT NOT NULL UNIQUE,
+    token TEXT NOT NULL UNIQUE,  -- SHA-256 hex digest of the token
     revoked BOOLEAN DEFAULT FALSE,  -- Changed INTEGER to BOOLEAN
     expires_at TIMESTAMP NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES "User"(id)
 );
 
+-- used by the expired token sweeper and by account deletion
+CREATE INDEX IF NOT EXISTS refresh_token_expires_at_idx ON "RefreshToken" (expires_at);
+CREATE INDEX IF NOT EXISTS refresh_token_user_id_idx ON "RefreshToken" (user_id);
+
 CREATE TABLE IF NOT EXISTS "Exam" (
     examId SERIAL PRIMARY KEY,  -- Changed INTEGER to SERIAL
     name TEXT NOT NULL,
@@ -56,4 +60,17 @@ CREATE TABLE IF NOT EXISTS "Favourite" (
     PRIMARY KEY (userId, examId),  -- Changed UNIQUE constraint to PRIMARY KEY
     FOREIGN KEY (userId) REFERENCES "User"(id),
     FOREIGN KEY (examId) REFERENCES "Exam"(examId)
-); 
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS "QuestionBank" (
+    id SERIAL PRIMARY KEY,
+    source TEXT NOT NULL,  -- SHA-256 hex digest of the source PDF
+    question TEXT NOT NULL,
+    answers TEXT NOT NULL,  -- JSON object mapping each answer to its confidence
+    used BOOLEAN DEFAULT FALSE,  -- set once the question is drawn into an exam
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (source, question)
+);
+
+-- used to draw and count the unused questions of a source
+CREATE INDEX IF NOT EXISTS question_bank_unused_idx ON "QuestionBank" (source) WHERE used = FALSE;
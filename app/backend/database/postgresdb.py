@@ -1,6 +1,7 @@
 import psycopg2
 from psycopg2 import pool
 import datetime
+import json
 from typing import Optional
 import time
 import logging
@@ -348,6 +349,29 @@ class PostgresDB(DataAccessObject):
             self._release_conn(conn)
     
 
+    def delete_expired_refresh_tokens(self,
+                                      before: datetime.datetime,
+                                      batch_size: int = 1000) -> int:
+        """Delete one batch of expired or revoked refresh tokens."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                'DELETE FROM "RefreshToken" WHERE id IN ('
+                'SELECT id FROM "RefreshToken" '
+                'WHERE expires_at < %s OR revoked = TRUE LIMIT %s);',
+                (before, batch_size)
+            )
+            deleted = cur.rowcount
+            conn.commit()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            raise DatabaseError(f"Error deleting expired refresh tokens: {str(e)}")
+        finally:
+            self._release_conn(conn)
+    
+
     def set_oauth_id(self, user_id: str, oauth_id: str) -> None:
         """Set the OAuth ID for a user."""
         conn = self._get_conn()
@@ -792,4 +816,90 @@ class PostgresDB(DataAccessObject):
         except Exception as e:
             raise DatabaseError(f"Error checking favourite status: {str(e)}")
         finally:
-            self._release_conn(conn) 
\ No newline at end of file
+            self._release_conn(conn) 
+    
+
+    def add_bank_questions(self,
+                           source: str,
+                           questions: list[tuple[str, dict[str, float]]]) -> int:
+        """Add generated questions to the question bank of a source PDF."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            added = 0
+            for question, answers in questions:
+                cur.execute(
+                    'INSERT INTO "QuestionBank" (source, question, answers) '
+                    'VALUES (%s, %s, %s) ON CONFLICT (source, question) DO NOTHING;',
+                    (source, question, json.dumps(answers))
+                )
+                added += cur.rowcount
+            conn.commit()
+            return added
+        except Exception as e:
+            conn.rollback()
+            raise DatabaseError(f"Error adding bank questions: {str(e)}")
+        finally:
+            self._release_conn(conn)
+    
+
+    def take_bank_questions(self,
+                            source: str,
+                            count: int) -> list[tuple[str, dict[str, float]]]:
+        """Draw unused questions from the question bank of a source PDF and mark them as used."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            # SKIP LOCKED lets concurrent jobs over the same source draw disjoint questions
+            cur.execute(
+                'UPDATE "QuestionBank" SET used = TRUE WHERE id IN ('
+                'SELECT id FROM "QuestionBank" WHERE source = %s AND used = FALSE '
+                'ORDER BY random() LIMIT %s FOR UPDATE SKIP LOCKED) '
+                'RETURNING question, answers;',
+                (source, count)
+            )
+            rows = cur.fetchall()
+            conn.commit()
+            return [(question, json.loads(answers)) for question, answers in rows]
+        except Exception as e:
+            conn.rollback()
+            raise DatabaseError(f"Error taking bank questions: {str(e)}")
+        finally:
+            self._release_conn(conn)
+    
+
+    def return_bank_questions(self,
+                              source: str,
+                              questions: list[str]) -> int:
+        """Mark drawn questions of a source PDF as unused again."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                'UPDATE "QuestionBank" SET used = FALSE WHERE source = %s AND question = ANY(%s);',
+                (source, list(questions))
+            )
+            conn.commit()
+            return cur.rowcount
+        except Exception as e:
+            conn.rollback()
+            raise DatabaseError(f"Error returning bank questions: {str(e)}")
+        finally:
+            self._release_conn(conn)
+    
+
+    def count_bank_questions(self, source: str) -> int:
+        """Count the unused questions in the question bank of a source PDF."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                'SELECT COUNT(*) FROM "QuestionBank" WHERE source = %s AND used = FALSE;',
+                (source,)
+            )
+            return cur.fetchone()[0]
+        except Exception as e:
+            raise DatabaseError(f"Error counting bank questions: {str(e)}")
+        finally:
+            self._release_conn(conn)
+
@@ -1,5 +1,6 @@
 import sqlite3
 import datetime
+import json
 
 from typing import Optional
 
@@ -169,6 +170,26 @@ class SQLiteDB(DataAccessObject):
             raise DataError from e
 
 
+    def delete_expired_refresh_tokens(self,
+        before: datetime,
+        batch_size: int = 1000
+    ) -> int:
+        try:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM RefreshToken "
+                        "WHERE id IN (SELECT id FROM RefreshToken "
+                        "WHERE expires_at < ? OR revoked = TRUE LIMIT ?);",
+                        (before, batch_size))
+            self.conn.commit()
+            return cur.rowcount
+        except sqlite3.DatabaseError as e:
+            self.conn.rollback()
+            raise DatabaseError from e
+        except sqlite3.DataError as e:
+            self.conn.rollback()
+            raise DataError from e
+
+
     def set_oauth_id(self, user_id: str, oauth_id: str) -> None:
         try:
             cur = self.conn.cursor()
@@ -476,5 +497,80 @@ class SQLiteDB(DataAccessObject):
             raise DatabaseError("Database error occurred while checking favourite.") from e
 
 
+    def add_bank_questions(self,
+        source: str,
+        questions: list[tuple[str, dict[str, float]]]
+    ) -> int:
+        try:
+            cur = self.conn.cursor()
+            added = 0
+            for question, answers in questions:
+                cur.execute("INSERT OR IGNORE INTO QuestionBank "
+                            "(source, question, answers) VALUES (?, ?, ?);",
+                            (source, question, json.dumps(answers)))
+                added += cur.rowcount
+            self.conn.commit()
+            return added
+        except sqlite3.DatabaseError as e:
+            self.conn.rollback()
+            raise DatabaseError from e
+        except sqlite3.DataError as e:
+            self.conn.rollback()
+            raise DataError from e
+
+
+    def take_bank_questions(self,
+        source: str,
+        count: int
+    ) -> list[tuple[str, dict[str, float]]]:
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT id, question, answers FROM QuestionBank "
+                        "WHERE source = ? AND used = FALSE "
+                        "ORDER BY random() LIMIT ?;", (source, count))
+            rows = cur.fetchall()
+            cur.executemany("UPDATE QuestionBank SET used = TRUE WHERE id = ?;",
+                            [(row[0],) for row in rows])
+            self.conn.commit()
+            return [(question, json.loads(answers)) for _, question, answers in rows]
+        except sqlite3.DatabaseError as e:
+            self.conn.rollback()
+            raise DatabaseError from e
+        except sqlite3.DataError as e:
+            self.conn.rollback()
+            raise DataError from e
+
+
+    def return_bank_questions(self,
+        source: str,
+        questions: list[str]
+    ) -> int:
+        try:
+            cur = self.conn.cursor()
+            returned = 0
+            for question in questions:
+                cur.execute("UPDATE QuestionBank SET used = FALSE "
+                            "WHERE source = ? AND question = ?;", (source, question))
+                returned += cur.rowcount
+            self.conn.commit()
+            return returned
+        except sqlite3.DatabaseError as e:
+            self.conn.rollback()
+            raise DatabaseError from e
+        except sqlite3.DataError as e:
+            self.conn.rollback()
+            raise DataError from e
+
+
+    def count_bank_questions(self, source: str) -> int:
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM QuestionBank "
+                        "WHERE source = ? AND used = FALSE;", (source,))
+            return cur.fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise DatabaseError from e
+
+
 if __name__ == "__main__":
     db = SQLiteDB()
\ No newline at end of file
@@ -1,12 +1,18 @@
 import asyncio
+import hashlib
+import json
 import os
 import logging
+import time
 from dotenv import load_dotenv
 from typing import Callable, Optional
 
 import cohere
 from google import genai
-from google.genai.types import Part, GenerateContentConfig
+from google.genai.types import Part, GenerateContentConfig, CreateCachedContentConfig
+
+from backend import usage
+from backend.structured_output import salvage_json
 
 load_dotenv()
 
@@ -14,11 +20,20 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+def _token_count(value) -> int:
+    return int(value) if isinstance(value, (int, float)) else 0
+
+
 class ModelProvider:
     """
         Abstract base class for model providers that defines the interface
         and shared behavior for calling language models.
+
+        Every call is recorded with `usage.record_call` (latency, attempts, billed tokens
+        and outcome), attributed to the pipeline stage set with `usage.stage`.
     """
+    # The provider label of the usage records
+    provider = "base"
     def __init__(self, model: str, max_reties: int, timeout: float):
         self.model = model
         self.max_retries = max_reties
@@ -50,6 +65,90 @@ class ModelProvider:
         """
         raise NotImplementedError
 
+    def token_usage(self, response) -> tuple[int, int]:
+        """
+        Returns the input and output tokens billed for a response. Providers that
+        do not report token counts return zeros.
+
+        Args:
+            response: The raw API response.
+
+        Returns:
+            tuple[int, int]: The input and output token counts.
+        """
+        return 0, 0
+
+    async def call_model_n(self, prompt: str, n: int, preamble: Optional[str] = None, **kwargs) -> list[str]:
+        """
+        Samples `n` responses to the same prompt.
+
+        The default makes `n` concurrent `call_model` calls; providers that can return
+        several candidates from one request override this.
+
+        Args:
+            prompt (str): The user prompt.
+            n (int): The number of responses to sample.
+            preamble (Optional[str]): The system message to guide the model's behavior.
+            **kwargs: Further arguments for `call_model`.
+
+        Returns:
+            list[str]: The responses that were generated, at most `n`. Failed calls are left out.
+        """
+        results = await asyncio.gather(
+            *(self.call_model(prompt, preamble=preamble, **kwargs) for _ in range(n)),
+            return_exceptions=True
+        )
+        return [r for r in results if isinstance(r, str)]
+
+    def json_mode_kwargs(self, schema: dict) -> dict:
+        """
+        Returns the `call_model` keyword arguments that make the provider respond with JSON
+        matching the given schema. Providers without a JSON mode return no arguments.
+
+        Args:
+            schema (dict): The JSON schema of the response.
+
+        Returns:
+            dict: Keyword arguments for `call_model`.
+        """
+        return {}
+
+    async def call_model_json(self, prompt: str, schema: dict, preamble: Optional[str] = None, **kwargs):
+        """
+        Calls the model in the provider's JSON mode and parses the response.
+
+        A response that is not valid JSON is salvaged where possible (e.g. a list cut off
+        after some items keeps those items, see `salvage_json`), so it does not cost a new
+        generation. Only when nothing can be salvaged is the model asked once to repair its
+        response into valid JSON.
+
+        Args:
+            prompt (str): The user prompt.
+            schema (dict): The JSON schema of the response.
+            preamble (Optional[str]): The system message to guide the model's behavior.
+            **kwargs: Further arguments for `call_model`.
+
+        Returns:
+            The parsed JSON value, or None if the model gave no usable response.
+        """
+        response = await self.call_model(prompt, preamble=preamble, **self.json_mode_kwargs(schema), **kwargs)
+        if response is None:
+            return None
+
+        value, complete = salvage_json(response)
+        if value is not None:
+            if not complete:
+                logger.warning("Salvaged a partial JSON response from the model")
+            return value
+
+        repair_prompt = (
+            f"The following text was meant to be JSON matching this JSON schema:\n{json.dumps(schema)}\n\n"
+            f"Text:\n{response}\n\n"
+            f"Return only the corrected JSON."
+        )
+        repaired = await self.call_model(repair_prompt, preamble=preamble, temperature=0, **self.json_mode_kwargs(schema))
+        return salvage_json(repaired)[0]
+
     def load_pdf(self, pdf_path: str) -> str:
         """
         Loads a PDF from the given file path and converts it to a Part object
@@ -73,9 +172,27 @@ class ModelProvider:
 class GeminiModel(ModelProvider):
     """
     Gemini implementation of the ModelProvider, using Google's Gemini API.
+
+    The stable part of a request (the preamble, and the prompt when a PDF is sent along)
+    can be stored as Gemini cached content with `cache_prefix=True`, so repeated requests
+    are not billed for it in full. Content below the model's minimum cache size cannot be
+    cached; such requests are sent uncached.
     """
 
-    def __init__(self, model: str = "gemini-2.0-flash", max_retries: int = 5, timeout: float = 30.0):
+    provider = "gemini"
+
+    # Candidates per request accepted by the API
+    MAX_CANDIDATES = 8
+
+    # (model, prefix digest) -> (cached content name or None if it could not be cached, expiry time),
+    # shared by all instances since the cached content lives on the API side
+    _prefix_caches: dict[tuple[str, str], tuple[Optional[str], float]] = {}
+
+    def __init__(self,
+                 model: str = "gemini-2.0-flash",
+                 max_retries: int = 5,
+                 timeout: float = 30.0,
+                 cache_ttl: int = 3600):
         """
         Initializes the Gemini model with an API key and model selection.
 
@@ -83,16 +200,72 @@ class GeminiModel(ModelProvider):
             api_key (str): The API key for Gemini API.
             model (str): The specific Gemini model to use.
             timeout (float): Timeout in seconds for each API call attempt (default: 20s).
+            cache_ttl (int): Seconds cached prompt prefixes are kept by the API.
         """
         super().__init__(model, max_retries, timeout)
+        self.cache_ttl = cache_ttl
         self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
 
+    async def _cached_prefix(self, preamble: str, prefix: Optional[str]) -> Optional[str]:
+        """
+        Returns the name of the cached content holding the preamble and prompt prefix,
+        creating it on first use.
+
+        A prefix that cannot be cached (e.g. it is below the minimum cache size) is not
+        retried until `cache_ttl` has passed.
+
+        Args:
+            preamble (str): The system instruction.
+            prefix (Optional[str]): The prompt text preceding the variable content, if any.
+
+        Returns:
+            Optional[str]: The cached content name, or None if the request must be sent uncached.
+        """
+        digest = hashlib.sha256(f"{preamble}\0{prefix or ''}".encode("utf-8")).hexdigest()
+        key = (self.model, digest)
+        now = time.time()
+
+        entry = self._prefix_caches.get(key)
+        # Leave a margin so the content does not expire while the request is in flight
+        if entry is not None and entry[1] > now + 60:
+            return entry[0]
+
+        try:
+            cache = await asyncio.wait_for(
+                self.client.aio.caches.create(
+                    model=self.model,
+                    config=CreateCachedContentConfig(
+                        system_instruction=preamble,
+                        contents=[prefix] if prefix else None,
+                        ttl=f"{self.cache_ttl}s"
+                    )
+                ),
+                timeout=self.timeout
+            )
+            name = cache.name
+        except Exception as e:
+            logger.info(f"Sending the prompt uncached, it could not be cached: {e}")
+            name = None
+
+        self._prefix_caches[key] = (name, now + self.cache_ttl)
+        return name
+
+    def json_mode_kwargs(self, schema: dict) -> dict:
+        return {'response_mime_type': 'application/json', 'response_schema': schema}
+
+    def token_usage(self, response) -> tuple[int, int]:
+        metadata = getattr(response, 'usage_metadata', None)
+        if metadata is None:
+            return 0, 0
+        return _token_count(metadata.prompt_token_count), _token_count(metadata.candidates_token_count)
+
     async def call_model(self,
                          prompt: str,
                          preamble: Optional[str] = None,
                          pdf_data: Optional[bytes] = None,
                          pdf_path: Optional[str] = None,
                          accept_func: Callable = lambda x: True,
+                         cache_prefix: bool = False,
                          **kwargs) -> str:
         """
         Reads the PDF as raw bytes, wraps it in a Part to preserve the document's content,
@@ -101,67 +274,160 @@ class GeminiModel(ModelProvider):
         Args:
             pdf_path (str): The file path to the PDF document.
             prompt (str): The prompt to guide the Gemini API's text generation.
+            cache_prefix (bool): Whether to serve the preamble (and the prompt, when a PDF is
+                                 given) from cached content.
 
         Returns:
             str: The generated response text from the Gemini model.
         """
+        responses = await self._generate(prompt, preamble, pdf_data, pdf_path, accept_func, cache_prefix, 1, **kwargs)
+        return responses[0] if responses else None
+
+    async def call_model_n(self,
+                           prompt: str,
+                           n: int,
+                           preamble: Optional[str] = None,
+                           pdf_data: Optional[bytes] = None,
+                           pdf_path: Optional[str] = None,
+                           accept_func: Callable = lambda x: True,
+                           cache_prefix: bool = False,
+                           **kwargs) -> list[str]:
+        """
+        Samples `n` responses as candidates of as few requests as the API allows
+        (`MAX_CANDIDATES` per request), instead of one request per response.
+
+        Args:
+            prompt (str): The user prompt.
+            n (int): The number of responses to sample.
+            preamble (Optional[str]): The system message to guide the model's behavior.
+            accept_func (Callable): Validates each candidate; rejected candidates are left out.
+            **kwargs: Further arguments as for `call_model`.
+
+        Returns:
+            list[str]: The responses that were generated, at most `n`. Failed requests are left out.
+        """
+        batches = [min(self.MAX_CANDIDATES, n - start) for start in range(0, n, self.MAX_CANDIDATES)]
+        results = await asyncio.gather(
+            *(
+                self._generate(prompt, preamble, pdf_data, pdf_path, accept_func, cache_prefix, size, **kwargs)
+                for size in batches
+            ),
+            return_exceptions=True
+        )
+        return [text for batch in results if isinstance(batch, list) for text in batch]
+
+    async def _generate(self,
+                        prompt: str,
+                        preamble: Optional[str],
+                        pdf_data: Optional[bytes],
+                        pdf_path: Optional[str],
+                        accept_func: Callable,
+                        cache_prefix: bool,
+                        candidate_count: int,
+                        **kwargs) -> Optional[list[str]]:
         preamble = preamble if preamble is not None else self.default_preamble
 
+        # Generation settings belong in the request config rather than the request itself
+        config_fields = {
+            key: kwargs.pop(key)
+            for key in ('temperature', 'response_mime_type', 'response_schema')
+            if key in kwargs
+        }
+        if candidate_count > 1:
+            config_fields['candidate_count'] = candidate_count
+
         # if a PDF is being passed for extraction
+        pdf_part = None
         if pdf_path is not None:
             pdf_part = self.load_pdf(pdf_path)
             if pdf_part is None:
-                return 
-            kwargs['contents'] = [pdf_part, prompt]
+                return
         elif pdf_data is not None:
             try:
                 pdf_part = Part.from_bytes(data=pdf_data, mime_type="application/pdf")
-                kwargs['contents'] = [pdf_part, prompt]
             except Exception as e:
                 print(e)
                 return
             if pdf_part is None:
                 return
+
+        # With a PDF the prompt is the stable part of the request, otherwise only the preamble is
+        cached_content = await self._cached_prefix(preamble, prompt if pdf_part is not None else None) if cache_prefix else None
+        if cached_content is not None:
+            config = GenerateContentConfig(cached_content=cached_content, **config_fields)
+            kwargs['contents'] = [pdf_part] if pdf_part is not None else prompt
         else:
-            kwargs['contents'] = prompt
+            config = GenerateContentConfig(system_instruction=preamble, **config_fields)
+            kwargs['contents'] = [pdf_part, prompt] if pdf_part is not None else prompt
 
-        for _ in range(self.max_retries):
+        started = time.perf_counter()
+        tokens = [0, 0]
+        for attempt in range(1, self.max_retries + 1):
+            outcome = 'error'
             try:
                 response = await asyncio.wait_for(
                     self.client.aio.models.generate_content(
                         model=self.model,
-                        config=GenerateContentConfig(
-                            system_instruction=preamble
-                        ),
+                        config=config,
                         **kwargs
                     ),
                     timeout=self.timeout
                 )
-                assert accept_func(response.text), "Model returned an unacceptable response according to the accept function"
-                return response.text.strip()
+                tokens = [total + count for total, count in zip(tokens, self.token_usage(response))]
+                outcome = 'rejected'
+                if candidate_count == 1:
+                    texts = [response.text]
+                else:
+                    texts = [
+                        "".join(part.text for part in candidate.content.parts if part.text)
+                        for candidate in response.candidates or []
+                        if candidate.content and candidate.content.parts
+                    ]
+                texts = [text.strip() for text in texts if text is not None and accept_func(text)]
+                assert texts, "Model returned an unacceptable response according to the accept function"
+                usage.record_call(self.provider, self.model, time.perf_counter() - started, attempt, *tokens, 'success')
+                return texts
             except asyncio.TimeoutError:
+                outcome = 'timeout'
                 logger.warning(f"Gemini API call timed out after {self.timeout} seconds")
             except Exception as e:
                 print(e)
+        usage.record_call(self.provider, self.model, time.perf_counter() - started, self.max_retries, *tokens, outcome)
 
 
 class Cohere(ModelProvider):
     """
     Cohere implementation of the ModelProvider, using Cohere's AsyncClient.
-    Note: Does not support PDF input.
+    Note: Does not support PDF input. The chat API has neither cached content nor
+    multiple candidates, so `cache_prefix` is ignored and `call_model_n` makes one
+    call per response.
     """
+    provider = "cohere"
+
     def __init__(self, model: str = 'command-a-03-2025', max_retries: int = 5, timeout: float = 10.0):
         super().__init__(model, max_retries, timeout)
         self.client = cohere.AsyncClient(os.environ.get("COHERE_API_KEY"))
 
-    async def call_model(self, prompt: str, preamble: Optional[str] = None, pdf_path: Optional[str] = None, accept_func: Callable = lambda x: True, **kwargs) -> str:
+    def json_mode_kwargs(self, schema: dict) -> dict:
+        return {'response_format': {'type': 'json_object', 'schema': schema}}
+
+    def token_usage(self, response) -> tuple[int, int]:
+        billed_units = getattr(getattr(response, 'meta', None), 'billed_units', None)
+        if billed_units is None:
+            return 0, 0
+        return _token_count(billed_units.input_tokens), _token_count(billed_units.output_tokens)
+
+    async def call_model(self, prompt: str, preamble: Optional[str] = None, pdf_path: Optional[str] = None, accept_func: Callable = lambda x: True, cache_prefix: bool = False, **kwargs) -> str:
 
         if pdf_path is not None:
             raise NotImplementedError("Cohere does not support PDFs")
 
         preamble = preamble if preamble is not None else self.default_preamble
 
-        for _ in range(self.max_retries):
+        started = time.perf_counter()
+        tokens = [0, 0]
+        for attempt in range(1, self.max_retries + 1):
+            outcome = 'error'
             try:
                 response = await asyncio.wait_for(
                     self.client.chat(
@@ -172,12 +438,17 @@ class Cohere(ModelProvider):
                     ),
                     timeout=self.timeout
                 )
+                tokens = [total + count for total, count in zip(tokens, self.token_usage(response))]
+                outcome = 'rejected'
                 assert accept_func(response.text), "Model returned an unacceptable response according to the accept function"
+                usage.record_call(self.provider, self.model, time.perf_counter() - started, attempt, *tokens, 'success')
                 return response.text.strip()
             except asyncio.TimeoutError:
+                outcome = 'timeout'
                 logger.warning(f"Cohere API call timed out after {self.timeout} seconds")
             except Exception as e:
                 print(e)
+        usage.record_call(self.provider, self.model, time.perf_counter() - started, self.max_retries, *tokens, outcome)
 
 
 if __name__ == "__main__":
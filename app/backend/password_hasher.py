@@ -0,0 +1,188 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusyError(Exception):
+    """Exception raised when the password hashing queue is full."""
+    pass
+
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash: str, password: str) -> bool:
+    return check_password_hash(pwhash, password)
+
+
+def _warm_up() -> None:
+    return None
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a dedicated, bounded process pool.
+
+    PBKDF2 is CPU-bound and holds the GIL, so running it inline pins the
+    waitress request threads during a login burst. The pool takes that work
+    off the request threads, but each admitted caller still waits on its
+    request thread for the result, so only `max_workers + max_queue` jobs are
+    admitted at a time; keep that well below the number of request threads.
+    Callers beyond that get a HasherBusyError at once instead of waiting.
+    """
+
+    def __init__(self,
+                 max_workers: int = 2,
+                 max_queue: int = 4,
+                 iterations: Optional[int] = None):
+        """
+        Initializes the pool and forks its worker processes.
+
+        Workers are forked immediately, while the web process is still
+        single-threaded, rather than lazily from a request thread.
+
+        Args:
+            max_workers (int): Number of hashing processes.
+            max_queue (int): Number of jobs that may wait for a free process.
+            iterations (Optional[int]): PBKDF2 cost factor for newly hashed passwords; werkzeug's
+                                        default if None. Existing hashes keep verifying
+                                        with the cost they were created with.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.method = "pbkdf2:sha256" if iterations is None else f"pbkdf2:sha256:{iterations}"
+
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            'completed': 0,
+            'rejected': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+        }
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("fork")
+        )
+        self._executor.submit(_warm_up).result()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning("Password hashing queue is full, rejecting request")
+            raise HasherBusyError("Password hashing queue is full")
+
+        with self._lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                self._stats['completed'] += 1
+                self._stats['total_latency'] += latency
+                self._stats['max_latency'] = max(self._stats['max_latency'], latency)
+            self._slots.release()
+            logger.debug(f"Password hash job took {latency:.3f}s, queue depth {self.queue_depth()}")
+
+    def hash(self, password: str) -> str:
+        """
+        Hashes a password with the configured cost factor.
+
+        Args:
+            password (str): The plaintext password.
+
+        Returns:
+            str: The werkzeug formatted password hash.
+
+        Raises:
+            HasherBusyError: The queue is full.
+        """
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        """
+        Checks a password against a stored hash.
+
+        Args:
+            pwhash (str): The stored werkzeug password hash.
+            password (str): The plaintext password to check.
+
+        Returns:
+            bool: True if the password matches.
+
+        Raises:
+            HasherBusyError: The queue is full.
+        """
+        return self._run(_verify, pwhash, password)
+
+    def queue_depth(self) -> int:
+        """Returns the number of jobs waiting for a free hashing process."""
+        return max(0, self._in_flight - self.max_workers)
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of the pool metrics.
+
+        Returns:
+            dict: In-flight jobs, queue depth, completed and rejected job counts,
+                  and the average and maximum latency (queueing included) in seconds.
+        """
+        with self._lock:
+            completed = self._stats['completed']
+            return {
+                'in_flight': self._in_flight,
+                'queue_depth': max(0, self._in_flight - self.max_workers),
+                'completed': completed,
+                'rejected': self._stats['rejected'],
+                'total_latency': self._stats['total_latency'],
+                'avg_latency': self._stats['total_latency'] / completed if completed else 0.0,
+                'max_latency': self._stats['max_latency'],
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        Renders the pool metrics of this process in the Prometheus text exposition format.
+
+        Returns:
+            str: The `password_hash_in_flight` and `password_hash_queue_depth` gauges, the
+                 `password_hash_rejected_total` counter, the `password_hash_latency_seconds`
+                 summary (sum and count) and the `password_hash_latency_seconds_max` gauge.
+        """
+        stats = self.stats()
+        lines = [
+            "# HELP password_hash_in_flight Password hash jobs running or queued.",
+            "# TYPE password_hash_in_flight gauge",
+            f"password_hash_in_flight {stats['in_flight']}",
+            "# HELP password_hash_queue_depth Password hash jobs waiting for a free process.",
+            "# TYPE password_hash_queue_depth gauge",
+            f"password_hash_queue_depth {stats['queue_depth']}",
+            "# HELP password_hash_rejected_total Password hash jobs rejected because the queue was full.",
+            "# TYPE password_hash_rejected_total counter",
+            f"password_hash_rejected_total {stats['rejected']}",
+            "# HELP password_hash_latency_seconds Password hash job latency, queueing included.",
+            "# TYPE password_hash_latency_seconds summary",
+            f"password_hash_latency_seconds_sum {stats['total_latency']}",
+            f"password_hash_latency_seconds_count {stats['completed']}",
+            "# HELP password_hash_latency_seconds_max Highest password hash job latency.",
+            "# TYPE password_hash_latency_seconds_max gauge",
+            f"password_hash_latency_seconds_max {stats['max_latency']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def shutdown(self) -> None:
+        """Stops the worker processes."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,95 @@
+import json
+import logging
+import time
+from typing import Callable, Iterator
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
+
+
+def channel_for(task_id: str) -> str:
+    """Returns the Redis pub/sub channel carrying progress events for a task."""
+    return f"task-progress:{task_id}"
+
+
+def publish_progress(redis_client: redis.Redis, task_id: str, state: str, result) -> None:
+    """
+    Publishes a task state change to the task's progress channel.
+
+    The event has the same shape as the `/api/task/<task_id>` response
+    (`{'state': ..., 'result': ...}`), so clients can treat streamed events
+    and polled responses alike. Publishing is best effort: a Redis error is
+    logged and never fails the task.
+
+    Args:
+        redis_client: The Redis client to publish with.
+        task_id: The id of the task.
+        state: The Celery state (e.g. 'PROGRESS', 'SUCCESS', 'FAILURE').
+        result: The JSON serializable progress metadata or task result.
+    """
+    try:
+        redis_client.publish(channel_for(task_id), json.dumps({'state': state, 'result': result}))
+    except (redis.RedisError, TypeError) as e:
+        logger.warning(f"Could not publish progress for task {task_id}: {e}")
+
+
+def format_event(payload: dict) -> str:
+    """Formats a payload as a Server-Sent Events message."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def stream_progress(redis_client: redis.Redis,
+                    task_id: str,
+                    snapshot: Callable[[], dict],
+                    heartbeat: float = 15.0,
+                    max_duration: float = 60.0,
+                    reconnect: float = 1.0) -> Iterator[str]:
+    """
+    Yields Server-Sent Events for a task until it reaches a terminal state.
+
+    The channel is subscribed to before the current state is read, so that
+    no transition between the snapshot and the subscription is lost. A
+    comment line is sent every `heartbeat` seconds without events to keep
+    proxies from closing the connection.
+
+    An open stream holds a request thread, so it is closed after `max_duration`
+    seconds; clients reconnect `reconnect` seconds later (`EventSource` does so
+    on its own) and start again from the current state.
+
+    Args:
+        redis_client: The Redis client to subscribe with.
+        task_id: The id of the task.
+        snapshot: Returns the current `{'state', 'result'}` payload of the task.
+        heartbeat: Seconds of silence before a keep-alive comment is sent.
+        max_duration: Seconds after which the stream is closed regardless of state.
+        reconnect: Seconds the client waits before reconnecting to a closed stream.
+
+    Yields:
+        str: Server-Sent Events messages.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(channel_for(task_id))
+
+        yield f"retry: {int(reconnect * 1000)}\n\n"
+        current = snapshot()
+        yield format_event(current)
+        if current['state'] in TERMINAL_STATES:
+            return
+
+        deadline = time.monotonic() + max_duration
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=heartbeat)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            payload = json.loads(message['data'])
+            yield format_event(payload)
+            if payload['state'] in TERMINAL_STATES:
+                return
+    finally:
+        pubsub.close()
@@ -1,7 +1,16 @@
+from backend import usage
 from backend.models import ModelProvider, Cohere
+from backend.structured_output import string_list
 import asyncio
-import ast
-import ast
+import random
+
+QUESTIONS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'questions': {'type': 'array', 'items': {'type': 'string'}}
+    },
+    'required': ['questions']
+}
 
 
 async def generate_questions(questions: list[str], num_new_questions: int, model: ModelProvider) -> list[str]:
@@ -18,9 +27,9 @@ async def generate_questions(questions: list[str], num_new_questions: int, model
         list[str]: A list of newly generated questions. Returns an empty list if an error occurs.
 
     Notes:
-        - The prompt instructs the model to return only a raw Python list of strings.
-        - The response is evaluated using `ast.literal_eval()` for safety.
-        - The model must return valid Python syntax, or the function will catch and handle the exception.
+        - The model is called in its JSON mode and asked for a `{"questions": [...]}` object.
+        - Malformed responses are salvaged (or repaired once) by `ModelProvider.call_model_json`
+          instead of being regenerated, so a partial list still yields its complete questions.
     """
     try:
         assert len(questions) > 0, "Questions list cannot be empty"
@@ -32,21 +41,63 @@ async def generate_questions(questions: list[str], num_new_questions: int, model
             prompt_formatter += questions[i] + "\n"
 
         prompt_formatter += f"\nGenerate {num_new_questions} new questions that tackle the same mathematical concepts " \
-                            f"as the current questions provided. Return the questions as a Python list of strings. " \
-                            f"Just give me the list and nothing else. Do not include ```python or ``` in the response."
-        response = await model.call_model(
-            prompt_formatter,
-            temperature=1,
-            accept_func=lambda x: ast.literal_eval(x) is not None
-        )
+                            f"as the current questions provided. Return a JSON object whose \"questions\" key " \
+                            f"holds the list of new questions as strings, and nothing else."
+        with usage.stage('generate'):
+            response = await model.call_model_json(
+                prompt_formatter,
+                QUESTIONS_SCHEMA,
+                temperature=1
+            )
 
-        new_questions = ast.literal_eval(response)
-        return new_questions
+        return string_list(response, 'questions')
 
     except Exception as e:
         print(f"Error generating questions: {e}")
         return []
 
+async def generate_questions_within_budget(questions: list[str],
+                                          num_needed: int,
+                                          model: ModelProvider,
+                                          buffer: int = 1,
+                                          max_examples: int = 8,
+                                          max_rounds: int = 3) -> list[str]:
+    """
+    Generates at least `num_needed` new questions while asking the model for as few as possible.
+
+    Each request asks for the missing number of questions plus a small buffer, and shows the
+    model a random subset of at most `max_examples` example questions rather than all of them.
+    Duplicates, empty strings and copies of the examples are dropped, and further small
+    requests are made while too few valid questions have come back.
+
+    Args:
+        questions (list[str]): A list of existing questions to serve as examples.
+        num_needed (int): The number of new questions needed.
+        model (ModelProvider): An instance of a ModelProvider (e.g., Gemini or Cohere) used to generate questions.
+        buffer (int, optional): Extra questions requested per request to absorb invalid ones. Defaults to 1.
+        max_examples (int, optional): Maximum number of example questions per request. Defaults to 8.
+        max_rounds (int, optional): Maximum number of requests. Defaults to 3.
+
+    Returns:
+        list[str]: The valid new questions; at most `num_needed + buffer` per request, and fewer
+                   than `num_needed` if the requests did not return enough valid questions.
+    """
+    new_questions = []
+    seen = set(questions)
+
+    for _ in range(max_rounds):
+        missing = num_needed - len(new_questions)
+        if missing <= 0 or not questions:
+            break
+
+        examples = random.sample(questions, min(max_examples, len(questions)))
+        for question in await generate_questions(examples, missing + buffer, model):
+            if isinstance(question, str) and question.strip() and question not in seen:
+                seen.add(question)
+                new_questions.append(question)
+
+    return new_questions
+
 # ---------------------- Example Usage ----------------------
 if __name__ == "__main__":
     model = Cohere()
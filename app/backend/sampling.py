@@ -0,0 +1,127 @@
+import re
+
+# Features of questions whose sampled answers tend to disagree
+_NUMBER = re.compile(r"\d+(?:[.,/]\d+)*")
+_MATH = re.compile(r"\\[a-zA-Z]+|[+\-*/^=<>]")
+_STEP_WORDS = re.compile(
+    r"\b(?:then|after|before|each|every|total|remaining|left|if|how many|how much|"
+    r"probability|rate|per|percent|ratio|respectively|at least|at most|expected)\b",
+    re.IGNORECASE
+)
+_SENTENCE_END = re.compile(r"[.?!](?:\s|$)")
+
+# Weight of a question of difficulty 0 relative to the extra weight of difficulty 1, so
+# that easy questions still get a share of the spare budget
+_BASE_WEIGHT = 0.25
+
+
+def difficulty(question: str) -> float:
+    """
+    Estimates how likely sampled answers to a question are to disagree, from its text alone.
+
+    Long, multi-sentence word problems with many quantities and step words ("then",
+    "each", "remaining", ...) score high; a short expression to simplify scores low.
+
+    Args:
+        question (str): The question.
+
+    Returns:
+        float: The estimate, between 0 and 1.
+    """
+    words = len(question.split())
+    numbers = len(_NUMBER.findall(question))
+    operators = len(_MATH.findall(question))
+    steps = len(_STEP_WORDS.findall(question))
+    sentences = len(_SENTENCE_END.findall(question))
+
+    return (
+        0.3 * min(words / 60, 1)
+        + 0.25 * min(numbers / 6, 1)
+        + 0.1 * min(operators / 6, 1)
+        + 0.2 * min(steps / 4, 1)
+        + 0.15 * min(sentences / 4, 1)
+    )
+
+
+def plan_samples(questions: list[str], budget: int, minimum: int = 4, maximum: int = 16) -> list[int]:
+    """
+    Splits a budget of sampled answers between questions by their estimated difficulty.
+
+    Every question gets `minimum` samples (or an equal share of the budget, but at least
+    one, if it cannot pay for that), and the rest of the budget is shared in proportion to
+    difficulty, without giving any question more than `maximum`. The budget is used up
+    unless every question is at `maximum`.
+
+    Args:
+        questions (list[str]): The questions to answer.
+        budget (int): The total number of samples.
+        minimum (int): The number of samples each question gets before the budget is shared.
+        maximum (int): The most samples a question gets.
+
+    Returns:
+        list[int]: The number of samples of each question.
+    """
+    return _split_budget([difficulty(question) for question in questions], budget, minimum, maximum)
+
+
+def plan_budgets(examples: list[list[str]], counts: list[int], budget: int, minimum: int = 4, maximum: int = 16) -> list[int]:
+    """
+    Splits a budget of sampled answers between groups of questions that are not known yet,
+    such as the questions each PDF of an exam will generate.
+
+    The questions of a group are assumed to be as difficult, on average, as its example
+    questions, and the budget is split as `plan_samples` would split it between the
+    questions of all groups.
+
+    Args:
+        examples (list[list[str]]): The example questions of each group.
+        counts (list[int]): The number of questions of each group.
+        budget (int): The total number of samples.
+        minimum (int): The number of samples each question gets before the budget is shared.
+        maximum (int): The most samples a question gets.
+
+    Returns:
+        list[int]: The number of samples of each group.
+    """
+    groups = []
+    difficulties = []
+    for group, (group_examples, count) in enumerate(zip(examples, counts)):
+        estimate = sum(map(difficulty, group_examples)) / len(group_examples) if group_examples else 0.0
+        groups += [group] * count
+        difficulties += [estimate] * count
+
+    budgets = [0] * len(counts)
+    for group, samples in zip(groups, _split_budget(difficulties, budget, minimum, maximum)):
+        budgets[group] += samples
+    return budgets
+
+
+def _split_budget(difficulties: list[float], budget: int, minimum: int, maximum: int) -> list[int]:
+    """Splits a budget of samples between questions of the given difficulties (see `plan_samples`)."""
+    if not difficulties:
+        return []
+    n = len(difficulties)
+    counts = [min(minimum, maximum, max(1, budget // n))] * n
+    remaining = budget - sum(counts)
+    weights = [_BASE_WEIGHT + estimate for estimate in difficulties]
+
+    while remaining > 0:
+        open_questions = [i for i in range(n) if counts[i] < maximum]
+        if not open_questions:
+            break
+        total_weight = sum(weights[i] for i in open_questions)
+        shares = {i: remaining * weights[i] / total_weight for i in open_questions}
+
+        given = 0
+        for i in open_questions:
+            extra = min(int(shares[i]), maximum - counts[i])
+            counts[i] += extra
+            given += extra
+        remaining -= given
+
+        if given == 0:
+            # Every share is below one sample: the largest fractions get one each
+            for i in sorted(open_questions, key=lambda i: shares[i], reverse=True)[:remaining]:
+                counts[i] += 1
+            break
+    return counts
@@ -0,0 +1,297 @@
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+import redis
+from celery import Celery
+from kombu.utils.json import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusyError(Exception):
+    """Exception raised when a job cannot be admitted, e.g. the owner has too many pending jobs."""
+    pass
+
+
+def job_fingerprint(owner: str, pdf_data_list: list[bytes], *params) -> str:
+    """
+    Computes the idempotency fingerprint of a generation request.
+
+    Two requests with the same owner, the same PDF contents (in the same order)
+    and the same parameters have the same fingerprint.
+
+    Args:
+        owner: Identifies who submitted the request, e.g. "user:<id>" or "guest:<address>".
+        pdf_data_list: The uploaded PDF files.
+        *params: The remaining request parameters (number of questions, title, ...).
+
+    Returns:
+        str: The SHA-256 hex digest of the request.
+    """
+    digest = hashlib.sha256(owner.encode("utf-8"))
+    for pdf_data in pdf_data_list:
+        digest.update(hashlib.sha256(pdf_data).digest())
+    digest.update(dumps(list(params)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class JobScheduler:
+    """
+    Redis-backed admission queue for exam generation jobs.
+
+    Jobs are not sent to Celery on submission. Each owner (a user or a guest
+    address) has its own FIFO queue, and owners belong to a priority class
+    ("user" or "guest"). Whenever there is spare capacity, the next job is
+    picked by weighted round-robin over the classes and plain round-robin over
+    the owners of a class, so one owner submitting many jobs cannot delay
+    everyone behind them.
+
+    Capacity is bounded globally (`max_running`) and per owner (the class's
+    running limit). Jobs beyond an owner's running limit wait in its queue;
+    submissions beyond its pending limit (running and queued) are rejected.
+
+    The Celery task of a job is sent with the job id as its task id, so the
+    id returned on submission can be polled before and after dispatch.
+    Running jobs must be released with `release` when they finish, and
+    `sweep` releases jobs that never reported back.
+
+    A job submitted with a fingerprint is deduplicated: while the job is queued
+    or running, and for `dedupe_ttl` seconds after it succeeds, submitting the
+    same fingerprint returns the existing job id instead of a new job.
+    """
+
+    def __init__(self,
+                 redis_client: redis.Redis,
+                 celery_app: Celery,
+                 max_running: int = 8,
+                 weights: Optional[dict[str, int]] = None,
+                 running_limits: Optional[dict[str, int]] = None,
+                 pending_limits: Optional[dict[str, int]] = None,
+                 job_timeout: float = 1800.0,
+                 dedupe_ttl: int = 600,
+                 prefix: str = "sched"):
+        """
+        Args:
+            redis_client: The shared Redis client.
+            celery_app: The Celery app the jobs are sent with.
+            max_running: Maximum number of jobs running at once across all owners.
+            weights: Number of dispatch turns each class gets per round. Defaults to 2 for users and 1 for guests.
+            running_limits: Maximum number of running jobs per owner, by class.
+            pending_limits: Maximum number of running and queued jobs per owner, by class.
+            job_timeout: Seconds after which a running job that was never released is dropped by `sweep`.
+            dedupe_ttl: Seconds a finished job is still returned for a duplicate submission.
+            prefix: Key prefix for Redis entries.
+        """
+        self.redis_client = redis_client
+        self.celery_app = celery_app
+        self.max_running = max_running
+        self.weights = weights or {'user': 2, 'guest': 1}
+        self.running_limits = running_limits or {'user': 2, 'guest': 1}
+        self.pending_limits = pending_limits or {'user': 5, 'guest': 2}
+        self.job_timeout = job_timeout
+        self.dedupe_ttl = dedupe_ttl
+        self.prefix = prefix
+
+        # e.g. ['user', 'user', 'guest'] for the default weights
+        self._cycle = [cls for cls, weight in self.weights.items() for _ in range(weight)]
+
+    def _key(self, *parts) -> str:
+        return ":".join((self.prefix,) + tuple(str(part) for part in parts))
+
+    def _lock(self):
+        return self.redis_client.lock(self._key("lock"), timeout=30, blocking_timeout=5)
+
+    def _pending(self, owner: str) -> int:
+        return self.redis_client.llen(self._key("queue", owner)) + self.redis_client.zcard(self._key("running", owner))
+
+    def submit(self,
+               owner: str,
+               cls: str,
+               task_name: str,
+               args: tuple = (),
+               kwargs: Optional[dict] = None,
+               fingerprint: Optional[str] = None) -> str:
+        """
+        Queues a job for an owner and dispatches whatever the current capacity allows.
+
+        Args:
+            owner: Identifies whose job this is, e.g. "user:<id>" or "guest:<address>".
+            cls: The priority class of the owner ("user" or "guest").
+            task_name: The registered name of the Celery task to run.
+            args: Positional arguments of the task.
+            kwargs: Keyword arguments of the task.
+            fingerprint: The idempotency fingerprint of the request (see `job_fingerprint`).
+
+        Returns:
+            str: The job id, which is also the Celery task id once the job is dispatched,
+                 or the id of an existing job with the same fingerprint.
+
+        Raises:
+            SchedulerBusyError: The owner already has too many pending jobs, or the queue is locked.
+        """
+        job_id = str(uuid.uuid4())
+        try:
+            with self._lock():
+                if fingerprint is not None:
+                    existing = self.redis_client.get(self._key("dedupe", fingerprint))
+                    if existing is not None:
+                        return existing.decode() if isinstance(existing, bytes) else existing
+
+                if self._pending(owner) >= self.pending_limits.get(cls, 1):
+                    raise SchedulerBusyError("Too many exam generation jobs in progress, try again later.")
+
+                job = {
+                    'owner': owner,
+                    'task': task_name,
+                    'payload': dumps({'args': list(args), 'kwargs': kwargs or {}})
+                }
+                if fingerprint is not None:
+                    job['fingerprint'] = fingerprint
+                    # Kept until the job is released, then shortened to `dedupe_ttl`
+                    self.redis_client.set(self._key("dedupe", fingerprint), job_id, ex=int(self.job_timeout * 2))
+                self.redis_client.hset(self._key("job", job_id), mapping=job)
+                self.redis_client.rpush(self._key("queue", owner), job_id)
+                if self.redis_client.sadd(self._key("members", cls), owner):
+                    self.redis_client.rpush(self._key("ring", cls), owner)
+
+                self._dispatch()
+        except redis.exceptions.LockError as e:
+            raise SchedulerBusyError("The job queue is busy, try again later.") from e
+        return job_id
+
+    def release(self, job_id: str, failed: bool = False) -> None:
+        """
+        Marks a running job as finished and dispatches the next jobs. Releasing a job twice is harmless.
+
+        Args:
+            job_id: The id of the finished job.
+            failed: Whether the job failed. A failed job is not returned for duplicate
+                    submissions, so that retrying the request starts a new job.
+        """
+        try:
+            with self._lock():
+                if self._release(job_id, failed):
+                    self._dispatch()
+        except redis.exceptions.LockError:
+            logger.warning(f"Could not release job {job_id}, the sweep will release it")
+
+    def sweep(self) -> int:
+        """
+        Releases running jobs older than `job_timeout` and dispatches queued jobs.
+
+        This recovers capacity from jobs whose worker died before releasing them.
+
+        Returns:
+            int: The number of stale jobs released.
+        """
+        cutoff = time.time() - self.job_timeout
+        with self._lock():
+            stale = self.redis_client.zrangebyscore(self._key("running"), 0, cutoff)
+            for job_id in stale:
+                logger.warning(f"Releasing job {job_id} that did not finish within {self.job_timeout}s")
+                self._release(job_id, failed=True)
+            self._dispatch()
+        return len(stale)
+
+    def _release(self, job_id, failed: bool = False) -> bool:
+        if isinstance(job_id, bytes):
+            job_id = job_id.decode()
+        owner = self.redis_client.hget(self._key("job", job_id), 'owner')
+        fingerprint = self.redis_client.hget(self._key("job", job_id), 'fingerprint')
+        removed = self.redis_client.zrem(self._key("running"), job_id)
+        if owner is not None:
+            if isinstance(owner, bytes):
+                owner = owner.decode()
+            self.redis_client.zrem(self._key("running", owner), job_id)
+        if fingerprint is not None:
+            if isinstance(fingerprint, bytes):
+                fingerprint = fingerprint.decode()
+            if failed:
+                self.redis_client.delete(self._key("dedupe", fingerprint))
+            else:
+                self.redis_client.set(self._key("dedupe", fingerprint), job_id, ex=self.dedupe_ttl)
+        self.redis_client.delete(self._key("job", job_id))
+        return bool(removed)
+
+    def _dispatch(self) -> None:
+        # Must be called with the lock held
+        while self.redis_client.zcard(self._key("running")) < self.max_running:
+            job_id = self._next_job()
+            if job_id is None:
+                return
+
+            job = {
+                (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                for k, v in self.redis_client.hgetall(self._key("job", job_id)).items()
+            }
+            now = time.time()
+            self.redis_client.zadd(self._key("running"), {job_id: now})
+            self.redis_client.zadd(self._key("running", job['owner']), {job_id: now})
+            self.redis_client.hdel(self._key("job", job_id), 'payload')
+
+            payload = loads(job['payload'])
+            self.celery_app.send_task(job['task'], args=payload['args'], kwargs=payload['kwargs'], task_id=job_id)
+
+    def _next_job(self) -> Optional[str]:
+        cursor = int(self.redis_client.get(self._key("cursor")) or 0)
+        for offset in range(len(self._cycle)):
+            cls = self._cycle[(cursor + offset) % len(self._cycle)]
+            job_id = self._next_job_of_class(cls)
+            if job_id is not None:
+                self.redis_client.set(self._key("cursor"), cursor + offset + 1)
+                return job_id
+        return None
+
+    def _next_job_of_class(self, cls: str) -> Optional[str]:
+        ring = self._key("ring", cls)
+        for _ in range(self.redis_client.llen(ring)):
+            # Rotate the ring so the next owner of the class gets the following turn
+            owner = self.redis_client.lmove(ring, ring, 'LEFT', 'RIGHT')
+            if owner is None:
+                return None
+            if isinstance(owner, bytes):
+                owner = owner.decode()
+
+            if self.redis_client.zcard(self._key("running", owner)) >= self.running_limits.get(cls, 1):
+                continue
+
+            job_id = self.redis_client.lpop(self._key("queue", owner))
+            if self.redis_client.llen(self._key("queue", owner)) == 0:
+                self.redis_client.lrem(ring, 0, owner)
+                self.redis_client.srem(self._key("members", cls), owner)
+            if job_id is not None:
+                return job_id.decode() if isinstance(job_id, bytes) else job_id
+        return None
+
+
+def scheduler_from_env(redis_client: redis.Redis, celery_app: Celery) -> JobScheduler:
+    """
+    Creates a JobScheduler configured from the environment.
+
+    The web process and the workers both create one, so they must see the same settings:
+    `SCHEDULER_MAX_RUNNING`, `SCHEDULER_USER_WEIGHT`, `SCHEDULER_GUEST_WEIGHT`,
+    `SCHEDULER_USER_RUNNING`, `SCHEDULER_GUEST_RUNNING`, `SCHEDULER_USER_PENDING`,
+    `SCHEDULER_GUEST_PENDING`, `SCHEDULER_JOB_TIMEOUT` and `SCHEDULER_DEDUPE_TTL`.
+
+    Args:
+        redis_client: The shared Redis client.
+        celery_app: The Celery app the jobs are sent with.
+
+    Returns:
+        JobScheduler: The configured scheduler.
+    """
+    env = os.environ.get
+    return JobScheduler(
+        redis_client,
+        celery_app,
+        max_running=int(env("SCHEDULER_MAX_RUNNING", 8)),
+        weights={'user': int(env("SCHEDULER_USER_WEIGHT", 2)), 'guest': int(env("SCHEDULER_GUEST_WEIGHT", 1))},
+        running_limits={'user': int(env("SCHEDULER_USER_RUNNING", 2)), 'guest': int(env("SCHEDULER_GUEST_RUNNING", 1))},
+        pending_limits={'user': int(env("SCHEDULER_USER_PENDING", 5)), 'guest': int(env("SCHEDULER_GUEST_PENDING", 2))},
+        job_timeout=float(env("SCHEDULER_JOB_TIMEOUT", 1800)),
+        dedupe_ttl=int(env("SCHEDULER_DEDUPE_TTL", 600))
+    )
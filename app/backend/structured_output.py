@@ -0,0 +1,117 @@
+import ast
+import json
+import re
+from typing import Any, Optional
+
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_CLOSERS = {'[': ']', '{': '}'}
+
+
+def _strip_fences(text: str) -> str:
+    return _FENCE.sub("", text).strip()
+
+
+def _complete_prefix(text: str, start: int) -> Optional[str]:
+    """
+    Cuts truncated or malformed JSON back to its longest prefix that ends on a value boundary
+    and closes the containers still open there.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    best = None
+
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+            best = text[:i + 1] + "".join(_CLOSERS[c] for c in reversed(stack))
+        elif char in ']}':
+            if not stack or _CLOSERS[stack.pop()] != char:
+                break
+            best = text[:i + 1] + "".join(_CLOSERS[c] for c in reversed(stack))
+            if not stack:
+                break
+        elif char == ',' and stack:
+            # everything before a comma is a complete element (or key-value pair)
+            best = text[:i] + "".join(_CLOSERS[c] for c in reversed(stack))
+
+    return best[start:] if best is not None else None
+
+
+def salvage_json(text: Optional[str]) -> tuple[Any, bool]:
+    """
+    Parses the first JSON object or array in a model response, salvaging what it can.
+
+    Code fences and surrounding prose are ignored, Python literals (e.g. single-quoted
+    strings) are accepted, and a truncated or malformed response is cut back to its
+    complete elements, so a list cut off after three items still yields those items.
+
+    Args:
+        text (str): The model response.
+
+    Returns:
+        tuple: The parsed value (None if nothing could be parsed), and whether the whole
+               value was parsed (False if it was salvaged from a partial response).
+    """
+    if not text:
+        return None, False
+    text = _strip_fences(text)
+
+    starts = [i for i in (text.find('['), text.find('{')) if i != -1]
+    if not starts:
+        return None, False
+    start = min(starts)
+
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value, True
+    except json.JSONDecodeError:
+        pass
+
+    end = max(text.rfind(']'), text.rfind('}'))
+    if end > start:
+        try:
+            value = ast.literal_eval(text[start:end + 1])
+            if isinstance(value, (list, dict)):
+                return value, True
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+
+    prefix = _complete_prefix(text, start)
+    if prefix is not None:
+        try:
+            return json.loads(prefix), False
+        except json.JSONDecodeError:
+            pass
+    return None, False
+
+
+def string_list(value: Any, key: str) -> list[str]:
+    """
+    Extracts a list of non-empty strings from a parsed response, which is either the list
+    itself or an object holding it under `key`.
+
+    Args:
+        value (Any): The parsed response.
+        key (str): The key of the list in an object response.
+
+    Returns:
+        list[str]: The strings of the list; an empty list if there is none.
+    """
+    if isinstance(value, dict):
+        value = value.get(key)
+    if not isinstance(value, list):
+        return []
+    return [item.strip() for item in value if isinstance(item, str) and item.strip()]
@@ -1,165 +1,819 @@
 import os
 import asyncio
+import datetime
+import functools
+import hashlib
+import json
+import logging
 import math
 import random
-from celery import Celery
-from dotenv import load_dotenv
+import threading
 
+import redis
+from celery import Task, chord, group
+from celery.exceptions import Ignore, Retry
+from celery.signals import task_postrun, task_prerun, worker_ready
+
+from backend.celery_app import celery
 from backend.PdfScanner.GeminiPdfScanner import GeminiPDFScanner
 from backend.models import GeminiModel
 from backend.models import Cohere
 import backend.questionGenerator as questionGenerator
 import backend.answerGenerator as answerGenerator
 from backend.exam import Exam
+from backend import usage
+from backend.comparison_pool import comparison_pool
+from backend.validation import LLMAnswerComparator
+from backend.progress import publish_progress
+from backend.sampling import plan_budgets, plan_samples
+from backend.scheduler import scheduler_from_env
 
-load_dotenv()
-celery = Celery(
-    "task",
-    broker=os.environ.get("REDIS_URL"),
-    backend=os.environ.get("REDIS_URL"),
-    broker_use_ssl={"ssl_cert_reqs": "CERT_NONE"}  # Use CERT_NONE instead of "NONE"
-)
+logger = logging.getLogger(__name__)
+
+SCAN_CHECKPOINT_TTL = int(os.environ.get("SCAN_CHECKPOINT_TTL", 86400))
+PARTIAL_RESULTS_TTL = 3600
+# Number of unused, answered questions kept in the question bank of each source PDF
+QUESTION_BANK_TARGET = int(os.environ.get("QUESTION_BANK_TARGET", 10))
+# Extra questions requested per PDF beyond its share of the exam, to absorb invalid ones
+QUESTION_BUFFER = int(os.environ.get("QUESTION_BUFFER", 1))
+# Answers sampled per question on average; the budget of an exam is split between its
+# questions by estimated difficulty (see `backend.sampling`), within these bounds
+ANSWER_SAMPLES = int(os.environ.get("ANSWER_SAMPLES", 10))
+ANSWER_SAMPLES_MIN = int(os.environ.get("ANSWER_SAMPLES_MIN", 4))
+ANSWER_SAMPLES_MAX = int(os.environ.get("ANSWER_SAMPLES_MAX", 16))
+# Answers sampled first, the rest only being sampled if these disagree; 0 disables the first pass
+ANSWER_FIRST_PASS = int(os.environ.get("ANSWER_FIRST_PASS", 0))
+# Deadlines, in seconds, of the model calls of each stage. The workers use the threads
+# pool, which does not enforce Celery's time limits, so the stages enforce these instead.
+SCAN_DEADLINE = int(os.environ.get("SCAN_DEADLINE", 300))
+GENERATE_DEADLINE = int(os.environ.get("GENERATE_DEADLINE", 300))
+ANSWER_DEADLINE = int(os.environ.get("ANSWER_DEADLINE", 180))
+REFILL_DEADLINE = int(os.environ.get("REFILL_DEADLINE", 900))
+
+
+@functools.lru_cache(maxsize=None)
+def _db():
+    """Returns the database instance shared by the tasks of this worker."""
+    from backend.database.db_factory import get_db_instance
+    return get_db_instance()
+
+
+@worker_ready.connect
+def _prewarm_comparison_pool(**kwargs):
+    # Workers that compare answers start the sympy worker processes before their first task
+    if os.environ.get("COMPARISON_POOL_PREWARM") == "1":
+        comparison_pool()
+
+
+# The event loop and the models of each worker thread. Model clients keep pools of HTTP
+# connections bound to the loop that opened them, so a thread runs all of its tasks in
+# one loop and its models (and their connections) outlive a single task.
+_thread_state = threading.local()
+
+
+def _loop():
+    """Returns the event loop of the current thread, starting a new one if it has none."""
+    loop = getattr(_thread_state, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _thread_state.loop = asyncio.new_event_loop()
+        _thread_state.models = {}
+    return loop
+
+
+def _model(factory, *args):
+    """
+    Returns the model `factory(*args)` of the current thread, creating it on first use.
+
+    The model is bound to the thread's event loop, so it is only used through `_run`.
+    """
+    _loop()
+    key = (factory, args)
+    if key not in _thread_state.models:
+        _thread_state.models[key] = factory(*args)
+    return _thread_state.models[key]
+
+
+def _run(coroutine, deadline):
+    """
+    Runs a coroutine to completion in the current thread's event loop, cancelling it
+    after `deadline` seconds.
+
+    Raises:
+        TimeoutError: If the coroutine did not finish in time.
+    """
+    return _loop().run_until_complete(asyncio.wait_for(coroutine, deadline))
+
+
+def _plan_samples(questions, budget=None):
+    """
+    Splits an answer sampling budget, by default `ANSWER_SAMPLES` per question, between the questions.
+    """
+    if budget is None:
+        budget = len(questions) * ANSWER_SAMPLES
+    return plan_samples(questions, budget, ANSWER_SAMPLES_MIN, ANSWER_SAMPLES_MAX)
+
+
+def _record_partial(self, job_id, items):
+    """
+    Appends answered questions to the job's partial results and returns all partial results so far.
+
+    Args:
+        self (celery.Task): The bound task.
+        job_id (str): The id of the exam generation job.
+        items (list[dict]): The answered questions (`index`, `question` and `answers`).
+
+    Returns:
+        list[dict]: The questions answered so far, in completion order.
+    """
+    client = getattr(self.backend, 'client', None)
+    if client is None or not items:
+        return list(items)
+    key = f"job-partial:{job_id}"
+    try:
+        client.rpush(key, *(json.dumps(item) for item in items))
+        client.expire(key, PARTIAL_RESULTS_TTL)
+        return [json.loads(item) for item in client.lrange(key, 0, -1)]
+    except redis.RedisError:
+        return list(items)
+
+
+class UsageTrackingTask(Task):
+    """
+    Base class for tasks that call models.
+
+    The model calls of each run (see `backend.usage`) are logged as one structured
+    summary and added to the LLM usage totals exported as Prometheus metrics.
+
+    Calls are flushed after the run, which Celery signals only once the run's result is
+    stored. Runs whose usage must be recorded before their result is seen (such as the
+    header tasks of a chord whose callback reads the usage) flush it themselves with
+    `flush_run_usage` before they return.
+    """
+
+    def usage_job_id(self, kwargs):
+        """Returns the job the run's model calls are attributed to, if any."""
+        return None
+
+    def flush_usage(self, task_id, kwargs, records):
+        """
+        Logs and records the model calls of a finished run.
+
+        Args:
+            task_id (str): The id of the run.
+            kwargs (dict): The keyword arguments of the run.
+            records (list[dict]): The records of its model calls.
+        """
+        if not records:
+            return
+        logger.info(json.dumps({
+            'event': 'llm_task_usage',
+            'task': self.name,
+            'task_id': task_id,
+            **usage.summarize(records)
+        }))
+        usage.flush(
+            getattr(self.backend, 'client', None),
+            records,
+            job_id=self.usage_job_id(kwargs),
+            ttl=PARTIAL_RESULTS_TTL
+        )
+
+    def flush_run_usage(self):
+        """Flushes the model calls the current run has made so far."""
+        runs = _usage_runs.get(self.request.id)
+        if not runs:
+            return
+        records = runs[-1][0]
+        self.flush_usage(self.request.id, self.request.kwargs or {}, list(records))
+        records.clear()
+
+
+# Collections of the running UsageTrackingTask runs by task id. Collecting from the task
+# signals rather than by overriding Task.__call__ keeps the request context of the run
+# intact. A stack, since an eagerly replaced task runs within the task it replaces.
+_usage_runs = {}
+
+
+@task_prerun.connect
+def _start_usage_collection(task_id=None, task=None, **kwargs):
+    if isinstance(task, UsageTrackingTask):
+        _usage_runs.setdefault(task_id, []).append(usage.start_collection())
+
+
+@task_postrun.connect
+def _finish_usage_collection(task_id=None, task=None, kwargs=None, **_):
+    # Other tasks can share the id, such as the task that joins an eager chord's results
+    if not isinstance(task, UsageTrackingTask):
+        return
+    runs = _usage_runs.get(task_id)
+    if not runs:
+        return
+    records, token = runs.pop()
+    if not runs:
+        del _usage_runs[task_id]
+    usage.stop_collection(token)
+    task.flush_usage(task_id, kwargs or {}, records)
+
+
+class ExamStageTask(UsageTrackingTask):
+    """
+    Base class for the tasks that make up an exam generation job.
+
+    A job is one canvas of stage tasks, and its state lives under the id of the
+    task that was originally enqueued (`job_id`), which is the id the client polls.
+    Stages report progress to that id rather than their own, and failures and the
+    final result are published to the job's progress stream. A finished or failed
+    job is released from the job scheduler so the next queued job can start. The
+    model usage of every stage is added up under the job id and reported with the
+    job result.
+    """
 
-celery.conf.update(
-    worker_disable_remote_control=True,
-    task_soft_time_limit=900,
-    result_expires=3600
+    def job_id(self, kwargs):
+        return kwargs.get('job_id') or self.request.id
+
+    def usage_job_id(self, kwargs):
+        return self.job_id(kwargs)
+
+    def report(self, job_id, meta):
+        """
+        Records progress metadata for the job and publishes it to the job's progress channel.
+
+        Args:
+            job_id (str): The id of the job.
+            meta (dict): The progress metadata.
+        """
+        self.update_state(task_id=job_id, state='PROGRESS', meta=meta)
+        client = getattr(self.backend, 'client', None)
+        if client is not None:
+            publish_progress(client, job_id, 'PROGRESS', meta)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        client = getattr(self.backend, 'client', None)
+        if client is not None:
+            error_data = {'exc_type': type(exc).__name__, 'exc_message': str(exc)}
+            publish_progress(client, self.job_id(kwargs), 'FAILURE', error_data)
+            scheduler_from_env(client, celery).release(self.job_id(kwargs), failed=True)
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        # Only the last stage runs under the job id, so its result is the job result
+        client = getattr(self.backend, 'client', None)
+        if status == 'SUCCESS' and task_id == kwargs.get('job_id') and client is not None:
+            publish_progress(client, task_id, status, retval)
+            scheduler_from_env(client, celery).release(task_id)
+
+
+stage_options = dict(
+    bind=True,
+    base=ExamStageTask,
+    autoretry_for=(Exception,),
+    max_retries=2,
+    retry_backoff=True,
+    retry_backoff_max=60,
+    retry_jitter=True
 )
 
-# Shared async function that handles the core exam generation process
-async def _generate_exam_core(self, pdf_data_list, num_questions, title, description, max_parallel=5):
+
+def _start_exam_job(self, pdf_data_list, num_questions, title, description, save=None):
     """
-    Core function for generating an exam from a list of PDF files.
+    Replaces an exam generation entry task with the canvas of stage tasks that performs the job.
 
-    This method handles the full pipeline of:
-      1. Scanning and extracting content from PDF documents,
-      2. Generating potential exam questions based on the extracted content,
-      3. Randomly selecting a subset of questions,
-      4. Generating multiple answers per question (in parallel with concurrency control),
-      5. Formatting the exam data for output.
+    The canvas is:
+      1. a chord of `scan_pdf_task` (one per PDF) into `plan_questions_task`,
+      2. which replaces itself with a chord of `answer_question_task` (one per question)
+         into `assemble_exam_task`.
+
+    Every stage retries on its own, so a failure only repeats the failed stage, and the
+    final stage runs under the entry task's id so the client sees its result there.
 
     Args:
+        self (celery.Task): The bound entry task.
         pdf_data_list (list[bytes]): A list of up to 5 PDF files in byte format.
         num_questions (int): The number of questions to include in the final exam.
         title (str): The title of the exam.
         description (str): A short description of the exam.
-        max_parallel (int, optional): Maximum number of concurrent answer generation tasks. Defaults to 5.
-
-    Returns:
-        tuple:
-            - Exam: An `Exam` object containing the final questions and their answers.
-            - dict: A dictionary containing the formatted exam data with title, description, questions, and answers.
+        save (dict, optional): `color`, `privacy` and `username` if the exam is saved to the database.
 
     Raises:
         ValueError: If the number of PDFs is not between 1 and 5.
-        Exception: If no questions could be generated from the provided PDFs.
     """
-    exam = Exam()
-    
     if not pdf_data_list or len(pdf_data_list) > 5:
         raise ValueError("Must provide between 1 and 5 PDF files.")
-    
-    pdf_model = GeminiModel()
-    text_model = Cohere('command-a-03-2025')
-    scanner = GeminiPDFScanner(pdf_model, text_model)
-
-    # 3. Scan PDFs
-    self.update_state(
-        state='PROGRESS',
-        meta={
-            'status': 'Scanning PDFs and extracting content',
-            'current': 1,
-            'total': 4,
-            'stage': 'pdf_scanning'
-        }
+
+    job_id = self.request.id
+    self.report(job_id, {
+        'status': 'Starting exam generation process',
+        'current': 0,
+        'total': 4,  # Total number of main steps
+        'stage': 'initialization'
+    })
+
+    scans = group(scan_pdf_task.s(pdf_data, job_id=job_id) for pdf_data in pdf_data_list)
+    plan = plan_questions_task.s(
+        job_id=job_id,
+        num_questions=num_questions,
+        title=title,
+        description=description,
+        save=save
     )
-    
-    extracted_pdfs = await scanner.scan_pdfs(pdf_data_list)
-
-    # 4. Generate questions
-    self.update_state(
-        state='PROGRESS',
-        meta={
-            'status': 'Generating potential exam questions',
-            'current': 2,
+    return self.replace(chord(scans, plan))
+
+
+@celery.task(**stage_options)
+def scan_pdf_task(self, pdf_data, job_id):
+    """
+    Scans a single PDF and extracts its question–answer pairs.
+
+    The extraction is checkpointed in Redis under the SHA-256 of the PDF, so
+    a retried job (or another job over the same PDF) skips the Gemini calls.
+
+    Args:
+        pdf_data (bytes): The PDF file content.
+        job_id (str): The id of the exam generation job.
+
+    Returns:
+        dict: The `source` (SHA-256 hex digest) of the PDF and its extracted `[question, answer]` pairs (`qa_pairs`).
+    """
+    self.report(job_id, {
+        'status': 'Scanning PDFs and extracting content',
+        'current': 1,
+        'total': 4,
+        'stage': 'pdf_scanning'
+    })
+
+    client = getattr(self.backend, 'client', None)
+    source = hashlib.sha256(pdf_data).hexdigest()
+    checkpoint_key = f"scan-checkpoint:{source}"
+    if client is not None:
+        try:
+            cached = client.get(checkpoint_key)
+        except redis.RedisError:
+            cached = None
+        if cached:
+            return {'source': source, 'qa_pairs': json.loads(cached)}
+
+    scanner = GeminiPDFScanner(_model(GeminiModel), _model(Cohere, 'command-a-03-2025'))
+    extracted_pdf = _run(scanner.scan_pdfs([pdf_data]), SCAN_DEADLINE)[0]
+    qa_pairs = [list(qa_pair) for qa_pair in extracted_pdf.qa_pairs]
+
+    if client is not None:
+        try:
+            client.setex(checkpoint_key, SCAN_CHECKPOINT_TTL, json.dumps(qa_pairs))
+        except redis.RedisError:
+            pass
+    self.flush_run_usage()
+    return {'source': source, 'qa_pairs': qa_pairs}
+
+
+@celery.task(**stage_options)
+def plan_questions_task(self, scanned_pdfs, job_id, num_questions, title, description, save=None):
+    """
+    Plans the questions of the exam and replaces itself with the question and answer generation stage.
+
+    Questions are first drawn from the question bank of each PDF, which holds questions
+    answered ahead of time. The remaining questions are split between the PDFs up front,
+    and each PDF generates and answers its share independently (see
+    `generate_pdf_questions_task`), so answers for one PDF start as soon as its questions
+    arrive. The bank of each PDF is refilled in the background afterwards.
+
+    The split draws the remaining questions uniformly from the questions all PDFs are
+    asked to generate, so the exam has the same composition as sampling from the combined
+    list would give, regardless of the order in which the PDFs finish. Each PDF also
+    answers a few spare questions, which fill the slots of PDFs that fall short of their
+    share (see `assemble_exam_task`).
+
+    Drawing from the bank removes the questions from it, so if planning (or, in eager
+    mode, the rest of the job) fails, the drawn questions are returned to the bank.
+
+    Args:
+        scanned_pdfs (list[dict]): The results of `scan_pdf_task` (`source` and `qa_pairs`) of each PDF.
+        job_id (str): The id of the exam generation job.
+        num_questions (int): The number of questions to include in the final exam.
+        title (str): The title of the exam.
+        description (str): A short description of the exam.
+        save (dict, optional): Database save options, forwarded to `assemble_exam_task`.
+    """
+    from backend.database import DatabaseError
+
+    self.report(job_id, {
+        'status': 'Generating potential exam questions',
+        'current': 2,
+        'total': 4,
+        'stage': 'question_generation'
+    })
+
+    quota = int(math.ceil(num_questions / len(scanned_pdfs)))
+    example_questions = [[qa_pair[0] for qa_pair in pdf['qa_pairs']] for pdf in scanned_pdfs]  # Extract only questions
+
+    # Draw already answered questions from the bank, up to each PDF's share of the exam
+    banked = []
+    drawn = []
+    for pdf in scanned_pdfs:
+        wanted = min(quota, num_questions - len(banked))
+        if wanted <= 0:
+            break
+        try:
+            taken = _db().take_bank_questions(pdf['source'], wanted)
+        except DatabaseError as e:
+            logger.warning(f"Could not draw from the question bank: {e}")
+            continue
+        banked.extend(taken)
+        if taken:
+            drawn.append((pdf['source'], [question for question, _ in taken]))
+
+    try:
+        return _plan_generation(self, scanned_pdfs, example_questions, banked, job_id, num_questions,
+                                title, description, save)
+    except (Ignore, Retry):
+        # Raised once the next stage is enqueued, which now owns the drawn questions
+        raise
+    except Exception:
+        for source, questions in drawn:
+            try:
+                _db().return_bank_questions(source, questions)
+            except DatabaseError as e:
+                logger.warning(f"Could not return questions to the question bank: {e}")
+        raise
+
+
+def _plan_generation(self, scanned_pdfs, example_questions, banked, job_id, num_questions, title, description, save):
+    """
+    Splits the questions not drawn from the bank between the PDFs and replaces the planning
+    task with their generation (see `plan_questions_task`).
+    """
+    quota = int(math.ceil(num_questions / len(scanned_pdfs)))
+    needed = num_questions - len(banked)
+
+    # Weigh the PDFs by how many questions they would contribute to a combined list (their share, or
+    # more for PDFs with more example questions) and pick the needed ones uniformly among them
+    pool_sizes = [max(quota, len(exam_questions)) for exam_questions in example_questions]
+    picks = random.sample(range(sum(pool_sizes)), min(needed, sum(pool_sizes)))
+    boundaries = [sum(pool_sizes[:i + 1]) for i in range(len(pool_sizes))]
+    shares = [0] * len(scanned_pdfs)
+    for pick in picks:
+        shares[next(i for i, boundary in enumerate(boundaries) if pick < boundary)] += 1
+
+    # Give every question a random position in the exam
+    slots = list(range(len(banked) + len(picks)))
+    random.shuffle(slots)
+    banked_items = [
+        {"index": slots.pop(), "question": question, "answers": answers}
+        for question, answers in banked
+    ]
+    if banked_items:
+        partial = _record_partial(self, job_id, banked_items)
+        self.report(job_id, {
+            'status': f'Generated answers for {len(partial)} of {num_questions} questions',
+            'current': 3,
             'total': 4,
-            'stage': 'question_generation'
-        }
+            'stage': 'answer_generation',
+            'completed_questions': len(partial),
+            'total_questions': num_questions,
+            'partial': partial
+        })
+
+    # The sampling budget of the exam is split between the PDFs before their questions are
+    # known, by the difficulty of their example questions
+    counts = [share + QUESTION_BUFFER if share else 0 for share in shares]
+    budgets = plan_budgets(
+        example_questions, counts, sum(counts) * ANSWER_SAMPLES, ANSWER_SAMPLES_MIN, ANSWER_SAMPLES_MAX
     )
-    
-    possible_exam_questions = []
 
-    for pdf in extracted_pdfs:
-        exam_questions = [qa_pair[0] for qa_pair in pdf.qa_pairs]  # Extract only questions
-        generated_questions = await questionGenerator.generate_questions(
+    generation = []
+    for pdf, exam_questions, share, budget in zip(scanned_pdfs, example_questions, shares, budgets):
+        pdf_slots = [slots.pop() for _ in range(share)]
+        if share == 0:
+            _schedule_bank_refill(self, pdf['source'], exam_questions, [])
+            continue
+        generation.append(generate_pdf_questions_task.s(
+            pdf['source'],
             exam_questions,
-            max(int(math.ceil(num_questions / len(pdf_data_list))), len(exam_questions)),
-            text_model
-        )
-        possible_exam_questions.extend(generated_questions)  # Flattening all generated questions into one list
+            job_id=job_id,
+            slots=pdf_slots,
+            total=num_questions,
+            exclude=[question for question, _ in banked],
+            budget=budget
+        ))
+
+    assemble = assemble_exam_task.s(
+        job_id=job_id, title=title, description=description, save=save, banked=banked_items, total=num_questions
+    )
+    if not generation:
+        return self.replace(assemble.clone(args=([],)))
+    return self.replace(chord(group(generation), assemble))
+
+
+@celery.task(**stage_options)
+def generate_pdf_questions_task(self, source, example_questions, job_id, slots, total, exclude=(), budget=None):
+    """
+    Generates questions for one PDF, selects its share of the exam and replaces itself with
+    the answer generation of the selected questions.
+
+    Only the share plus a small buffer is requested from the model (see
+    `questionGenerator.generate_questions_within_budget`). Up to `QUESTION_BUFFER` of the
+    questions left over are answered as spares, for the slots of PDFs that fall short of
+    their share; the rest go to the question bank. The PDF's budget of sampled answers
+    goes mostly to the questions whose answers are likely to disagree.
+
+    Args:
+        source (str): The SHA-256 hex digest of the PDF.
+        example_questions (list[str]): The questions extracted from the PDF.
+        job_id (str): The id of the exam generation job.
+        slots (list[int]): The positions in the exam of this PDF's questions; one question is selected per slot.
+        total (int): The number of questions in the exam.
+        exclude (list[str], optional): Questions already in the exam.
+        budget (int, optional): The answers to sample for this PDF's questions, as planned
+                                for the whole exam; by default `ANSWER_SAMPLES` per question.
+
+    Returns:
+        list[dict]: The answered questions and spares, as returned by `answer_question_task`.
+    """
+    text_model = _model(Cohere, 'command-a-03-2025')
+
+    generated_questions = _run(questionGenerator.generate_questions_within_budget(
+        example_questions,
+        len(slots),
+        text_model,
+        buffer=QUESTION_BUFFER
+    ), GENERATE_DEADLINE)
+    generated_questions = [q for q in generated_questions if q not in exclude]
+    selected_questions = random.sample(generated_questions, min(len(slots), len(generated_questions)))
+    leftover = [q for q in generated_questions if q not in selected_questions]
+    spare_questions = leftover[:QUESTION_BUFFER]
+
+    # Other generated questions are answered and banked for later exams
+    _schedule_bank_refill(self, source, example_questions, leftover[QUESTION_BUFFER:])
+    self.flush_run_usage()
+
+    if not selected_questions and not spare_questions:
+        return []
+    samples = _plan_samples(selected_questions + spare_questions, budget)
+    indices = slots[:len(selected_questions)] + [None] * len(spare_questions)
+    return self.replace(group(
+        answer_question_task.s(question, job_id=job_id, index=index, total=total, samples=count, source=source)
+        for question, index, count in zip(selected_questions + spare_questions, indices, samples)
+    ))
+
+
+def _schedule_bank_refill(self, source, example_questions, candidates):
+    """
+    Starts a background refill of the question bank of a PDF, unless one is already running.
+
+    Refills are only scheduled when the result backend is Redis, which is used to run
+    one refill per PDF at a time.
+
+    Args:
+        self (celery.Task): The bound task.
+        source (str): The SHA-256 hex digest of the PDF.
+        example_questions (list[str]): The questions extracted from the PDF.
+        candidates (list[str]): Generated questions to answer and bank before generating new ones.
+    """
+    client = getattr(self.backend, 'client', None)
+    if client is None or QUESTION_BANK_TARGET <= 0:
+        return
+    try:
+        if not client.set(f"bank-refill:{source}", 1, nx=True, ex=600):
+            return
+    except redis.RedisError:
+        return
+    refill_question_bank_task.delay(source, example_questions, candidates)
+
+
+@celery.task(**stage_options)
+def answer_question_task(self, question, job_id, index, total, samples=ANSWER_SAMPLES, source=None):
+    """
+    Generates the answers of a single question and publishes it with the questions answered so far.
+
+    Spare questions are not published, as they only make it into the exam if another PDF
+    falls short of its share.
+
+    Args:
+        question (str): The question to answer.
+        job_id (str): The id of the exam generation job.
+        index (int): The position of the question in the exam, or None for a spare question.
+        total (int): The number of questions in the exam.
+        samples (int, optional): The number of answers to sample.
+        source (str, optional): The SHA-256 hex digest of the PDF the question was generated from.
 
-    if len(possible_exam_questions) == 0:
+    Returns:
+        dict: The `index`, `question`, `answers` (answer to confidence) and `source` of the question.
+    """
+    answers = _run(answerGenerator.generate_answers(
+        question, samples, _model(Cohere, 'command-a-03-2025'), first_pass=ANSWER_FIRST_PASS
+    ), ANSWER_DEADLINE)
+    result = {"index": index, "question": question, "answers": answers, "source": source}
+    # Flushed before the result is stored, since assembling the exam reads the job's usage
+    self.flush_run_usage()
+    if index is None:
+        return result
+    partial = _record_partial(self, job_id, [result])
+
+    self.report(job_id, {
+        'status': f'Generated answers for {len(partial)} of {total} questions',
+        'current': 3,
+        'total': 4,
+        'stage': 'answer_generation',
+        'completed_questions': len(partial),
+        'total_questions': total,
+        'partial': partial
+    })
+    return result
+
+
+def _bank_spares(spares):
+    """
+    Adds answered spare questions that did not make it into the exam to the question bank of their PDF.
+
+    Args:
+        spares (list[dict]): The spare questions, as returned by `answer_question_task`.
+    """
+    from backend.database import DatabaseError
+
+    if QUESTION_BANK_TARGET <= 0:
+        return
+    by_source = {}
+    for spare in spares:
+        if spare["answers"] and spare.get("source"):
+            by_source.setdefault(spare["source"], []).append((spare["question"], spare["answers"]))
+    for source, questions in by_source.items():
+        try:
+            _db().add_bank_questions(source, questions)
+        except DatabaseError as e:
+            logger.warning(f"Could not bank spare questions: {e}")
+
+
+# Saving is not idempotent, so the stage is neither retried nor redelivered
+@celery.task(**{**stage_options, 'autoretry_for': ()}, acks_late=False)
+def assemble_exam_task(self, answered_questions, job_id, title, description, save=None, banked=(), total=None):
+    """
+    Builds the exam from the answered questions and, for save jobs, stores it in the database.
+
+    Slots left empty by PDFs that fell short of their share are filled with spare
+    questions, drawn at random from all PDFs; unused spares go to the question bank.
+
+    Args:
+        answered_questions (list[list[dict]]): The results of `answer_question_task`, grouped by PDF.
+        job_id (str): The id of the exam generation job.
+        title (str): The title of the exam.
+        description (str): A short description of the exam.
+        save (dict, optional): `color`, `privacy` and `username` if the exam is saved to the database.
+        banked (list[dict], optional): The questions drawn from the question bank, in the same format.
+        total (int, optional): The number of questions in the exam, if empty slots are to be filled with spares.
+
+    Returns:
+        dict: The exam data (title, description, questions and answers), or the `exam_id`
+              of the saved exam for save jobs, with the model `usage` of the job
+              (see `usage.summarize`).
+
+    Raises:
+        Exception: If no questions could be generated from the provided PDFs.
+    """
+    items = [item for pdf_items in answered_questions for item in pdf_items] + list(banked)
+    spares = [item for item in items if item["index"] is None]
+    items = [item for item in items if item["index"] is not None]
+
+    random.shuffle(spares)
+    missing = sorted(set(range(total or 0)) - {item["index"] for item in items})
+    filled = [dict(spare, index=index) for index, spare in zip(missing, spares)]
+    _bank_spares(spares[len(filled):])
+    if filled:
+        items += filled
+        partial = _record_partial(self, job_id, filled)
+        self.report(job_id, {
+            'status': f'Generated answers for {len(partial)} of {total} questions',
+            'current': 3,
+            'total': 4,
+            'stage': 'answer_generation',
+            'completed_questions': len(partial),
+            'total_questions': total,
+            'partial': partial
+        })
+
+    if not items:
         raise Exception("No questions could be generated from the provided PDFs")
-    
-    # Randomly select `num_questions`
-    selected_questions = random.sample(possible_exam_questions, min(num_questions, len(possible_exam_questions)))
-
-    # Add questions to the exam
-    for question in selected_questions:
-        exam.add_question(question)
-
-    # 6. Generate answers for each question
-    self.update_state(
-        state='PROGRESS',
-        meta={
-            'status': 'Generating answers for each question',
-            'current': 3,  # Show some progress before completion
+
+    exam = Exam()
+    for item in sorted(items, key=lambda item: item["index"]):
+        exam.add_question(item["question"])
+        exam.add_answers(item["question"], item["answers"])
+
+    if save is None:
+        self.report(job_id, {
+            'status': 'Exam generation complete',
+            'current': 4,
             'total': 4,
-            'stage': 'answer_generation'
+            'stage': 'complete'
+        })
+
+        return {
+            "title": title,
+            "description": description,
+            "questions": [
+                {
+                    "question": q,
+                    "answers": exam.get_all_answers(q)
+                }
+                for q in exam.get_question()
+            ],
+            "usage": usage.job_usage(getattr(self.backend, 'client', None), job_id)
         }
+
+    db = _db()
+
+    self.report(job_id, {
+        'status': 'Saving exam to database',
+        'current': 4,
+        'total': 4,
+        'stage': 'database_save'
+    })
+
+    # Save the exam to the database
+    exam_id = db.add_exam(
+        username=save['username'],
+        name=title,
+        color=save['color'],
+        description=description,
+        public=save['privacy']
     )
-    
-    # Create a semaphore to limit concurrent tasks
-    semaphore = asyncio.Semaphore(max_parallel)
-
-    # Define a function that acquires and releases the semaphore
-    async def generate_answers_with_semaphore(question):
-        async with semaphore:
-            return await answerGenerator.generate_answers(question, 10, text_model)
-
-    # Run answer generation asynchronously for all questions with semaphore
-    answer_tasks = [
-        generate_answers_with_semaphore(question) 
-        for _, question in enumerate(selected_questions)
-    ]
-    results = await asyncio.gather(*answer_tasks)  # Run all answer generations with controlled parallelism
-
-    # Store answers in the exam
-    for question, answers in zip(selected_questions, results):
-        exam.add_answers(question, answers)
-    
-    # Prepare exam data for return
-    exam_data = {
-        "title": title,
-        "description": description,
-        "questions": [
-            {
-                "question": q,
-                "answers": exam.get_all_answers(q)
-            }
-            for q in exam.get_question()
-        ]
-    }
-    
-    return exam, exam_data
-
-
-@celery.task(bind=True)
-def generate_exam_task(self, pdf_data_list, num_questions, title, description, max_parallel=3):
+
+    # Insert questions and answers into the database
+    for index, question_text in enumerate(exam.get_question(), start=1):
+        answers = exam.get_all_answers(question_text)
+
+        if answers is not None:
+            db.insert_question(index, exam_id, question_text, set(answers.items()))
+
+    return {"exam_id": exam_id, "usage": usage.job_usage(getattr(self.backend, 'client', None), job_id)}
+
+
+@celery.task(bind=True, base=UsageTrackingTask, autoretry_for=(Exception,), max_retries=2, retry_backoff=True)
+def refill_question_bank_task(self, source, example_questions, candidates=()):
+    """
+    Background task that tops up the question bank of a source PDF to `QUESTION_BANK_TARGET`
+    unused questions.
+
+    The given candidate questions are used first; further questions are generated from the
+    example questions of the PDF. Every question is answered before it is banked, so exams
+    can use banked questions without any LLM calls.
+
+    Args:
+        source (str): The SHA-256 hex digest of the source PDF.
+        example_questions (list[str]): The questions extracted from the PDF.
+        candidates (list[str], optional): Generated questions that have not been answered yet.
+
+    Returns:
+        int: The number of questions added to the bank.
+    """
+    try:
+        db = _db()
+        missing = QUESTION_BANK_TARGET - db.count_bank_questions(source)
+        if missing <= 0:
+            return 0
+
+        text_model = _model(Cohere, 'command-a-03-2025')
+
+        async def refill():
+            questions = list(candidates)[:missing]
+            if len(questions) < missing and example_questions:
+                generated_questions = await questionGenerator.generate_questions_within_budget(
+                    example_questions,
+                    missing - len(questions),
+                    text_model,
+                    buffer=0
+                )
+                questions.extend(q for q in generated_questions if q not in questions)
+                questions = questions[:missing]
+
+            semaphore = asyncio.Semaphore(3)
+            # One comparator for all questions, deciding with the answering model's client
+            comparator = LLMAnswerComparator(tolerance=1e-5, model=text_model)
+
+            async def answer(question, samples):
+                async with semaphore:
+                    return question, await answerGenerator.generate_answers(
+                        question, samples, text_model, comparator, first_pass=ANSWER_FIRST_PASS
+                    )
+
+            samples = _plan_samples(questions)
+            return await asyncio.gather(*(answer(question, count) for question, count in zip(questions, samples)))
+
+        answered = [(question, answers) for question, answers in _run(refill(), REFILL_DEADLINE) if answers]
+        return db.add_bank_questions(source, answered)
+    finally:
+        client = getattr(self.backend, 'client', None)
+        if client is not None:
+            try:
+                client.delete(f"bank-refill:{source}")
+            except redis.RedisError:
+                pass
+
+
+@celery.task(bind=True, base=ExamStageTask)
+def generate_exam_task(self, pdf_data_list, num_questions, title, description):
     """
     Celery task for generating an exam from uploaded PDFs without saving it to a database.
 
-    This task runs asynchronously and tracks its own progress state across key steps, including:
+    The task replaces itself with the stage tasks of the job (see `_start_exam_job`), which
+    report their progress under this task's id across key steps, including:
         1. Initialization,
         2. PDF scanning and content extraction,
         3. Question generation,
@@ -170,56 +824,23 @@ def generate_exam_task(self, pdf_data_list, num_questions, title, description, m
         num_questions (int): The number of questions to include in the generated exam.
         title (str): The title of the exam.
         description (str): A short description of the exam.
-        max_parallel (int, optional): Maximum number of concurrent answer generation tasks. Defaults to 3.
 
     Returns:
-        dict: A dictionary containing the structured exam data (title, description, questions, and answers).
+        dict: A dictionary containing the structured exam data (title, description, questions, and answers),
+              stored under this task's id once the last stage completes.
 
     Raises:
-        Exception: If any step in the pipeline fails. Updates the task state to 'FAILURE' and returns error metadata.
+        ValueError: If the number of PDFs is not between 1 and 5.
     """
-    try:
-        # Initial progress update
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'status': 'Starting exam generation process',
-                'current': 0,
-                'total': 4,  # Total number of main steps
-                'stage': 'initialization'
-            }
-        )
-        
-        # Run the shared async function
-        _, exam_data = asyncio.run(_generate_exam_core(self, pdf_data_list, num_questions, title, description, max_parallel))
-        
-        # Final progress update
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'status': 'Exam generation complete',
-                'current': 4,
-                'total': 4,
-                'stage': 'complete'
-            }
-        )
-        
-        return exam_data
-    except Exception as e:
-        error_data = {
-            'exc_type': type(e).__name__,
-            'exc_message': str(e)
-        }
-        self.update_state(state='FAILURE', meta=error_data)
-        raise
+    return _start_exam_job(self, pdf_data_list, num_questions, title, description)
 
 
-@celery.task(bind=True)
-def generate_and_save_exam_task(self, pdf_data_list, num_questions, title, description, color, privacy, username, max_parallel=3):
+@celery.task(bind=True, base=ExamStageTask)
+def generate_and_save_exam_task(self, pdf_data_list, num_questions, title, description, color, privacy, username):
     """
     Celery task for generating an exam and saving it to the database under a given user.
 
-    This task performs the same pipeline as `generate_exam_task`, but additionally:
+    This task runs the same stages as `generate_exam_task`, but its last stage additionally:
         - Saves the generated exam metadata to the database,
         - Inserts all questions and their associated answers,
         - Associates the exam with a specific user account.
@@ -232,66 +853,50 @@ def generate_and_save_exam_task(self, pdf_data_list, num_questions, title, descr
         color (str): Color tag or theme for the exam in the UI.
         privacy (bool): Whether the exam is public (`True`) or private (`False`).
         username (str): The username of the user creating the exam.
-        max_parallel (int, optional): Max number of concurrent answer generation tasks. Defaults to 3.
 
     Returns:
-        dict: A dictionary containing the `exam_id` of the saved exam.
+        dict: A dictionary containing the `exam_id` of the saved exam, stored under this
+              task's id once the last stage completes.
 
     Raises:
-        Exception: If an error occurs during exam generation or database insertion.
-        Task state is updated to 'FAILURE' with exception type and message.
+        ValueError: If the number of PDFs is not between 1 and 5.
     """
-    try:
-        from backend.database.db_factory import get_db_instance
-        db = get_db_instance()
-
-        # Initial progress update
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'status': 'Starting exam generation process',
-                'current': 0,
-                'total': 4,  # Total steps including database save
-                'stage': 'initialization'
-            }
-        )
-        
-        # Run the shared async function for steps 1-6
-        exam, _ = asyncio.run(_generate_exam_core(self, pdf_data_list, num_questions, title, description, max_parallel))
-        
-        # Step 7: Save to database
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'status': 'Saving exam to database',
-                'current': 4,
-                'total': 4,
-                'stage': 'database_save'
-            }
-        )
+    save = {'color': color, 'privacy': privacy, 'username': username}
+    return _start_exam_job(self, pdf_data_list, num_questions, title, description, save)
 
-        # Save the exam to the database
-        exam_id = db.add_exam(
-            username=username,
-            name=title,
-            color=color,
-            description=description,
-            public=privacy
-        )
-        
-        # Insert questions and answers into the database
-        for index, question_text in enumerate(exam.get_question(), start=1):
-            answers = exam.get_all_answers(question_text)
-            
-            if answers is not None:
-                db.insert_question(index, exam_id, question_text, set(answers.items()))
-        
-        return {"exam_id": exam_id}
-        
-    except Exception as e:
-        error_data = {
-            'exc_type': type(e).__name__,
-            'exc_message': str(e)
-        }
-        self.update_state(state='FAILURE', meta=error_data)
-        raise
+
+@celery.task
+def purge_refresh_tokens_task(batch_size=1000):
+    """
+    Periodic Celery task that deletes expired and revoked refresh tokens.
+
+    Rows are deleted in batches of `batch_size` so that no single transaction
+    holds locks on a large part of the table.
+
+    Args:
+        batch_size (int, optional): Maximum number of rows deleted per transaction. Defaults to 1000.
+
+    Returns:
+        int: The total number of deleted refresh tokens.
+    """
+    db = _db()
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    total = 0
+    while True:
+        deleted = db.delete_expired_refresh_tokens(now, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+@celery.task
+def sweep_job_scheduler_task():
+    """
+    Periodic Celery task that releases exam generation jobs that never reported back
+    and dispatches queued jobs.
+
+    Returns:
+        int: The number of stale jobs released.
+    """
+    return scheduler_from_env(celery.backend.client, celery).sweep()
@@ -316,6 +316,50 @@ class BaseTestDAO(ABC):
         assert db.get_refresh_token("token", True) is not None
         assert db.get_refresh_token("token", False) is None
 
+    def test_delete_expired_refresh_tokens(self, db: DataAccessObject):
+        user_id = db.add_user("testuser",
+                              "test@example.com",
+                              "password",
+                              "local")
+        now = datetime.datetime.now()
+        db.create_refresh_token(user_id, "expired", now - datetime.timedelta(days=1))
+        db.create_refresh_token(user_id, "revoked", now + datetime.timedelta(days=1))
+        db.create_refresh_token(user_id, "valid", now + datetime.timedelta(days=1))
+        db.set_revoked_status("revoked", True)
+
+        assert db.delete_expired_refresh_tokens(now, 1) == 1
+        assert db.delete_expired_refresh_tokens(now, 100) == 1
+        assert db.delete_expired_refresh_tokens(now, 100) == 0
+
+        assert db.get_refresh_token("expired") is None
+        assert db.get_refresh_token("revoked") is None
+        assert db.get_refresh_token("valid", False) is not None
+
+    def test_question_bank(self, db: DataAccessObject):
+        questions = [("What's 1 + 1?", {"2": 90.0, "3": 10.0}),
+                     ("What's 5 * 4?", {"20": 100.0})]
+
+        assert db.count_bank_questions("source") == 0
+        assert db.add_bank_questions("source", questions) == 2
+        assert db.add_bank_questions("source", questions[:1]) == 0
+        assert db.count_bank_questions("source") == 2
+        assert db.count_bank_questions("other") == 0
+
+        taken = db.take_bank_questions("source", 1)
+        assert len(taken) == 1
+        assert taken[0] in questions
+        assert db.count_bank_questions("source") == 1
+
+        rest = db.take_bank_questions("source", 5)
+        assert sorted(taken + rest) == sorted(questions)
+        assert db.take_bank_questions("source", 5) == []
+        assert db.count_bank_questions("source") == 0
+
+        assert db.return_bank_questions("source", [taken[0][0]]) == 1
+        assert db.return_bank_questions("other", [taken[0][0]]) == 0
+        assert db.count_bank_questions("source") == 1
+        assert db.take_bank_questions("source", 5) == taken
+
     def test_set_oauth_id(self, db: DataAccessObject):
         user_id = db.add_user("testuser",
                               "test@example.com",
@@ -1,8 +1,8 @@
 import pytest
 import pytest_asyncio
-from backend.answerGenerator import extract_answer, majority_vote, generate_answers
+from backend.answerGenerator import MAX_ANSWER_CHARS, extract_answer, majority_vote, generate_answers
 from backend.models import Cohere
-from backend.validation import LLMAnswerComparator, Equality
+from backend.validation import LLMAnswerComparator, Equality, ValidationObject
 from unittest.mock import patch, AsyncMock
 
 # Configure pytest-asyncio
@@ -16,11 +16,19 @@ def sample_question():
     ("Some reasoning...\nFinal answer: 4", "4"),
     ("Complex calculation...\nFinal answer: *42*", "42"),
     ("Multiple steps...\nFinal answer: 3.14", "3.14"),
+    ("Final answer: 1\nOn second thought...\nFinal answer: 2", "2"),
+    ("No marker, so the answer is \\boxed{7}", "No marker, so the answer is \\boxed{7}"),
 ])
 def test_extract_answer(text, expected):
     result = extract_answer(text)
     assert result == expected
 
+def test_extract_answer_capped():
+    reasoning = "step " * 10000
+    assert extract_answer(reasoning + "the answer is 5") == (reasoning + "the answer is 5")[-MAX_ANSWER_CHARS:].strip()
+    assert extract_answer("Final answer: 5 " + reasoning) == (" 5 " + reasoning)[:MAX_ANSWER_CHARS].strip()
+    assert extract_answer("so \\boxed{5} " + reasoning) == ("\\boxed{5} " + reasoning)[:MAX_ANSWER_CHARS].strip()
+
 @pytest_asyncio.fixture
 async def mock_cohere():
     with patch('backend.models.Cohere.call_model', new_callable=AsyncMock) as mock:
@@ -28,7 +36,7 @@ async def mock_cohere():
 
 @pytest_asyncio.fixture
 async def mock_comparator():
-    with patch('backend.validation.LLMAnswerComparator.llm_answers_equivalent_full', new_callable=AsyncMock) as mock:
+    with patch('backend.validation.LLMAnswerComparator.deterministic_equivalent', new_callable=AsyncMock) as mock:
         yield mock
 
 @pytest.mark.asyncio
@@ -69,14 +77,15 @@ async def test_generate_answers(sample_question, mock_cohere, mock_comparator):
     model = Cohere()
     
     # Mock comparator to consider the answers
-    class MockEquivalenceResult:
-        def __init__(self, status):
-            self.status = status
-    
+    def unequal():
+        result = ValidationObject()
+        result.add_unequal("math")
+        return result
+
     mock_comparator.side_effect = [
-        MockEquivalenceResult(Equality.UNEQUAL),  # 4 vs 5
-        MockEquivalenceResult(Equality.UNEQUAL),  # 4 vs 5
-        MockEquivalenceResult(Equality.UNEQUAL)   # 4 vs 5
+        unequal(),  # 4 vs 5
+        unequal(),  # 4 vs 5
+        unequal()   # 4 vs 5
     ]
     
     result = await generate_answers(sample_question, 3, model)
@@ -118,4 +127,24 @@ async def test_model_exception(sample_question, mock_cohere):
     model = Cohere()
     
     result = await generate_answers(sample_question, 3, model)
-    assert result == {"no answers generated": 0}
\ No newline at end of file
+    assert result == {"no answers generated": 0}
+
+@pytest.mark.asyncio
+async def test_generate_answers_first_pass_unanimous(sample_question, mock_cohere):
+    mock_cohere.return_value = "Final answer: 4"
+    model = Cohere()
+
+    result = await generate_answers(sample_question, 10, model, first_pass=3)
+
+    assert result == {"4": 100.0}
+    assert mock_cohere.call_count == 3
+
+@pytest.mark.asyncio
+async def test_generate_answers_first_pass_disagreement(sample_question, mock_cohere):
+    mock_cohere.side_effect = ["Final answer: 4", "Final answer: 5"] + ["Final answer: 4"] * 3
+    model = Cohere()
+
+    result = await generate_answers(sample_question, 5, model, first_pass=2)
+
+    assert mock_cohere.call_count == 5
+    assert result == {"4": 80.0, "5": 20.0}
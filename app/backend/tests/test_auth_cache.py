@@ -0,0 +1,155 @@
+import datetime
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+
+from backend.auth_cache import UserCache, RevocationCache, claims_for_user, user_from_claims, hash_token
+
+
+class FakeRedis:
+    """A minimal in-memory stand-in for the Redis commands used by the auth caches."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.store)
+
+
+@pytest.fixture
+def user_row():
+    now = datetime.datetime.now()
+    return (1, "testuser", "test@example.com", "hashed", "local", None, now, now, None)
+
+
+@pytest.fixture
+def db(user_row):
+    db = MagicMock()
+    db.get_user.return_value = user_row
+    return db
+
+
+def test_claims_round_trip():
+    claims = claims_for_user(1, "testuser", "test@example.com", "local")
+    user = user_from_claims(claims)
+
+    assert user[0] == 1
+    assert user[1] == "testuser"
+    assert user[2] == "test@example.com"
+    assert user[3] is None
+    assert user[4] == "local"
+
+
+def test_claims_missing_username():
+    assert user_from_claims({'user_id': 1, 'type': 'access'}) is None
+
+
+def test_get_user_caches_without_password(db):
+    cache = UserCache(db, FakeRedis())
+
+    first = cache.get_user(1)
+    second = cache.get_user(1)
+
+    assert first == second
+    assert first[1] == "testuser"
+    assert first[3] is None
+    db.get_user.assert_called_once_with(user_id=1)
+
+
+def test_get_user_shared_through_redis(db):
+    shared = FakeRedis()
+    UserCache(db, shared).get_user(1)
+
+    other_process = UserCache(db, shared)
+    assert other_process.get_user(1)[1] == "testuser"
+    db.get_user.assert_called_once()
+
+
+def test_get_user_not_found(db):
+    db.get_user.return_value = None
+    cache = UserCache(db, FakeRedis())
+
+    assert cache.get_user(1) is None
+
+
+def test_invalidate(db, user_row):
+    cache = UserCache(db, FakeRedis())
+    cache.get_user(1)
+
+    db.get_user.return_value = (1, "renamed") + user_row[2:]
+    cache.invalidate(1)
+
+    assert cache.get_user(1)[1] == "renamed"
+    assert db.get_user.call_count == 2
+
+
+def test_local_ttl_expiry(db):
+    shared = FakeRedis()
+    cache = UserCache(db, shared, local_ttl=0)
+    cache.get_user(1)
+
+    shared.store.clear()
+    cache.get_user(1)
+    assert db.get_user.call_count == 2
+
+
+def test_redis_unavailable(db):
+    broken = MagicMock()
+    broken.get.side_effect = redis.ConnectionError()
+    broken.setex.side_effect = redis.ConnectionError()
+    broken.delete.side_effect = redis.ConnectionError()
+    cache = UserCache(db, broken)
+
+    assert cache.get_user(1)[1] == "testuser"
+    cache.invalidate(1)
+
+
+def test_hash_token():
+    digest = hash_token("a" * 128)
+
+    assert len(digest) == 64
+    assert digest == hash_token("a" * 128)
+    assert digest != hash_token("b" * 128)
+
+
+def test_revocation_cache():
+    revoked = RevocationCache(FakeRedis())
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+
+    assert not revoked.is_revoked("digest")
+    revoked.revoke("digest", expires_at)
+    assert revoked.is_revoked("digest")
+
+
+def test_revocation_cache_expired_token():
+    revoked = RevocationCache(FakeRedis())
+    revoked.revoke("digest", datetime.datetime.now() - datetime.timedelta(days=1))
+
+    assert not revoked.is_revoked("digest")
+
+
+def test_revocation_cache_iso_string():
+    revoked = RevocationCache(FakeRedis())
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    revoked.revoke("digest", expires_at.isoformat())
+
+    assert revoked.is_revoked("digest")
+
+
+def test_revocation_cache_deleted_user():
+    revoked = RevocationCache(FakeRedis())
+
+    assert not revoked.is_user_revoked(1)
+    revoked.revoke_user(1, 900)
+    assert revoked.is_user_revoked(1)
+    assert not revoked.is_user_revoked(2)
@@ -0,0 +1,86 @@
+import math
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from backend.comparison_pool import ComparisonError, ComparisonPool
+
+
+@pytest.fixture
+def pool():
+    pool = ComparisonPool(max_workers=1, timeout=2.0, max_tasks=3)
+    yield pool
+    pool.shutdown()
+
+
+def test_run(pool):
+    assert pool.run(math.factorial, 5) == 120
+    assert pool.run(os.getpid) != os.getpid()
+
+
+def test_deadline_replaces_worker(pool):
+    pid = pool.run(os.getpid)
+
+    started = time.monotonic()
+    with pytest.raises(ComparisonError):
+        pool.run(time.sleep, 30, timeout=0.5)
+    assert time.monotonic() - started < 5
+
+    assert pool.run(os.getpid) != pid
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_error_keeps_worker(pool):
+    pid = pool.run(os.getpid)
+
+    with pytest.raises(ComparisonError, match="ValueError"):
+        pool.run(math.sqrt, -1)
+
+    assert pool.run(os.getpid) == pid
+
+
+def test_worker_recycled_after_max_tasks(pool):
+    pids = [pool.run(os.getpid) for _ in range(4)]
+
+    assert len(set(pids[:3])) == 1
+    assert pids[3] != pids[0]
+    assert pool.stats()['recycled'] == 1
+
+
+def test_failed_replacement_keeps_slot(pool):
+    with patch.object(pool, '_spawn', side_effect=OSError("no processes left")):
+        with pytest.raises(ComparisonError):
+            pool.run(time.sleep, 30, timeout=0.5)
+
+    # The empty slot starts a new worker when it is next used
+    assert pool.run(math.factorial, 5) == 120
+
+
+def test_worker_that_does_not_start_is_replaced(pool):
+    worker = pool._idle.queue[0]
+    with patch.object(worker, 'wait_ready', side_effect=ComparisonError("did not start")):
+        with pytest.raises(ComparisonError, match="did not start"):
+            pool.run(os.getpid)
+
+    assert pool._idle.queue[0] is not worker
+    assert pool.run(math.factorial, 5) == 120
+
+
+def test_busy_pool_times_out(pool):
+    pool.acquire_timeout = 0.1
+    worker = pool._idle.get()
+    try:
+        with pytest.raises(ComparisonError, match="No comparison worker"):
+            pool.run(os.getpid)
+    finally:
+        pool._idle.put(worker)
+
+
+def test_worker_recycled_after_memory_threshold():
+    pool = ComparisonPool(max_workers=1, max_memory_mb=0)
+    try:
+        assert pool.run(os.getpid) != pool.run(os.getpid)
+    finally:
+        pool.shutdown()
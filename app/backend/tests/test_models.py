@@ -72,4 +72,89 @@ async def test_gemini_call_model_with_pdf_data(mock_client_class):
 
     result = await model.call_model(prompt="Summarize this", pdf_data=fake_pdf_data)
 
-    assert result == "PDF answer"
\ No newline at end of file
+    assert result == "PDF answer"
+
+@pytest.fixture
+def gemini_client():
+    GeminiModel._prefix_caches.clear()
+    with patch("backend.models.genai.Client") as mock_client_class:
+        mock_client = MagicMock()
+        mock_client_class.return_value = mock_client
+        yield mock_client
+    GeminiModel._prefix_caches.clear()
+
+
+def _candidates_response(texts):
+    response = MagicMock()
+    response.candidates = []
+    for text in texts:
+        candidate = MagicMock()
+        part = MagicMock()
+        part.text = text
+        candidate.content.parts = [part]
+        response.candidates.append(candidate)
+    return response
+
+
+@pytest.mark.asyncio
+@patch("backend.models.Cohere.call_model", new_callable=AsyncMock)
+async def test_call_model_n_default_calls_model_per_response(mock_call_model):
+    mock_call_model.side_effect = ["a", None, Exception("Model error"), "b"]
+    model = Cohere()
+
+    results = await model.call_model_n("prompt", 4, preamble="system", temperature=1)
+
+    assert results == ["a", "b"]
+    assert mock_call_model.call_count == 4
+    assert mock_call_model.call_args.kwargs == {'preamble': "system", 'temperature': 1}
+
+
+@pytest.mark.asyncio
+async def test_gemini_call_model_n_uses_candidates(gemini_client):
+    gemini_client.aio.models.generate_content = AsyncMock(
+        side_effect=lambda **kwargs: _candidates_response(["Final answer: 4"] * kwargs['config'].candidate_count)
+    )
+    model = GeminiModel()
+
+    results = await model.call_model_n("What is 2 + 2?", 10, temperature=1)
+
+    assert results == ["Final answer: 4"] * 10
+    counts = sorted(call.kwargs['config'].candidate_count for call in gemini_client.aio.models.generate_content.call_args_list)
+    assert counts == [2, GeminiModel.MAX_CANDIDATES]
+
+
+@pytest.mark.asyncio
+async def test_gemini_cache_prefix(gemini_client):
+    gemini_client.aio.caches.create = AsyncMock(return_value=MagicMock())
+    gemini_client.aio.caches.create.return_value.name = "cachedContents/scanner"
+    response = MagicMock()
+    response.text = "PDF content"
+    gemini_client.aio.models.generate_content = AsyncMock(return_value=response)
+    model = GeminiModel()
+
+    for _ in range(2):
+        assert await model.call_model("Extract this", pdf_data=b"%PDF-1.4", cache_prefix=True) == "PDF content"
+
+    gemini_client.aio.caches.create.assert_called_once()
+    call = gemini_client.aio.models.generate_content.call_args
+    assert call.kwargs['config'].cached_content == "cachedContents/scanner"
+    assert call.kwargs['config'].system_instruction is None
+    assert len(call.kwargs['contents']) == 1
+
+
+@pytest.mark.asyncio
+async def test_gemini_cache_prefix_too_small(gemini_client):
+    gemini_client.aio.caches.create = AsyncMock(side_effect=Exception("Cached content is too small"))
+    response = MagicMock()
+    response.text = "PDF content"
+    gemini_client.aio.models.generate_content = AsyncMock(return_value=response)
+    model = GeminiModel()
+
+    for _ in range(2):
+        assert await model.call_model("Extract this", pdf_data=b"%PDF-1.4", cache_prefix=True) == "PDF content"
+
+    # An uncacheable prefix is not retried on every request
+    gemini_client.aio.caches.create.assert_called_once()
+    call = gemini_client.aio.models.generate_content.call_args
+    assert call.kwargs['config'].cached_content is None
+    assert call.kwargs['contents'][1] == "Extract this"
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from backend.password_hasher import PasswordHasher, HasherBusyError
+
+
+@pytest.fixture(scope="module")
+def hasher():
+    hasher = PasswordHasher(max_workers=1, max_queue=1, iterations=1000)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_verify(hasher):
+    pwhash = hasher.hash("password")
+
+    assert pwhash.startswith("pbkdf2:sha256:1000$")
+    assert hasher.verify(pwhash, "password")
+    assert not hasher.verify(pwhash, "wrong")
+
+
+def test_stats(hasher):
+    hasher.hash("password")
+    stats = hasher.stats()
+
+    assert stats['in_flight'] == 0
+    assert stats['queue_depth'] == 0
+    assert stats['completed'] >= 1
+    assert stats['max_latency'] >= stats['avg_latency'] > 0
+
+
+def test_queue_full(hasher):
+    # occupy the worker and the single queue slot
+    hasher._slots.acquire()
+    hasher._slots.acquire()
+    try:
+        with pytest.raises(HasherBusyError):
+            hasher.hash("password")
+        assert hasher.stats()['rejected'] == 1
+    finally:
+        hasher._slots.release()
+        hasher._slots.release()
+
+
+def test_rejected_once_bound_is_hit(hasher):
+    rejected = hasher.stats()['rejected']
+    # one job runs and one waits in the queue
+    jobs = [threading.Thread(target=hasher._run, args=(time.sleep, 0.5)) for _ in range(2)]
+    for job in jobs:
+        job.start()
+    while hasher.stats()['in_flight'] < 2:
+        time.sleep(0.01)
+
+    started = time.perf_counter()
+    with pytest.raises(HasherBusyError):
+        hasher.hash("password")
+    assert time.perf_counter() - started < 0.1
+    assert hasher.stats()['rejected'] == rejected + 1
+
+    for job in jobs:
+        job.join()
+    assert hasher.verify(hasher.hash("password"), "password")
+
+
+def test_prometheus_text(hasher):
+    hasher.hash("password")
+    text = hasher.prometheus_text()
+
+    assert "password_hash_queue_depth 0\n" in text
+    assert "password_hash_in_flight 0\n" in text
+    assert "password_hash_rejected_total " in text
+    assert "password_hash_latency_seconds_count " in text
+    assert "# TYPE password_hash_latency_seconds summary" in text
+
+
+def test_default_cost_is_werkzeugs():
+    from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+    hasher = PasswordHasher(max_workers=1, max_queue=1)
+    try:
+        assert hasher.method == "pbkdf2:sha256"
+        assert hasher.hash("password").startswith(f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}$")
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,96 @@
+import json
+
+import redis
+
+from backend.progress import channel_for, publish_progress, stream_progress
+
+
+class FakePubSub:
+    """Replays queued messages; returns None (a timeout) once they run out."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.channels.append(channel)
+
+    def get_message(self, timeout=None):
+        if not self.messages:
+            return None
+        return {'type': 'message', 'data': json.dumps(self.messages.pop(0))}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self, messages=()):
+        self.published = []
+        self.pubsub_instance = FakePubSub(messages)
+
+    def publish(self, channel, data):
+        self.published.append((channel, json.loads(data)))
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return self.pubsub_instance
+
+
+def _events(chunks):
+    return [json.loads(chunk[len("data: "):]) for chunk in chunks if chunk.startswith("data: ")]
+
+
+def test_publish_progress():
+    client = FakeRedis()
+    publish_progress(client, "abc", "PROGRESS", {'progress': 10})
+
+    assert client.published == [(channel_for("abc"), {'state': 'PROGRESS', 'result': {'progress': 10}})]
+
+
+def test_publish_progress_redis_error():
+    class Broken:
+        def publish(self, channel, data):
+            raise redis.ConnectionError()
+
+    publish_progress(Broken(), "abc", "PROGRESS", {})
+
+
+def test_stream_until_terminal_state():
+    client = FakeRedis([
+        {'state': 'PROGRESS', 'result': {'progress': 50}},
+        {'state': 'SUCCESS', 'result': {'title': 'Exam'}},
+        {'state': 'PROGRESS', 'result': {'progress': 99}},
+    ])
+    snapshot = {'state': 'PROGRESS', 'result': {'progress': 10}}
+
+    chunks = list(stream_progress(client, "abc", lambda: snapshot))
+
+    assert _events(chunks) == [
+        snapshot,
+        {'state': 'PROGRESS', 'result': {'progress': 50}},
+        {'state': 'SUCCESS', 'result': {'title': 'Exam'}},
+    ]
+    assert client.pubsub_instance.channels == [channel_for("abc")]
+    assert client.pubsub_instance.closed
+
+
+def test_stream_finished_task():
+    client = FakeRedis([{'state': 'PROGRESS', 'result': {}}])
+
+    chunks = list(stream_progress(client, "abc", lambda: {'state': 'SUCCESS', 'result': {}}))
+
+    assert _events(chunks) == [{'state': 'SUCCESS', 'result': {}}]
+    assert client.pubsub_instance.closed
+
+
+def test_stream_heartbeat_and_max_duration():
+    client = FakeRedis()
+
+    chunks = list(stream_progress(client, "abc", lambda: {'state': 'PENDING', 'result': 'Pending...'},
+                                  heartbeat=0, max_duration=0.01))
+
+    assert chunks[0] == "retry: 1000\n\n"
+    assert chunks[1].startswith("data: ")
+    assert all(chunk == ": keep-alive\n\n" for chunk in chunks[2:])
+    assert client.pubsub_instance.closed
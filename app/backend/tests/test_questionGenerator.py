@@ -1,6 +1,6 @@
 import pytest
 import pytest_asyncio
-from backend.questionGenerator import generate_questions
+from backend.questionGenerator import generate_questions, generate_questions_within_budget
 from backend.models import Cohere
 from unittest.mock import patch, AsyncMock
 
@@ -50,7 +50,35 @@ async def test_invalid_model_response(sample_questions, mock_cohere):
     mock_cohere.return_value = '```python\n["What is 4 + 4?", "Solve for y: 2y - 3 = 7"]\n```'
     model = Cohere()
     result = await generate_questions(sample_questions, 2, model)
-    assert result == []
+    assert result == ["What is 4 + 4?", "Solve for y: 2y - 3 = 7"]
+    assert mock_cohere.call_count == 1
+
+@pytest.mark.asyncio
+async def test_json_mode_response(sample_questions, mock_cohere):
+    mock_cohere.return_value = '{"questions": ["What is 4 + 4?", "Solve for y: 2y - 3 = 7"]}'
+    model = Cohere()
+    result = await generate_questions(sample_questions, 2, model)
+    assert result == ["What is 4 + 4?", "Solve for y: 2y - 3 = 7"]
+    assert mock_cohere.call_args.kwargs['response_format']['type'] == 'json_object'
+
+@pytest.mark.asyncio
+async def test_truncated_model_response(sample_questions, mock_cohere):
+    mock_cohere.return_value = '{"questions": ["What is 4 + 4?", "Solve for y: 2y - 3 = 7", "What is'
+    model = Cohere()
+    result = await generate_questions(sample_questions, 3, model)
+    assert result == ["What is 4 + 4?", "Solve for y: 2y - 3 = 7"]
+    assert mock_cohere.call_count == 1
+
+@pytest.mark.asyncio
+async def test_unparseable_model_response_repaired(sample_questions, mock_cohere):
+    mock_cohere.side_effect = [
+        'Here are the questions: What is 4 + 4? and What is 5 + 5?',
+        '{"questions": ["What is 4 + 4?", "What is 5 + 5?"]}'
+    ]
+    model = Cohere()
+    result = await generate_questions(sample_questions, 2, model)
+    assert result == ["What is 4 + 4?", "What is 5 + 5?"]
+    assert "corrected JSON" in mock_cohere.call_args[0][0]
 
 @pytest.mark.asyncio
 async def test_model_exception(sample_questions, mock_cohere):
@@ -80,4 +108,42 @@ async def test_negative_question_count(sample_questions, mock_cohere):
     model = Cohere()
     result = await generate_questions(sample_questions, -1, model)
     assert isinstance(result, list)
-    assert len(result) == 0
\ No newline at end of file
+    assert len(result) == 0
+
+@pytest.mark.asyncio
+async def test_budget_requests_only_needed(sample_questions, mock_cohere):
+    mock_cohere.return_value = '["What is 4 + 4?", "Solve for y: 2y - 3 = 7", "What is 3 * 3?"]'
+    model = Cohere()
+
+    result = await generate_questions_within_budget(sample_questions * 5, 2, model, buffer=1, max_examples=4)
+
+    assert len(result) == 3
+    assert mock_cohere.call_count == 1
+    called_prompt = mock_cohere.call_args[0][0]
+    assert "Here are 4 questions:" in called_prompt
+    assert "Generate 3 new questions" in called_prompt
+
+@pytest.mark.asyncio
+async def test_budget_tops_up(sample_questions, mock_cohere):
+    mock_cohere.side_effect = [
+        '["What is 4 + 4?", "What is 2 + 2?", ""]',
+        '["What is 4 + 4?", "What is 5 + 5?"]',
+    ]
+    model = Cohere()
+
+    result = await generate_questions_within_budget(sample_questions, 2, model, buffer=1)
+
+    assert result == ["What is 4 + 4?", "What is 5 + 5?"]
+    assert mock_cohere.call_count == 2
+    assert "Generate 2 new questions" in mock_cohere.call_args[0][0]
+
+@pytest.mark.asyncio
+async def test_budget_gives_up(sample_questions, mock_cohere):
+    mock_cohere.side_effect = Exception("Model error")
+    model = Cohere()
+
+    result = await generate_questions_within_budget(sample_questions, 2, model, max_rounds=2)
+
+    assert result == []
+    assert mock_cohere.call_count == 2
+
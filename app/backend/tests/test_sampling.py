@@ -0,0 +1,43 @@
+import pytest
+
+from backend.sampling import difficulty, plan_budgets, plan_samples
+
+EASY = "Simplify 924/1092"
+HARD = ("Tom is painting a fence 100 feet long. He starts at the West end of the fence and paints at a rate "
+        "of 5 feet per hour. After 2 hours, Huck joins Tom and begins painting from the East end of the fence "
+        "at a rate of 8 feet per hour. After another 2 hours of the two boys painting together, Tom leaves. "
+        "How many hours does it take Huck to finish the remaining fence?")
+MEDIUM = "A bag has 3 red and 5 blue balls. Two are drawn. What is the probability that both are red?"
+
+
+def test_difficulty_orders_questions():
+    assert 0 <= difficulty(EASY) < difficulty(MEDIUM) < difficulty(HARD) <= 1
+
+
+@pytest.mark.parametrize("budget", [15, 30, 31, 45])
+def test_plan_uses_budget_within_bounds(budget):
+    samples = plan_samples([EASY, HARD, MEDIUM], budget, minimum=4, maximum=16)
+
+    assert sum(samples) == budget
+    assert all(4 <= count <= 16 for count in samples)
+    assert samples[0] <= samples[2] <= samples[1]
+
+
+def test_plan_caps_at_maximum():
+    assert plan_samples([EASY, HARD], 100, minimum=4, maximum=16) == [16, 16]
+
+
+def test_plan_small_budget():
+    assert plan_samples([EASY, HARD, MEDIUM], 6, minimum=4, maximum=16) == [2, 2, 2]
+    assert plan_samples([EASY, HARD], 1, minimum=4, maximum=16) == [1, 1]
+    assert plan_samples([], 10) == []
+
+
+def test_plan_budgets_across_groups():
+    budgets = plan_budgets([[EASY], [HARD, HARD], []], [1, 1, 0], 20, minimum=4, maximum=16)
+
+    assert budgets[2] == 0
+    assert sum(budgets) == 20
+    # A group of one question is planned with the others rather than given the average
+    assert budgets[0] < 10 < budgets[1]
+    assert budgets[:2] == plan_samples([EASY, HARD], 20, minimum=4, maximum=16)
@@ -0,0 +1,190 @@
+import contextlib
+from unittest.mock import MagicMock
+
+import pytest
+
+from backend.scheduler import JobScheduler, SchedulerBusyError, job_fingerprint
+
+
+class FakeRedis:
+    """A minimal in-memory stand-in for the Redis commands used by the job scheduler."""
+
+    def __init__(self):
+        self.store = {}
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return contextlib.nullcontext()
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    def hset(self, key, mapping):
+        self.store.setdefault(key, {}).update(mapping)
+
+    def hget(self, key, field):
+        return self.store.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+    def hdel(self, key, field):
+        self.store.get(key, {}).pop(field, None)
+
+    def rpush(self, key, value):
+        self.store.setdefault(key, []).append(value)
+
+    def lpop(self, key):
+        items = self.store.get(key)
+        return items.pop(0) if items else None
+
+    def llen(self, key):
+        return len(self.store.get(key, []))
+
+    def lmove(self, source, destination, src, dest):
+        value = self.lpop(source)
+        if value is not None:
+            self.rpush(destination, value)
+        return value
+
+    def lrem(self, key, count, value):
+        self.store[key] = [item for item in self.store.get(key, []) if item != value]
+
+    def sadd(self, key, value):
+        members = self.store.setdefault(key, set())
+        added = value not in members
+        members.add(value)
+        return int(added)
+
+    def srem(self, key, value):
+        self.store.get(key, set()).discard(value)
+
+    def zadd(self, key, mapping):
+        self.store.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        return int(self.store.get(key, {}).pop(member, None) is not None)
+
+    def zcard(self, key):
+        return len(self.store.get(key, {}))
+
+    def zrangebyscore(self, key, low, high):
+        return [member for member, score in self.store.get(key, {}).items() if low <= score <= high]
+
+
+@pytest.fixture
+def celery_app():
+    return MagicMock()
+
+
+def sent_owners(celery_app):
+    return [call.kwargs['args'][0] for call in celery_app.send_task.call_args_list]
+
+
+def test_submit_dispatches_with_job_id(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app)
+
+    job_id = scheduler.submit("user:1", "user", "backend.task.generate_exam_task", (b"pdf", 3), {'flag': True})
+
+    celery_app.send_task.assert_called_once_with(
+        "backend.task.generate_exam_task", args=[b"pdf", 3], kwargs={'flag': True}, task_id=job_id
+    )
+
+
+def test_pending_limit(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, pending_limits={'user': 2, 'guest': 1})
+
+    scheduler.submit("user:1", "user", "task")
+    scheduler.submit("user:1", "user", "task")
+    with pytest.raises(SchedulerBusyError):
+        scheduler.submit("user:1", "user", "task")
+    scheduler.submit("user:2", "user", "task")
+
+
+def test_running_limit_defers_until_release(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, running_limits={'user': 1, 'guest': 1})
+
+    first = scheduler.submit("user:1", "user", "task", ("first",))
+    scheduler.submit("user:1", "user", "task", ("second",))
+    assert sent_owners(celery_app) == ["first"]
+
+    scheduler.release(first)
+    assert sent_owners(celery_app) == ["first", "second"]
+
+    scheduler.release(first)
+    assert celery_app.send_task.call_count == 2
+
+
+def test_round_robin_between_owners(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, max_running=1, weights={'user': 1, 'guest': 1})
+
+    running = scheduler.submit("user:1", "user", "task", ("blocker",))
+    for i in range(3):
+        scheduler.submit("user:1", "user", "task", (f"user:1 job {i}",))
+    scheduler.submit("user:2", "user", "task", ("user:2 job 0",))
+
+    scheduler.release(running)
+    scheduler.release(celery_app.send_task.call_args.kwargs['task_id'])
+
+    assert sent_owners(celery_app) == ["blocker", "user:1 job 0", "user:2 job 0"]
+
+
+def test_weighted_classes(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, max_running=1,
+                             running_limits={'user': 5, 'guest': 5}, pending_limits={'user': 5, 'guest': 5})
+
+    running = scheduler.submit("guest:a", "guest", "task", ("blocker",))
+    for i in range(3):
+        scheduler.submit("guest:a", "guest", "task", (f"guest {i}",))
+        scheduler.submit("user:1", "user", "task", (f"user {i}",))
+
+    for _ in range(6):
+        scheduler.release(running)
+        running = celery_app.send_task.call_args.kwargs['task_id']
+
+    assert sent_owners(celery_app)[1:] == ["user 0", "user 1", "guest 0", "user 2", "guest 1", "guest 2"]
+
+
+def test_sweep_releases_stale_jobs(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, running_limits={'user': 1, 'guest': 1}, job_timeout=-1)
+
+    scheduler.submit("user:1", "user", "task", ("first",))
+    scheduler.submit("user:1", "user", "task", ("second",))
+
+    assert scheduler.sweep() == 1
+    assert sent_owners(celery_app) == ["first", "second"]
+
+
+def test_job_fingerprint():
+    fingerprint = job_fingerprint("user:1", [b"pdf one", b"pdf two"], 3, "Title", "Description")
+
+    assert fingerprint == job_fingerprint("user:1", [b"pdf one", b"pdf two"], 3, "Title", "Description")
+    assert fingerprint != job_fingerprint("user:2", [b"pdf one", b"pdf two"], 3, "Title", "Description")
+    assert fingerprint != job_fingerprint("user:1", [b"pdf one"], 3, "Title", "Description")
+    assert fingerprint != job_fingerprint("user:1", [b"pdf one", b"pdf two"], 4, "Title", "Description")
+
+
+def test_duplicate_submission(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app, pending_limits={'user': 1, 'guest': 1})
+
+    first = scheduler.submit("user:1", "user", "task", fingerprint="abc")
+    assert scheduler.submit("user:1", "user", "task", fingerprint="abc") == first
+
+    scheduler.release(first)
+    assert scheduler.submit("user:1", "user", "task", fingerprint="abc") == first
+    assert celery_app.send_task.call_count == 1
+
+
+def test_duplicate_of_failed_job(celery_app):
+    scheduler = JobScheduler(FakeRedis(), celery_app)
+
+    first = scheduler.submit("user:1", "user", "task", fingerprint="abc")
+    scheduler.release(first, failed=True)
+
+    assert scheduler.submit("user:1", "user", "task", fingerprint="abc") != first
+    assert celery_app.send_task.call_count == 2
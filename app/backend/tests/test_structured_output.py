@@ -0,0 +1,31 @@
+import pytest
+
+from backend.structured_output import salvage_json, string_list
+
+
+@pytest.mark.parametrize("text, expected, complete", [
+    ('["a", "b"]', ["a", "b"], True),
+    ('{"questions": ["a", "b"]}', {"questions": ["a", "b"]}, True),
+    ('```json\n["a", "b"]\n```', ["a", "b"], True),
+    ('Sure! Here is the list: ["a", "b"] Hope this helps.', ["a", "b"], True),
+    ("['a', \"b\"]", ["a", "b"], True),
+    ('["a", "b", "c', ["a", "b"], False),
+    ('{"questions": ["a", "b", "c', {"questions": ["a", "b"]}, False),
+    ('{"questions": ["a, with comma", "b\\" quoted", "c', {"questions": ["a, with comma", 'b" quoted']}, False),
+    ('{"questions": [', {"questions": []}, False),
+    ('[["a", "b"], ["c"', [["a", "b"], []], False),
+])
+def test_salvage_json(text, expected, complete):
+    assert salvage_json(text) == (expected, complete)
+
+
+@pytest.mark.parametrize("text", [None, "", "no json here", '"just a string"'])
+def test_salvage_json_nothing(text):
+    assert salvage_json(text) == (None, False)
+
+
+def test_string_list():
+    assert string_list({"questions": ["a", " b ", "", 3]}, "questions") == ["a", "b"]
+    assert string_list(["a"], "questions") == ["a"]
+    assert string_list({"other": ["a"]}, "questions") == []
+    assert string_list(None, "questions") == []
@@ -0,0 +1,278 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from celery.signals import task_success
+
+from backend.PdfScanner.pdfobject import PDFObject
+import backend.task as task
+
+
+@pytest.fixture
+def eager():
+    task.celery.conf.task_always_eager = True
+    task.celery.conf.task_eager_propagates = True
+    # Eagerly replacing a task with a chord joins the chord inside the task
+    with patch('celery.result.task_join_will_block', return_value=False):
+        yield
+    task.celery.conf.task_always_eager = False
+    task.celery.conf.task_eager_propagates = False
+
+
+@pytest.fixture
+def db():
+    db = MagicMock()
+    db.take_bank_questions.return_value = []
+    db.count_bank_questions.return_value = 0
+    with patch.object(task, '_db', return_value=db):
+        yield db
+
+
+@pytest.fixture
+def models(db):
+    async def generate_answers(question, n, model, comparator=None, first_pass=0):
+        return {f"answer to {question}": 100}
+
+    scanner = MagicMock()
+    scanner.scan_pdfs = AsyncMock(return_value=[PDFObject([("example question", "example answer")])])
+    generated = AsyncMock(return_value=[f"question {i}" for i in range(4)])
+
+    with patch.object(task, 'GeminiModel'), patch.object(task, 'Cohere'), \
+            patch.object(task, 'GeminiPDFScanner', return_value=scanner), \
+            patch.object(task.questionGenerator, 'generate_questions', generated), \
+            patch.object(task.answerGenerator, 'generate_answers', generate_answers):
+        yield scanner, generated
+
+
+def test_generate_exam_task(eager, models):
+    scanner, generated = models
+
+    exam_data = task.generate_exam_task.delay([b"pdf one", b"pdf two"], 3, "Title", "Description").get()
+
+    assert exam_data["title"] == "Title"
+    assert exam_data["description"] == "Description"
+    assert len(exam_data["questions"]) == 3
+    for item in exam_data["questions"]:
+        assert item["answers"] == {f"answer to {item['question']}": 100}
+    assert scanner.scan_pdfs.await_count == 2
+    assert generated.await_count == 2
+
+
+def test_generate_and_save_exam_task(eager, models, db):
+    db.add_exam.return_value = 7
+
+    result = task.generate_and_save_exam_task.delay(
+        [b"pdf"], 2, "Title", "Description", "#ffffff", True, "testuser"
+    ).get()
+
+    assert result["exam_id"] == 7
+    assert result["usage"]["calls"] == 0
+    db.add_exam.assert_called_once_with(
+        username="testuser", name="Title", color="#ffffff", description="Description", public=True
+    )
+    assert db.insert_question.call_count == 2
+
+
+def test_short_pdf_filled_with_spares(eager, models, db):
+    scanner, generated = models
+    scanner.scan_pdfs.side_effect = lambda pdfs: [PDFObject([(f"example from {pdfs[0].decode()}", "answer")])]
+    # The first PDF only ever comes up with one question for its share of two
+    generated.side_effect = lambda examples, n, model: (
+        ["lonely question"] if examples == ["example from short pdf"] else [f"question {i}" for i in range(n)]
+    )
+
+    exam_data = task.generate_exam_task.delay([b"short pdf", b"long pdf"], 4, "Title", "Description").get()
+
+    questions = [item["question"] for item in exam_data["questions"]]
+    assert len(questions) == 4
+    assert len(set(questions)) == 4
+    assert "lonely question" in questions
+    db.add_bank_questions.assert_not_called()
+
+
+def test_unused_spares_banked(eager, models, db):
+    exam_data = task.generate_exam_task.delay([b"pdf"], 2, "Title", "Description").get()
+
+    assert len(exam_data["questions"]) == 2
+    source, spares = db.add_bank_questions.call_args.args
+    assert source == task.hashlib.sha256(b"pdf").hexdigest()
+    assert len(spares) == task.QUESTION_BUFFER
+    assert spares[0][0] not in [item["question"] for item in exam_data["questions"]]
+
+
+def test_generate_exam_task_invalid_pdf_count(eager, models):
+    with pytest.raises(ValueError):
+        task.generate_exam_task.delay([], 3, "Title", "Description").get()
+
+
+def test_no_questions_generated(eager, models):
+    _, generated = models
+    generated.return_value = []
+
+    with pytest.raises(Exception, match="No questions could be generated"):
+        task.generate_exam_task.delay([b"pdf"], 3, "Title", "Description").get()
+
+
+def test_model_calls_have_deadline(eager, models):
+    scanner, _ = models
+
+    async def hang(pdfs):
+        await asyncio.sleep(60)
+
+    scanner.scan_pdfs = hang
+    with patch.object(task, 'SCAN_DEADLINE', 0.01), patch.object(task.scan_pdf_task, 'max_retries', 0):
+        with pytest.raises(TimeoutError):
+            task.scan_pdf_task.delay(b"pdf", job_id="job").get()
+
+
+def test_models_shared_by_tasks_of_a_thread(eager, models):
+    loops = []
+
+    async def generate_answers(question, n, model, comparator=None, first_pass=0):
+        loops.append((asyncio.get_running_loop(), model))
+        return {"answer": 100}
+
+    with patch.object(task.answerGenerator, 'generate_answers', generate_answers):
+        for index in range(2):
+            task.answer_question_task.delay("question", job_id="job", index=index, total=2).get()
+
+    assert loops[0] == loops[1]
+    task.Cohere.assert_called_once_with('command-a-03-2025')
+
+
+def test_questions_drawn_from_bank(eager, models, db):
+    _, generated = models
+    db.take_bank_questions.return_value = [("banked question", {"banked answer": 100})]
+
+    exam_data = task.generate_exam_task.delay([b"pdf"], 3, "Title", "Description").get()
+
+    questions = {item["question"]: item["answers"] for item in exam_data["questions"]}
+    assert len(questions) == 3
+    assert questions["banked question"] == {"banked answer": 100}
+    db.take_bank_questions.assert_called_once_with(task.hashlib.sha256(b"pdf").hexdigest(), 3)
+
+
+def test_bank_questions_returned_on_failure(eager, models, db):
+    _, generated = models
+    db.take_bank_questions.return_value = [("banked question", {"banked answer": 100})]
+
+    with patch.object(task, '_record_partial', side_effect=RuntimeError("backend down")):
+        # The planning stage retries, and eagerly the last retry surfaces as celery's Retry
+        with pytest.raises(Exception, match="backend down"):
+            task.generate_exam_task.delay([b"pdf"], 3, "Title", "Description").get()
+
+    assert db.return_bank_questions.call_count == db.take_bank_questions.call_count
+    db.return_bank_questions.assert_called_with(task.hashlib.sha256(b"pdf").hexdigest(), ["banked question"])
+    generated.assert_not_awaited()
+
+
+def test_exam_entirely_from_bank(eager, models, db):
+    _, generated = models
+    db.take_bank_questions.side_effect = lambda source, count: [
+        (f"banked question {i}", {"banked answer": 100}) for i in range(count)
+    ]
+
+    exam_data = task.generate_exam_task.delay([b"pdf one", b"pdf two"], 4, "Title", "Description").get()
+
+    assert sorted(item["question"] for item in exam_data["questions"]) == [
+        "banked question 0", "banked question 0", "banked question 1", "banked question 1"
+    ]
+    generated.assert_not_awaited()
+
+
+def test_refill_question_bank(eager, models, db):
+    _, generated = models
+    db.count_bank_questions.return_value = task.QUESTION_BANK_TARGET - 3
+    db.add_bank_questions.side_effect = lambda source, questions: len(questions)
+
+    added = task.refill_question_bank_task.delay("source", ["example question"], ["candidate"]).get()
+
+    assert added == 3
+    source, questions = db.add_bank_questions.call_args.args
+    assert source == "source"
+    assert [question for question, _ in questions] == ["candidate", "question 0", "question 1"]
+    assert questions[0][1] == {"answer to candidate": 100}
+
+
+def test_purge_refresh_tokens_uses_shared_db(eager, db):
+    db.delete_expired_refresh_tokens.side_effect = [2, 2, 1]
+
+    assert task.purge_refresh_tokens_task.delay(batch_size=2).get() == 5
+    assert db.delete_expired_refresh_tokens.call_count == 3
+
+
+def test_usage_attributed_to_job(eager, models):
+    async def generate_answers(question, n, model, comparator=None, first_pass=0):
+        with task.usage.stage('answer'):
+            task.usage.record_call('cohere', 'model', 0.5, 1, 100, 20, 'success')
+        return {"answer": 100}
+
+    with patch.object(task.answerGenerator, 'generate_answers', generate_answers), \
+            patch.object(task.usage, 'flush') as flush:
+        result = task.generate_exam_task.apply(args=([b"pdf"], 2, "Title", "Description"), task_id="job").get()
+
+    assert len(result["questions"]) == 2
+    flushed = [call for call in flush.call_args_list if call.args[1]]
+    # The exam's questions and the spare
+    assert len(flushed) == 2 + task.QUESTION_BUFFER
+    for call in flushed:
+        assert call.kwargs['job_id'] == "job"
+        assert call.args[1] == [{
+            'provider': 'cohere', 'model': 'model', 'stage': 'answer', 'latency': 0.5,
+            'attempts': 1, 'input_tokens': 100, 'output_tokens': 20, 'outcome': 'success'
+        }]
+    assert not task._usage_runs
+
+
+def test_job_usage_flushed_before_stage_results(eager, models):
+    async def generate_answers(question, n, model, comparator=None, first_pass=0):
+        with task.usage.stage('answer'):
+            task.usage.record_call('cohere', 'model', 0.5, 1, 100, 20, 'success')
+        return {"answer": 100}
+
+    # The job's usage as stored, and the order in which usage and results are recorded
+    stored = []
+    events = []
+
+    def flush(client, records, job_id=None, ttl=None):
+        stored.extend(records)
+        events.extend(("usage", record['stage']) for record in records)
+
+    def stored_result(sender=None, **kwargs):
+        if sender.name == task.answer_question_task.name:
+            events.append(("result", "answer"))
+
+    task_success.connect(stored_result)
+    try:
+        with patch.object(task.answerGenerator, 'generate_answers', generate_answers), \
+                patch.object(task.usage, 'flush', flush), \
+                patch.object(task.usage, 'job_usage', lambda client, job_id: task.usage.summarize(stored)):
+            result = task.generate_exam_task.apply(args=([b"pdf"], 2, "Title", "Description"), task_id="job").get()
+    finally:
+        task_success.disconnect(stored_result)
+
+    answers = 2 + task.QUESTION_BUFFER
+    assert events == [("usage", "answer"), ("result", "answer")] * answers
+    assert result["usage"]["calls"] == answers
+    assert not task._usage_runs
+
+
+def test_task_names_registered():
+    from backend import celery_app
+
+    assert celery_app.GENERATE_EXAM_TASK == task.generate_exam_task.name
+    assert celery_app.GENERATE_AND_SAVE_EXAM_TASK == task.generate_and_save_exam_task.name
+    for name in task.celery.conf.task_routes:
+        assert name in task.celery.tasks
+
+
+def test_celery_app_imports_no_pipeline():
+    import subprocess
+    import sys
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, backend.celery_app; print(sorted(m for m in sys.modules "
+                               "if m in ('backend.task', 'backend.models', 'sympy')))"],
+        check=True, capture_output=True, text=True
+    ).stdout
+    assert loaded.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,155 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from backend import usage
+from backend.models import Cohere
+
+
+class FakeRedis:
+    """A minimal in-memory stand-in for the Redis hash commands used by the usage records."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+
+    def hincrbyfloat(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = str(float(fields.get(field, 0)) + amount)
+
+    def expire(self, key, ttl):
+        pass
+
+    def hgetall(self, key):
+        return {k.encode(): v.encode() for k, v in self.hashes.get(key, {}).items()}
+
+
+def _record(stage='answer', outcome='success', input_tokens=100, output_tokens=20):
+    with usage.stage(stage):
+        return usage.record_call('cohere', 'command', 0.5, 2, input_tokens, output_tokens, outcome)
+
+
+def test_records_collected_with_stage():
+    with usage.collect() as records:
+        _record('scan')
+        with usage.stage('answer'):
+            with usage.stage('equivalence'):
+                usage.record_call('cohere', 'command', 0.1, 1, 1, 1, 'success')
+            usage.record_call('cohere', 'command', 0.1, 1, 1, 1, 'success')
+        usage.record_call('cohere', 'command', 0.1, 1, 1, 1, 'success')
+
+    assert [record['stage'] for record in records] == ['scan', 'equivalence', 'answer', 'other']
+    # Outside a collection calls are only logged
+    _record()
+    assert len(records) == 4
+
+
+def test_stage_carries_into_tasks():
+    async def call():
+        usage.record_call('cohere', 'command', 0.1, 1, 1, 1, 'success')
+
+    async def run():
+        with usage.stage('answer'):
+            await asyncio.gather(call(), call())
+
+    with usage.collect() as records:
+        asyncio.run(run())
+
+    assert [record['stage'] for record in records] == ['answer', 'answer']
+
+
+def test_summarize():
+    with usage.collect() as records:
+        _record('answer')
+        _record('answer', outcome='timeout', input_tokens=0, output_tokens=0)
+        _record('generate', input_tokens=50)
+
+    summary = usage.summarize(records)
+
+    assert summary['calls'] == 3
+    assert summary['attempts'] == 6
+    assert summary['input_tokens'] == 150
+    assert summary['output_tokens'] == 40
+    assert summary['failures'] == 1
+    assert summary['stages']['answer']['calls'] == 2
+    assert summary['stages']['generate']['input_tokens'] == 50
+
+
+def test_flush_and_job_usage():
+    client = FakeRedis()
+    with usage.collect() as first:
+        _record('scan')
+    with usage.collect() as second:
+        _record('answer', outcome='rejected')
+
+    usage.flush(client, first, job_id="job")
+    usage.flush(client, second, job_id="job")
+    usage.flush(client, second)
+
+    job = usage.job_usage(client, "job")
+    assert job['calls'] == 2
+    assert job['input_tokens'] == 200
+    assert job['latency'] == 1.0
+    assert job['failures'] == 1
+    assert job['stages']['scan']['output_tokens'] == 20
+
+    assert usage.job_usage(client, "other job")['calls'] == 0
+    assert usage.job_usage(None, "job")['calls'] == 0
+
+
+def test_prometheus_text():
+    client = FakeRedis()
+    with usage.collect() as records:
+        _record('answer')
+        _record('answer')
+    usage.flush(client, records)
+
+    text = usage.prometheus_text(client)
+
+    assert "# TYPE llm_calls_total counter" in text
+    assert 'llm_calls_total{provider="cohere",model="command",stage="answer",outcome="success"} 2' in text
+    assert 'llm_input_tokens_total{provider="cohere",model="command",stage="answer",outcome="success"} 200' in text
+
+
+@pytest.mark.asyncio
+@patch("backend.models.cohere.AsyncClient.chat", new_callable=AsyncMock)
+async def test_cohere_call_recorded(mock_chat):
+    mock_chat.return_value = MagicMock(text="Final answer: 42")
+    mock_chat.return_value.meta.billed_units.input_tokens = 12.0
+    mock_chat.return_value.meta.billed_units.output_tokens = 3.0
+    model = Cohere()
+
+    with usage.collect() as records:
+        with usage.stage('answer'):
+            await model.call_model("What's 6 * 7?")
+
+    assert len(records) == 1
+    assert records[0]['provider'] == 'cohere'
+    assert records[0]['stage'] == 'answer'
+    assert records[0]['attempts'] == 1
+    assert (records[0]['input_tokens'], records[0]['output_tokens']) == (12, 3)
+    assert records[0]['outcome'] == 'success'
+
+
+@pytest.mark.asyncio
+@patch("backend.models.cohere.AsyncClient.chat", new_callable=AsyncMock)
+async def test_cohere_failed_call_recorded(mock_chat):
+    mock_chat.side_effect = asyncio.TimeoutError()
+    model = Cohere(max_retries=2)
+
+    with usage.collect() as records:
+        assert await model.call_model("What's 6 * 7?") is None
+
+    assert len(records) == 1
+    assert records[0]['attempts'] == 2
+    assert records[0]['outcome'] == 'timeout'
@@ -169,4 +169,244 @@ def test_llm_answer_comparator(ans1, ans2, expected_status, expected_state):
 # def test_llm_answer_comparator(ans1, ans2, expected):
 #     comparator = LLMAnswerComparator(tolerance=1e-5)
 #     result = asyncio.run(comparator.llm_answers_equivalent_full(ans1, ans2)).status
-#     assert result == expected, f"Failed on: {ans1} vs {ans2}"
\ No newline at end of file
+#     assert result == expected, f"Failed on: {ans1} vs {ans2}"
+
+def test_symbolic_comparison_deadline(monkeypatch):
+    from backend import validation
+    from backend.comparison_pool import ComparisonPool
+
+    pool = ComparisonPool(max_workers=1, timeout=0.5)
+    monkeypatch.setattr(validation, "comparison_pool", lambda: pool)
+    monkeypatch.setattr(validation, "_sympy_stages", _slow_sympy_stages)
+
+    async def llm_check(self, ans1, ans2):
+        return Equality.UNEQUAL
+
+    monkeypatch.setattr(LLMAnswerComparator, "llm_check", llm_check)
+    try:
+        result = asyncio.run(LLMAnswerComparator().llm_answers_equivalent_full("x**2", "x*x"))
+    finally:
+        pool.shutdown()
+
+    # The abandoned comparison is left to the LLM
+    assert result.status == Equality.UNEQUAL
+    assert result.state[-1] == {"type": "llm comparison", "reason": "not equal"}
+
+
+def _slow_sympy_stages(tolerance, a, b):
+    import time
+    time.sleep(30)
+
+
+def test_answers_parsed_once():
+    from unittest.mock import patch
+    import sympy.parsing.sympy_parser as sympy_parser
+
+    comparator = LLMAnswerComparator(tolerance=1e-5)
+    answers = ["x + x", "2*x", "x*2", "3*x"]
+    with patch.object(sympy_parser, "parse_expr", wraps=sympy_parser.parse_expr) as parse_expr:
+        for i, a in enumerate(answers):
+            for b in answers[i + 1:]:
+                comparator._llm_answers_equivalent(a, b)
+
+    # sympy calls parse_expr itself (e.g. when loading its units), so only our calls are counted
+    parsed = [call.args[0] for call in parse_expr.call_args_list]
+    for normalized in ("x+x", "2*x", "x*2", "3*x"):
+        assert parsed.count(normalized) == 1
+
+
+# Outputs of the normalization before its patterns were precompiled
+@pytest.mark.parametrize(
+    "answer, expected",
+    [
+        ("\\frac{10}{2}", "\\frac{10}{2}"),
+        ("5", "5"),
+        ("7 \\frac{3}{4}", "7+3/4"),
+        ("7.75", "7.75"),
+        ("3+4j", "3+4j"),
+        ("3", "3"),
+        ("3.01", "3.01"),
+        ("The expression is 4.3", "Theexpressionis4.3"),
+        ("The expression is 2 + 2.3", "Theexpressionis2+2.3"),
+        ("42", "42"),
+        ("-17", "-17"),
+        ("007", "7"),
+        ("5.0", "5"),
+        ("3.14159", "3.14159"),
+        ("1,234,567", "1234567"),
+        ("1,2,345", "1,2,345"),
+        ("12,34", "12,34"),
+        ("\\frac{3}{4}", "\\frac{3}{4}"),
+        ("\\frac34", "\\frac{3}{4}"),
+        ("\\frac 1{2}", "\\frac{1}{2}"),
+        ("\\sqrt2", "\\sqrt{2}"),
+        ("\\sqrt{3}x", "\\sqrt{3}x"),
+        ("\\left( 1, 2 \\right)", "(1,2)"),
+        ("5 \\text{ cm}", "5"),
+        ("\\text{5}", "5"),
+        ("x \\text{or} y", "x,y"),
+        ("12 feet", "12"),
+        ("3 inches", "3"),
+        ("45^\\circ", "45"),
+        ("90^{\\circ}", "90"),
+        ("\\$1.50", "1.50"),
+        ("50\\%", "50"),
+        ("2 million", "2*10^6"),
+        ("x \\in (0, 1)", "(0,1)"),
+        ("7 3/4", "7+3/4"),
+        ("- 4", "-4"),
+        ("4 hours and 30 minutes", "4,30"),
+        ("Tuesday", "Tuesday"),
+        ("3 days", "3"),
+        ("6 p.m.", "6"),
+        ("\\mbox{m} 5", ""),
+        ("\\!5", "5"),
+        ("{5}", "5"),
+        ("secondegree", "secon"),
+        ("x^2 cm^2", "x^2"),
+    ],
+)
+def test_normalize_answer_string(answer, expected):
+    assert LLMAnswerComparator(cache_size=0).normalize_answer_string(answer) == expected
+
+
+def _unsettled(monkeypatch):
+    from backend.validation import ValidationObject
+
+    async def deterministic_equivalent(self, ans1, ans2):
+        return ValidationObject()
+
+    monkeypatch.setattr(LLMAnswerComparator, "deterministic_equivalent", deterministic_equivalent)
+
+
+def test_equivalence_matrix_partitions_in_one_call(monkeypatch):
+    from unittest.mock import AsyncMock, patch
+
+    _unsettled(monkeypatch)
+    llm_check = AsyncMock()
+    monkeypatch.setattr(LLMAnswerComparator, "llm_check", llm_check)
+    with patch("backend.models.Cohere.call_model_json", new_callable=AsyncMock) as call:
+        # Answer 3 is left out, and the out of range and repeated numbers are ignored
+        call.return_value = {"groups": [[0, 2, 7], [1, 0]]}
+        matrix = asyncio.run(LLMAnswerComparator().equivalence_matrix(["1/2", "x", "0.5", "y"]))
+
+    assert call.call_count == 1
+    assert call.call_args.kwargs["temperature"] == 0
+    llm_check.assert_not_called()
+    assert matrix[0][2] is True
+    assert not any(matrix[i][j] for i in range(4) for j in range(i + 1, 4) if (i, j) != (0, 2))
+
+
+def test_equivalence_matrix_falls_back_to_pairs(monkeypatch):
+    from unittest.mock import AsyncMock, patch
+
+    _unsettled(monkeypatch)
+
+    async def llm_check(self, ans1, ans2):
+        return Equality.EQUAL if {ans1, ans2} == {"1/2", "0.5"} else Equality.UNEQUAL
+
+    monkeypatch.setattr(LLMAnswerComparator, "llm_check", llm_check)
+    with patch("backend.models.Cohere.call_model_json", new_callable=AsyncMock) as call:
+        call.return_value = None
+        matrix = asyncio.run(LLMAnswerComparator().equivalence_matrix(["1/2", "x", "0.5"]))
+
+    assert matrix[0][2] is True
+    assert matrix[0][1] is False and matrix[1][2] is False
+
+
+def test_equivalence_matrix_settled_without_llm():
+    from unittest.mock import AsyncMock, patch
+
+    with patch("backend.models.Cohere.call_model_json", new_callable=AsyncMock) as call:
+        matrix = asyncio.run(LLMAnswerComparator().equivalence_matrix(["4", "4.0", "5"]))
+
+    call.assert_not_called()
+    assert matrix[0][1] is True
+    assert matrix[0][2] is False and matrix[1][2] is False
+
+
+def test_bulk_compare_matches_pairwise():
+    answers = ["5", "\\frac{10}{2}", "5.00001", "5.1", "1,000", "1000", "\\text{five}", "Five", "x^2", "1e-30", "-0.0", "0"]
+    comparator = LLMAnswerComparator(tolerance=1e-5)
+    matrix, unresolved = comparator.bulk_compare(answers)
+
+    for i in range(len(answers)):
+        for j in range(i + 1, len(answers)):
+            validation, _, _ = comparator._cheap_stages(answers[i], answers[j])
+            if validation.status == Equality.FAILED:
+                assert (i, j) in unresolved and matrix[i][j] is False
+            else:
+                assert (i, j) not in unresolved
+                assert matrix[i][j] == (validation.status == Equality.EQUAL), (answers[i], answers[j])
+    assert (0, 2) not in unresolved and matrix[0][2] is True
+
+
+def test_validation_object_is_compact():
+    import pickle
+    from backend.validation import ValidationObject
+
+    result = ValidationObject()
+    assert result.state == [] and result.stage is None
+    assert not hasattr(result, "__dict__")
+
+    result.add_equal("matrices", "up to rounding")
+    result = pickle.loads(pickle.dumps(result))
+    assert result.status == Equality.EQUAL and result.stage == ValidationObject.MATRICES
+    assert result.state == [
+        {"type": "string comparison", "reason": "not equal"},
+        {"type": "math comparison", "reason": "failed"},
+        {"type": "brackets comparison", "reason": "failed"},
+        {"type": "matrices comparison", "reason": "success up to rounding"},
+    ]
+
+
+def test_llm_check_uses_injected_model():
+    from unittest.mock import AsyncMock, MagicMock
+
+    model = MagicMock()
+    model.call_model = AsyncMock(return_value="1/2 = 0.5\nDecision: yes")
+    comparator = LLMAnswerComparator(model=model)
+
+    assert asyncio.run(comparator.llm_check("1/2", "0.5")) == Equality.EQUAL
+    model.call_model.assert_awaited_once()
+
+
+def test_default_model_shared_per_event_loop(monkeypatch):
+    from unittest.mock import AsyncMock, MagicMock
+    from backend import validation
+
+    created = []
+
+    def cohere():
+        model = MagicMock()
+        model.call_model = AsyncMock(return_value="Decision: no")
+        created.append(model)
+        return model
+
+    monkeypatch.setattr(validation, "Cohere", cohere)
+
+    async def compare_twice():
+        await LLMAnswerComparator().llm_check("x", "y")
+        await LLMAnswerComparator().llm_check("x", "z")
+
+    asyncio.run(compare_twice())
+    assert len(created) == 1
+    assert created[0].call_model.await_count == 2
+
+    # The client's connections belong to the loop, so a new loop gets its own model
+    asyncio.run(compare_twice())
+    assert len(created) == 2
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("so \\boxed{\\frac{1}{2}}.", "\\frac{1}{2}"),
+    ("first \\boxed{1}, then \\boxed{ 2 }", "2"),
+    ("so \\fbox{7}", "7"),
+    ("\\boxed{1} or \\fbox{2}", "2"),
+    ("\\fbox{1} or \\boxed{2}", "2"),
+    ("unclosed \\boxed{\\frac{1}{2}", "unclosed \\boxed{\\frac{1}{2}"),
+    ("\\boxed 5", "\\boxed 5"),
+    ("the final answer is 12", "12"),
+])
+def test_extract_answer(text, expected):
+    assert LLMAnswerComparator().extract_answer(text) == expected
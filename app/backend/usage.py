@@ -0,0 +1,246 @@
+import contextlib
+import contextvars
+import json
+import logging
+from typing import Iterator, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# The pipeline stages LLM calls are attributed to; calls made outside any stage are 'other'
+STAGES = ('scan', 'validate', 'generate', 'answer', 'equivalence')
+OUTCOMES = ('success', 'rejected', 'timeout', 'error')
+
+# Summed per record, in this order, in the Redis hashes and the Prometheus counters
+_METRICS = ('calls', 'attempts', 'input_tokens', 'output_tokens', 'latency')
+
+_stage = contextvars.ContextVar('llm_stage', default='other')
+_records = contextvars.ContextVar('llm_usage_records', default=None)
+
+TOTALS_KEY = "llm-usage"
+
+
+def job_key(job_id: str) -> str:
+    """Returns the Redis hash holding the aggregated usage of a job."""
+    return f"job-usage:{job_id}"
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Attributes the model calls made within the block to a pipeline stage.
+
+    The stage is a context variable, so it carries over into the asyncio tasks
+    started within the block, and the innermost stage wins.
+
+    Args:
+        name (str): One of `STAGES`.
+    """
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def start_collection() -> tuple[list[dict], contextvars.Token]:
+    """
+    Starts collecting the records of the model calls made in the current context.
+
+    Returns:
+        tuple: The list the records are appended to, and the token to pass to `stop_collection`.
+    """
+    records = []
+    return records, _records.set(records)
+
+
+def stop_collection(token: contextvars.Token) -> None:
+    """Stops the collection started with the given token, resuming any enclosing collection."""
+    _records.reset(token)
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[list[dict]]:
+    """
+    Collects the records of the model calls made within the block.
+
+    Yields:
+        list[dict]: The list the records are appended to.
+    """
+    records, token = start_collection()
+    try:
+        yield records
+    finally:
+        stop_collection(token)
+
+
+def record_call(provider: str,
+                model: str,
+                latency: float,
+                attempts: int,
+                input_tokens: int,
+                output_tokens: int,
+                outcome: str) -> dict:
+    """
+    Records one model call (with all its retries) in the current collection and the structured log.
+
+    Args:
+        provider (str): The provider name, e.g. 'gemini' or 'cohere'.
+        model (str): The model name.
+        latency (float): Seconds from the first attempt to the last response.
+        attempts (int): The number of requests made, retries included.
+        input_tokens (int): The input tokens billed over all attempts.
+        output_tokens (int): The output tokens billed over all attempts.
+        outcome (str): One of `OUTCOMES`; the reason the last attempt failed if none succeeded.
+
+    Returns:
+        dict: The record.
+    """
+    record = {
+        'provider': provider,
+        'model': model,
+        'stage': _stage.get(),
+        'latency': round(latency, 4),
+        'attempts': attempts,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'outcome': outcome,
+    }
+    records = _records.get()
+    if records is not None:
+        records.append(record)
+    logger.info(json.dumps({'event': 'llm_call', **record}))
+    return record
+
+
+def summarize(records: list[dict]) -> dict:
+    """
+    Aggregates call records.
+
+    Args:
+        records (list[dict]): Records as returned by `record_call`.
+
+    Returns:
+        dict: The totals of `calls`, `attempts`, `input_tokens`, `output_tokens`, `latency`
+              and `failures`, and the same totals per stage under `stages`.
+    """
+    summary = {metric: 0 for metric in _METRICS}
+    summary['failures'] = 0
+    summary['stages'] = {}
+    for record in records:
+        stage_summary = summary['stages'].setdefault(record['stage'], {metric: 0 for metric in _METRICS})
+        for target in (summary, stage_summary):
+            target['calls'] += 1
+            for metric in _METRICS[1:]:
+                target[metric] += record[metric]
+        if record['outcome'] != 'success':
+            summary['failures'] += 1
+    return summary
+
+
+def flush(redis_client: Optional[redis.Redis], records: list[dict], job_id: Optional[str] = None, ttl: int = 3600) -> None:
+    """
+    Adds call records to the process-wide totals in Redis and, given a job id, to the job's usage.
+
+    Flushing is best effort: a Redis error is logged and the records are dropped.
+
+    Args:
+        redis_client (Optional[redis.Redis]): The shared Redis client; nothing is flushed without one.
+        records (list[dict]): Records as returned by `record_call`.
+        job_id (Optional[str]): The job the calls were made for.
+        ttl (int): Seconds the job's usage is kept.
+    """
+    if redis_client is None or not records:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for record in records:
+            labels = "|".join((record['provider'], record['model'], record['stage'], record['outcome']))
+            pipe.hincrby(TOTALS_KEY, f"{labels}|calls", 1)
+            pipe.hincrby(TOTALS_KEY, f"{labels}|attempts", record['attempts'])
+            pipe.hincrby(TOTALS_KEY, f"{labels}|input_tokens", record['input_tokens'])
+            pipe.hincrby(TOTALS_KEY, f"{labels}|output_tokens", record['output_tokens'])
+            pipe.hincrbyfloat(TOTALS_KEY, f"{labels}|latency", record['latency'])
+            if job_id is not None:
+                key = job_key(job_id)
+                pipe.hincrby(key, f"{record['stage']}|calls", 1)
+                pipe.hincrby(key, f"{record['stage']}|attempts", record['attempts'])
+                pipe.hincrby(key, f"{record['stage']}|input_tokens", record['input_tokens'])
+                pipe.hincrby(key, f"{record['stage']}|output_tokens", record['output_tokens'])
+                pipe.hincrbyfloat(key, f"{record['stage']}|latency", record['latency'])
+                pipe.hincrby(key, "failures", int(record['outcome'] != 'success'))
+        if job_id is not None:
+            pipe.expire(job_key(job_id), ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record LLM usage: {e}")
+
+
+def job_usage(redis_client: Optional[redis.Redis], job_id: str) -> dict:
+    """
+    Reads the usage of a job, in the format of `summarize`.
+
+    Args:
+        redis_client (Optional[redis.Redis]): The shared Redis client.
+        job_id (str): The id of the job.
+
+    Returns:
+        dict: The job's usage; all zeros if nothing was recorded or Redis is unavailable.
+    """
+    summary = summarize([])
+    if redis_client is None:
+        return summary
+    try:
+        fields = redis_client.hgetall(job_key(job_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not read LLM usage of job {job_id}: {e}")
+        return summary
+
+    for field, value in fields.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        value = float(value)
+        if field == 'failures':
+            summary['failures'] = int(value)
+            continue
+        stage_name, metric = field.rsplit("|", 1)
+        value = round(value, 4) if metric == 'latency' else int(value)
+        summary['stages'].setdefault(stage_name, {name: 0 for name in _METRICS})[metric] = value
+        summary[metric] += value
+    summary['latency'] = round(summary['latency'], 4)
+    return summary
+
+
+def prometheus_text(redis_client: redis.Redis) -> str:
+    """
+    Renders the process-wide totals in the Prometheus text exposition format.
+
+    Args:
+        redis_client (redis.Redis): The shared Redis client.
+
+    Returns:
+        str: The `llm_calls_total`, `llm_attempts_total`, `llm_input_tokens_total`,
+             `llm_output_tokens_total` and `llm_latency_seconds_total` counters, labelled
+             by provider, model, stage and outcome.
+    """
+    names = {
+        'calls': ('llm_calls_total', "Model calls, retries excluded."),
+        'attempts': ('llm_attempts_total', "Model requests, retries included."),
+        'input_tokens': ('llm_input_tokens_total', "Input tokens billed."),
+        'output_tokens': ('llm_output_tokens_total', "Output tokens billed."),
+        'latency': ('llm_latency_seconds_total', "Seconds spent in model calls."),
+    }
+    samples = {metric: [] for metric in names}
+    for field, value in sorted(redis_client.hgetall(TOTALS_KEY).items()):
+        field = field.decode() if isinstance(field, bytes) else field
+        value = value.decode() if isinstance(value, bytes) else value
+        provider, model, stage_name, outcome, metric = field.split("|")
+        labels = f'provider="{provider}",model="{model}",stage="{stage_name}",outcome="{outcome}"'
+        samples[metric].append(f"{names[metric][0]}{{{labels}}} {value}")
+
+    lines = []
+    for metric, (name, description) in names.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(samples[metric])
+    return "\n".join(lines) + "\n"
@@ -7,15 +7,87 @@
 
 import re
 import contextlib
+import functools
+import logging
+import weakref
 from math import isclose
-from typing import Union
-import sympy
-from sympy.parsing.latex import parse_latex
-from sympy.parsing.sympy_parser import parse_expr
+from typing import Optional, Union
+import numpy as np
 import asyncio
-from backend.models import Cohere
+from backend import usage
+from backend.comparison_pool import ComparisonError, comparison_pool
+from backend.models import Cohere, ModelProvider
 from enum import Enum
-from sympy import Eq, simplify, symbols, cancel
+
+# sympy and its parsers are imported where they are used: loading them takes hundreds of
+# milliseconds and tens of MB, and only the symbolic stages, which run in the comparison
+# pool's workers, need them. The workers import them before their first comparison.
+
+
+logger = logging.getLogger(__name__)
+
+# Units stripped from answers. The entries are regex fragments ('p.m.' matches any
+# character in place of the dots), removed one unit after the other.
+_UNITS = [
+    "degree",
+    "cm",
+    "centimeter",
+    "meter",
+    "mile",
+    "second",
+    "minute",
+    "hour",
+    "week",
+    "month",
+    "year",
+    "foot",
+    "feet",
+    "inch",
+    "yard",
+    "p.m.",
+    "PM",
+]
+_UNIT_PATTERNS = [re.compile(f"{unit}(es)?(s)?\\s*(\\^[0-9]+)?") for unit in _UNITS]
+# Matches wherever any unit pattern would; most answers contain no unit, and one search
+# rules out all the removals. The removals themselves stay sequential, since removing one
+# unit can join or split the text another unit is matched against.
+_ANY_UNIT = re.compile("|".join(_UNITS))
+
+_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+_DAY = re.compile("day(s)?")
+
+_SURROUND_COMMANDS = [
+    (surround_str, re.compile(f"^{surround_str}" + r"\{(?P<text>.+?)\}$"))
+    for surround_str in ["\\\\text", "\\\\mathrm", "\\\\mathcal", "\\\\textbf", "\\\\textit"]
+]
+
+_LEFT_RIGHT = re.compile(r"\\left|\\right")
+_TEXT_AND_OR = re.compile(r"\s*\\text{\s*(or|and)\s*}\s*")
+_DOUBLE_COMMA = re.compile(r",\s*,")
+_TEXT_OPEN = re.compile(r"\\text\s*{\s*")
+_TEXT_BRACES = re.compile(r"\\text{([^}]+)}")
+_DEGREES = re.compile(r"\^ *\\circ")
+_SQRT = re.compile(r"\\sqrt(\s*\w+)")
+_MINUS_SPACE = re.compile(r"-\s*")
+_MIXED_NUMBER = re.compile(r"([0-9]) +([0-9])")
+_MIXED_FRACTION = re.compile(r"(\d+)\s*\\frac{(\d+)}{(\d+)}")
+# A comma between thousands; the lookahead leaves the next group's comma for the same pass
+_THOUSANDS_COMMA = re.compile(r"(\d),(?=\d\d\d(?:$|\D))")
+# Strings every normalization step leaves unchanged, up to the final integer conversion
+_PLAIN_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+_ANSWER_PHRASE = re.compile(r"(?i)(?:the\s+)?(?:final\s+)?(?:answer|result)(?:\s*(?:[:\-]|is)\s*)(.+)$")
+_BRACES = re.compile(r"[{}]")
+# LaTeX commands that box a final answer
+BOX_COMMANDS = ("\\boxed", "\\fbox")
+
+EQUIVALENCE_CLASSES_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'groups': {'type': 'array', 'items': {'type': 'array', 'items': {'type': 'integer'}}}
+    },
+    'required': ['groups']
+}
 
 
 class Equality(Enum):
@@ -25,40 +97,57 @@ class Equality(Enum):
 
 
 class ValidationObject:
-    stages = ["string", "math", "brackets", "matrices", "symbolic", "llm"]
+    """
+    The result of comparing two answers: its status and the stage that decided it.
+
+    Comparisons are made in bulk and mostly only their status is read, so the result
+    stores the deciding stage as an index into `stages` and renders the per-stage
+    diagnostic `state` only when it is read.
+    """
+    __slots__ = ("status", "stage", "info")
+
+    stages = ("string", "math", "brackets", "matrices", "symbolic", "llm")
+    STRING, MATH, BRACKETS, MATRICES, SYMBOLIC, LLM = range(len(stages))
+    _codes = {name: code for code, name in enumerate(stages)}
 
     def __init__(self):
-        self.counter = 0
-        self.state = []
         self.status = Equality.FAILED
+        # Index of the deciding stage, None while undecided
+        self.stage = None
+        self.info = ""
 
-    def _populate_info(self, idx: int, stage: str):
+    @property
+    def state(self) -> list[dict]:
         """
-        Populate the state list with reasons for previous stages being unequal or failed.
-        
-        :param idx: Index up to which stages should be populated.
-        :param stage: Current stage name.
+        The reason of every stage up to the deciding one: the string stage found the answers
+        unequal, the stages after it failed, and the deciding stage's result.
         """
-        for i in range(idx):
-            reason = "not equal" if i == 0 else "failed"
-            self.state.append(
-                {"type": f"{self.stages[i]} comparison", "reason": reason}
-            )
+        if self.stage is None:
+            return []
+        state = [
+            {"type": f"{self.stages[i]} comparison", "reason": "not equal" if i == 0 else "failed"}
+            for i in range(self.stage)
+        ]
+        reason = "success" if self.status == Equality.EQUAL else "not equal"
+        info = f" {self.info}" if self.info else ""
+        state.append({"type": f"{self.stages[self.stage]} comparison", "reason": f"{reason}{info}"})
+        return state
 
-    def _add_stage(self, stage: str, msg: str):
+    def _add_stage(self, stage: str, status: Equality, info: str):
         """
-        Add a new comparison stage and corresponding message to the state.
-        
+        Record the stage that decided the comparison.
+
         :param stage: Name of the stage.
-        :param msg: Message describing the result of the comparison.
+        :param status: The decision.
+        :param info: Optional message to include in the stage's reason.
         """
         assert (
-            stage in ValidationObject.stages
+            stage in ValidationObject._codes
         ), f"Value Error: stage {stage} does not exist"
 
-        idx = ValidationObject.stages.index(stage)
-        self._populate_info(idx, stage)
-        self.state.append({"type": f"{self.stages[idx]} comparison", "reason": msg})
+        self.stage = ValidationObject._codes[stage]
+        self.status = status
+        self.info = info
 
     def add_equal(self, stage: str, info: str = ""):
         """
@@ -67,9 +156,7 @@ class ValidationObject:
         :param stage: The stage at which equality was determined (e.g., "math", "symbolic").
         :param info: Optional message or context to include in the state log.
         """
-        info = f" {info}" if info else info
-        self._add_stage(stage, f"success{info}")
-        self.status = Equality.EQUAL
+        self._add_stage(stage, Equality.EQUAL, info)
 
     def add_unequal(self, stage: str, info: str = ""):
         """
@@ -78,9 +165,7 @@ class ValidationObject:
         :param stage: The stage at which inequality was determined.
         :param info: Optional message or context to include in the state log.
         """
-        info = f" {info}" if info else info
-        self._add_stage(stage, f"not equal{info}")
-        self.status = Equality.UNEQUAL
+        self._add_stage(stage, Equality.UNEQUAL, info)
 
 
 def safe_execution(default_return=None, catch_exceptions=(Exception,)):
@@ -104,8 +189,22 @@ def safe_execution(default_return=None, catch_exceptions=(Exception,)):
 
 
 class LLMAnswerComparator:
-    def __init__(self, tolerance: float = 1e-4):
+    def __init__(self, tolerance: float = 1e-4, cache_size: int = 256, model: Optional[ModelProvider] = None):
+        """
+        :param tolerance: Relative tolerance of numeric comparisons.
+        :param cache_size: Number of answers whose extracted and normalized form, and of
+            expressions whose sympy parse, are memoized (LRU). 0 disables the memo.
+        :param model: The model that decides the comparisons the deterministic stages cannot.
+            Defaults to a Cohere model shared by all comparators in the same event loop.
+        """
         self.tolerance = tolerance
+        self.model = model
+
+        # Every answer of a question is compared with every other one, so without the memo
+        # each would be extracted, normalized and parsed (parse_latex is slow) once per pair
+        self._extract_and_normalize_one = functools.lru_cache(maxsize=cache_size)(self._extract_and_normalize_one)
+        self.normalize_answer_string = functools.lru_cache(maxsize=cache_size)(self.normalize_answer_string)
+        self._try_parse_sympy = functools.lru_cache(maxsize=cache_size)(self._try_parse_sympy)
 
     def _fix_fracs(self, string: str) -> str:
         """
@@ -174,17 +273,10 @@ class LLMAnswerComparator:
         :param step: Input string.
         :return: Modified string.
         """
-        p1 = re.compile(r"([0-9]) +([0-9])")
-        return p1.sub(r"\1+\2", step)
+        return _MIXED_NUMBER.sub(r"\1+\2", step)
 
     def _strip_properly_formatted_commas(self, expr: str) -> str:
-        p1 = re.compile(r"(\d)(,)(\d\d\d)($|\D)")
-        while True:
-            next_expr = p1.sub(r"\1\3\4", expr)
-            if next_expr == expr:
-                break
-            expr = next_expr
-        return next_expr
+        return _THOUSANDS_COMMA.sub(r"\1", expr)
 
     def _remove_right_units(self, expr: str) -> str:
         """
@@ -194,11 +286,11 @@ class LLMAnswerComparator:
         :return: Cleaned expression.
         """
         if "\\text" in expr:
-            splits = re.split(r"\\text\s*{\s*", expr)
+            splits = _TEXT_OPEN.split(expr)
             if len(splits) == 2 and splits[0] not in ("", "("):
                 return splits[0]
         if "\\text{" in expr:
-            return re.sub(r"\\text{([^}]+)}", r"\1", expr)
+            return _TEXT_BRACES.sub(r"\1", expr)
         elif "\\mbox{" in expr:
             splits = expr.split("\\mbox{")
             if len(splits) == 2:
@@ -212,11 +304,11 @@ class LLMAnswerComparator:
         :param string: Input LaTeX string.
         :return: Cleaned string.
         """
-        string = re.sub(r"\s*\\text{\s*(or|and)\s*}\s*", ",", string)
-        return re.sub(r",\s*,", ",", string)
+        string = _TEXT_AND_OR.sub(",", string)
+        return _DOUBLE_COMMA.sub(",", string)
 
     def _remove_left_and_right(self, expr: str) -> str:
-        return re.sub(r"\\left|\\right", "", expr)
+        return _LEFT_RIGHT.sub("", expr)
 
     def _fix_sqrt(self, string: str) -> str:
         """
@@ -225,7 +317,7 @@ class LLMAnswerComparator:
         :param string: Input LaTeX expression.
         :return: Fixed expression.
         """
-        return re.sub(r"\\sqrt(\s*\w+)", r"\\sqrt{\1}", string)
+        return _SQRT.sub(r"\\sqrt{\1}", string)
 
     def _fix_interval(self, expr: str) -> str:
         """
@@ -245,37 +337,31 @@ class LLMAnswerComparator:
         :param step: Input LaTeX expression.
         :return: Modified expression.
         """
-        p1 = re.compile(r"(\d+)\s*\\frac{(\d+)}{(\d+)}")
-
         def replacer(match):
             whole_part = match.group(1)
             numerator = match.group(2)
             denominator = match.group(3)
             return f"{whole_part}+{numerator}/{denominator}"
 
-        return p1.sub(replacer, step)
+        return _MIXED_FRACTION.sub(replacer, step)
 
     def normalize_answer_string(self, expr: str) -> str:
         """Normalize an answer expression."""
         if expr is None:
             return None
 
+        if _PLAIN_NUMBER.fullmatch(expr):
+            return str(self._str_to_int(expr)) if self._str_is_int(expr) else expr
+
         expr = self._remove_left_and_right(expr)
         expr = self._process_and_or_inside_text(expr)
         expr = self._remove_right_units(expr)
         expr = self._fix_interval(expr)
 
         # Remove additional LaTeX formatting commands.
-        for surround_str in [
-            "\\\\text",
-            "\\\\mathrm",
-            "\\\\mathcal",
-            "\\\\textbf",
-            "\\\\textit",
-        ]:
+        for surround_str, pattern in _SURROUND_COMMANDS:
             expr = expr.replace(surround_str, "")
-            pattern = f"^{surround_str}" + r"\{(?P<text>.+?)\}$"
-            m = re.search(pattern, expr)
+            m = pattern.search(expr)
             if m:
                 expr = m.group("text")
 
@@ -288,48 +374,22 @@ class LLMAnswerComparator:
             .replace("billion", "*10^9")
             .replace("trillion", "*10^12")
         )
-        for unit in [
-            "degree",
-            "cm",
-            "centimeter",
-            "meter",
-            "mile",
-            "second",
-            "minute",
-            "hour",
-            "week",
-            "month",
-            "year",
-            "foot",
-            "feet",
-            "inch",
-            "yard",
-            "p.m.",
-            "PM",
-        ]:
-            expr = re.sub(f"{unit}(es)?(s)?\s*(\^[0-9]+)?", "", expr)
+        if _ANY_UNIT.search(expr):
+            for pattern in _UNIT_PATTERNS:
+                expr = pattern.sub("", expr)
 
         if "day" in expr:
-            days = [
-                "Monday",
-                "Tuesday",
-                "Wednesday",
-                "Thursday",
-                "Friday",
-                "Saturday",
-                "Sunday",
-            ]
-            if not any(day in expr for day in days):
-                expr = re.sub("day(s)?", "", expr)
-
-        expr = re.sub(r"\^ *\\circ", "", expr)
+            if not any(day in expr for day in _DAYS):
+                expr = _DAY.sub("", expr)
+
+        expr = _DEGREES.sub("", expr)
 
         if expr.startswith("{") and expr.endswith("}"):
             expr = expr[1:-1]
 
         expr = self._fix_sqrt(expr)
         expr = self._fix_fracs(expr)
-        expr = re.sub(r"-\s*", "-", expr)
+        expr = _MINUS_SPACE.sub("-", expr)
         expr = self._inject_implicit_mixed_number(expr)
         expr = self._inject_implicit_mixed_fraction(expr)
         expr = expr.replace(" ", "")
@@ -392,6 +452,9 @@ class LLMAnswerComparator:
         :param s: Input expression.
         :return: Parsed sympy object or None.
         """
+        from sympy.parsing.latex import parse_latex
+        from sympy.parsing.sympy_parser import parse_expr
+
         for parse_fn in (parse_expr, parse_latex):
             try:
                 return parse_fn(s)
@@ -401,20 +464,24 @@ class LLMAnswerComparator:
 
     @safe_execution()
     def check_difference(self, expr_a, expr_b):
+        import sympy
         return sympy.simplify(expr_a - expr_b) == 0
 
     @safe_execution()
     def check_equality(self, expr_a, expr_b):
+        import sympy
         return sympy.Eq(expr_a, expr_b).simplify() is True
 
     @safe_execution(default_return=False)
     def check_close(self, expr_a, expr_b):
+        import sympy
         return isclose(
             float(sympy.N(expr_a)), float(sympy.N(expr_b)), rel_tol=self.tolerance
         )
 
     def _symbolic_equal(self, a: str, b: str) -> bool:
         """Check if two expressions are symbolically equivalent using sympy."""
+        from sympy import Eq, cancel, simplify
 
         expr_a = self._try_parse_sympy(a)
         expr_b = self._try_parse_sympy(b)
@@ -449,6 +516,8 @@ class LLMAnswerComparator:
         :param expr: LaTeX or sympy matrix string.
         :return: sympy Matrix object.
         """
+        import sympy
+
         latex_match = re.search(
             r"\\begin\{(pmatrix|bmatrix|vmatrix|Bmatrix|matrix)\}(.*?)\\end\{\1\}",
             expr,
@@ -489,6 +558,8 @@ class LLMAnswerComparator:
         :param b: Second matrix string.
         :return: True if equivalent, False otherwise.
         """
+        import sympy
+
         try:
             mat_a = self._parse_matrix(a)
             mat_b = self._parse_matrix(b)
@@ -513,15 +584,16 @@ class LLMAnswerComparator:
 
     async def llm_check(self, ans1: str, ans2: str) -> Equality:
         """Use LLM to check equivalence as last resort"""
-        model = Cohere()
+        model = self.model or _shared_model()
 
         prompt = f"Evaluate the values within expression 1: <{ans1}> and expression 2: <{ans2}>. Show your steps. It does not matter if the format is different, just tell me if the final value is numerically equal."
-        response = await model.call_model(
-            prompt,
-            preamble="You are an examinator and need to decide if 2 answers are equivalent in value. Show your steps and at the end reply with exactly 'Decision: yes' or 'Decision: no'",
-            accept_func=lambda x: any(s in x.lower().split('decision:')[1].strip() for s in ['yes', 'no']),
-            temperature=1,
-        )
+        with usage.stage('equivalence'):
+            response = await model.call_model(
+                prompt,
+                preamble="You are an examinator and need to decide if 2 answers are equivalent in value. Show your steps and at the end reply with exactly 'Decision: yes' or 'Decision: no'",
+                accept_func=lambda x: any(s in x.lower().split('decision:')[1].strip() for s in ['yes', 'no']),
+                temperature=1,
+            )
         return Equality.EQUAL if "yes" in response.lower().split('decision:')[1].strip() else Equality.UNEQUAL
 
     def format_intervals(self, prediction: str) -> str:
@@ -565,11 +637,10 @@ class LLMAnswerComparator:
         :param extract_regex: Optional regex pattern(s) for natural language extraction.
         :return: Extracted answer string.
         """
-        if "boxed" not in string and "fbox" not in string:
+        # Searched from the end, where the answer of a reasoning trace is
+        if string.rfind("boxed") < 0 and string.rfind("fbox") < 0:
             if extract_regex is None:
-                extract_regex = [
-                    r"(?i)(?:the\s+)?(?:final\s+)?(?:answer|result)(?:\s*(?:[:\-]|is)\s*)(.+)$"
-                ]
+                extract_regex = [_ANSWER_PHRASE]
             elif isinstance(extract_regex, str):
                 extract_regex = [extract_regex]
             for regex in extract_regex:
@@ -578,29 +649,19 @@ class LLMAnswerComparator:
                     return match.group(1).strip()
             return string
 
-        idx = string.rfind("\\boxed")
+        # The answer is the last box; only the box itself is walked, from brace to brace
+        idx, command = max((string.rfind(command), command) for command in BOX_COMMANDS)
         if idx < 0:
-            idx = string.rfind("\\fbox")
-        i = idx
-        num_left_braces_open = 0
-        right_brace_idx = None
-        while i < len(string):
-            if string[i] == "{":
-                num_left_braces_open += 1
-            if string[i] == "}":
-                num_left_braces_open -= 1
-                if num_left_braces_open == 0:
-                    right_brace_idx = i
-                    break
-            i += 1
-
-        if right_brace_idx is None:
             return string
 
-        retval = string[idx : right_brace_idx + 1]
-        left = "\\boxed{"
-        if retval.startswith(left) and retval.endswith("}"):
-            return retval[len(left) : -1].strip()
+        left = f"{command}{{"
+        if not string.startswith(left, idx):
+            return string
+        depth = 0
+        for brace in _BRACES.finditer(string, idx):
+            depth += 1 if brace.group() == "{" else -1
+            if depth == 0:
+                return string[idx + len(left) : brace.start()].strip()
         return string
 
     def extract_and_normalize(
@@ -613,11 +674,10 @@ class LLMAnswerComparator:
         :param ans2: Second answer.
         :return: Tuple of normalized answer strings.
         """
-        ans1 = self.extract_answer(ans1)
-        ans2 = self.extract_answer(ans2)
-        a = self.normalize_answer_string(ans1)
-        b = self.normalize_answer_string(ans2)
-        return a, b
+        return self._extract_and_normalize_one(ans1), self._extract_and_normalize_one(ans2)
+
+    def _extract_and_normalize_one(self, answer: Union[str, float, bool]) -> str:
+        return self.normalize_answer_string(self.extract_answer(answer))
 
     def _llm_answers_equivalent(
         self, ans1: Union[str, float, bool], ans2: Union[str, float, bool]
@@ -629,21 +689,48 @@ class LLMAnswerComparator:
         :param ans2: Second answer to compare.
         :return: ValidationObject indicating the result and reason for each comparison stage.
         """
+        validation, a, b = self._cheap_stages(ans1, ans2)
+        if validation.status != Equality.FAILED:
+            return validation
+        return self._sympy_stages(a, b)
+
+    def _cheap_stages(
+        self, ans1: Union[str, float, bool], ans2: Union[str, float, bool]
+    ) -> tuple[ValidationObject, str, str]:
+        """
+        Runs the string and numeric comparison stages, which take no sympy work.
+
+        :param ans1: First answer to compare.
+        :param ans2: Second answer to compare.
+        :return: The ValidationObject (FAILED if neither stage decided) and the normalized answers.
+        """
         validation = ValidationObject()
         # Extract answers if wrapped in boxes or labeled.
         a, b = self.extract_and_normalize(ans1, ans2)
 
         if a.lower().strip() == b.lower().strip():
             validation.add_equal("string")
-            return validation
+            return validation, a, b
         a_is_num, a_val = self.is_digit(a)
         b_is_num, b_val = self.is_digit(b)
         if a_is_num and b_is_num:
             is_close = isclose(a_val, b_val, rel_tol=self.tolerance)
             val_method = validation.add_equal if is_close else validation.add_unequal
             val_method("math")
-            return validation
+        return validation, a, b
 
+    def _sympy_stages(self, a: str, b: str) -> ValidationObject:
+        """
+        Runs the bracket, matrix and symbolic comparison stages on normalized answers.
+
+        These can take unbounded time on pathological input, so `llm_answers_equivalent_full`
+        runs them in the comparison pool.
+
+        :param a: First normalized answer.
+        :param b: Second normalized answer.
+        :return: ValidationObject indicating the result and reason for each comparison stage.
+        """
+        validation = ValidationObject()
         a = self.format_intervals(a)
         b = self.format_intervals(b)
 
@@ -664,6 +751,80 @@ class LLMAnswerComparator:
 
         return validation
 
+    def bulk_compare(self, answers: list[str]) -> tuple[list[list[bool]], list[tuple[int, int]]]:
+        """
+        Resolve the string and numeric comparisons of all pairs of answers at once.
+
+        Each answer is extracted, normalized and classified once. Pairs whose normalized
+        answers match as strings are equal, and all pairs of plain numbers are compared in
+        one vectorized pass, with the same relative tolerance as the math stage
+        (`math.isclose`). Only the remaining pairs need the per-pair stages.
+
+        :param answers: The answers to compare.
+        :return: An n x n matrix whose entry [i][j] (i < j) tells whether answers i and j are equal,
+            where resolved, and the pairs (i, j) that are left unresolved.
+        """
+        n = len(answers)
+        normalized = [self._extract_and_normalize_one(answer) for answer in answers]
+        values = np.full(n, np.nan)
+        numeric = np.zeros(n, dtype=bool)
+        for i, answer in enumerate(normalized):
+            numeric[i], value = self.is_digit(answer)
+            if numeric[i]:
+                values[i] = value
+
+        _, keys = np.unique([answer.lower().strip() for answer in normalized], return_inverse=True)
+        same = keys[:, None] == keys[None, :]
+        both_numeric = numeric[:, None] & numeric[None, :]
+        magnitude = np.abs(values)
+        with np.errstate(invalid="ignore"):
+            close = (values[:, None] == values[None, :]) | (
+                np.abs(values[:, None] - values[None, :])
+                <= self.tolerance * np.maximum(magnitude[:, None], magnitude[None, :])
+            )
+
+        upper = np.triu(np.ones((n, n), dtype=bool), 1)
+        equal = (same | (both_numeric & close)) & upper
+        unresolved = ~(same | both_numeric) & upper
+        return equal.tolist(), [(int(i), int(j)) for i, j in zip(*np.nonzero(unresolved))]
+
+    async def deterministic_equivalent(
+        self, ans1: Union[str, float, bool], ans2: Union[str, float, bool]
+    ) -> ValidationObject:
+        """
+        Check whether two LLM-generated answers are equivalent using the deterministic stages only.
+
+        The sympy stages run in the comparison pool; a comparison that does not finish in
+        time is left FAILED.
+
+        :param ans1: First answer to compare.
+        :param ans2: Second answer to compare.
+        :return: ValidationObject indicating the result and reason for each comparison stage.
+        """
+        validation, a, b = self._cheap_stages(ans1, ans2)
+        if validation.status == Equality.FAILED:
+            try:
+                validation = await asyncio.to_thread(comparison_pool().run, _sympy_stages, self.tolerance, a, b)
+            except ComparisonError as e:
+                # Left FAILED, so the LLM decides
+                logger.warning(f"Symbolic comparison of {a!r} and {b!r} abandoned: {e}")
+        return validation
+
+    @staticmethod
+    def is_settled(validation: ValidationObject) -> bool:
+        """
+        Whether a deterministic result can be trusted without asking the LLM.
+
+        :param validation: The result of `deterministic_equivalent`.
+        :return: False if the comparison failed, or only sympy found the answers unequal.
+        """
+        # NOTE: sometimes sympy parses even though its meaningless
+        # we are not confident in UNEQUAL value so dont set it
+        return validation.status != Equality.FAILED and not (
+            validation.status == Equality.UNEQUAL
+            and validation.stage == ValidationObject.SYMBOLIC
+        )
+
     async def llm_answers_equivalent_full(
         self, ans1: Union[str, float, bool], ans2: Union[str, float, bool]
     ) -> bool:
@@ -674,13 +835,8 @@ class LLMAnswerComparator:
         :param ans2: Second answer to compare.
         :return: True if answers are equivalent, otherwise False.
         """
-        # NOTE: sometimes sympy parses even though its meaningless
-        validation = self._llm_answers_equivalent(ans1, ans2)
-        # we are not confident in UNEQUAL value so dont set it
-        if validation.status != Equality.FAILED and not (
-            validation.status == Equality.UNEQUAL
-            and validation.state[-1]["type"] == "symbolic comparison"
-        ):
+        validation = await self.deterministic_equivalent(ans1, ans2)
+        if self.is_settled(validation):
             return validation
         # must clear it because of above reason
         validation = ValidationObject()
@@ -691,6 +847,119 @@ class LLMAnswerComparator:
             validation.add_unequal("llm")
         return validation
 
+    async def llm_partition(self, answers: list[str]) -> Union[list[int], None]:
+        """
+        Ask the LLM to partition answers into classes of equivalent values, in one call.
+
+        :param answers: The answers to partition.
+        :return: The class of each answer (answers of the same class are equivalent), or None
+            if the model gave no usable partition. Answers the model left out get a class of their own.
+        """
+        model = self.model or _shared_model()
+
+        listing = "\n".join(f"Answer {i}: <{answer}>" for i, answer in enumerate(answers))
+        prompt = f"{listing}\n\nGroup these answers by their final value: two answers belong to the same group " \
+                 f"if their values are numerically or symbolically equal, regardless of format. Return a JSON " \
+                 f"object whose \"groups\" key holds the groups as lists of answer numbers, with every answer " \
+                 f"number in exactly one group."
+        with usage.stage('equivalence'):
+            response = await model.call_model_json(
+                prompt,
+                EQUIVALENCE_CLASSES_SCHEMA,
+                preamble="You are an examinator and need to decide which answers to a question are equivalent in value.",
+                temperature=0,
+            )
+
+        groups = response.get('groups') if isinstance(response, dict) else None
+        if not isinstance(groups, list):
+            return None
+
+        classes = [None] * len(answers)
+        for label, group in enumerate(groups):
+            if not isinstance(group, list):
+                continue
+            for index in group:
+                # The first group an answer is listed in wins
+                if isinstance(index, int) and 0 <= index < len(answers) and classes[index] is None:
+                    classes[index] = label
+        if all(label is None for label in classes):
+            return None
+        return [label if label is not None else len(groups) + i for i, label in enumerate(classes)]
+
+    async def equivalence_matrix(self, answers: list[str]) -> list[list[bool]]:
+        """
+        Decide which pairs of answers are equivalent.
+
+        String and numeric comparisons of all pairs are resolved in bulk (`bulk_compare`), and
+        the remaining pairs are compared deterministically. The answers of the pairs that are
+        not settled that way are partitioned by the LLM in a single call (`llm_partition`),
+        instead of one LLM call per pair; only if that call fails are the pairs checked
+        one by one.
+
+        :param answers: The unique answers to a question.
+        :return: An n x n matrix whose entry [i][j] (i < j) tells whether answers i and j are equivalent.
+        """
+        matrix, pairs = self.bulk_compare(answers)
+        results = await asyncio.gather(*(self.deterministic_equivalent(answers[i], answers[j]) for i, j in pairs))
+
+        unsettled = []
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for (i, j), validation in zip(pairs, results):
+            if debug:
+                # The per-stage diagnostics are only rendered for debug logs
+                logger.debug(f"Compared {answers[i]!r} and {answers[j]!r}: {validation.state}")
+            if self.is_settled(validation):
+                matrix[i][j] = validation.status == Equality.EQUAL
+            else:
+                unsettled.append((i, j))
+        if not unsettled:
+            return matrix
+
+        involved = sorted({index for pair in unsettled for index in pair})
+        classes = await self.llm_partition([answers[index] for index in involved])
+        if classes is not None:
+            label = dict(zip(involved, classes))
+            for i, j in unsettled:
+                matrix[i][j] = label[i] == label[j]
+            return matrix
+
+        logger.warning("The LLM gave no usable partition of the answers, checking pairs one by one")
+        decisions = await asyncio.gather(*(self.llm_check(answers[i], answers[j]) for i, j in unsettled))
+        for (i, j), decision in zip(unsettled, decisions):
+            matrix[i][j] = decision == Equality.EQUAL
+        return matrix
+
+
+# The default comparison model of each event loop
+_loop_models = weakref.WeakKeyDictionary()
+
+
+def _shared_model() -> ModelProvider:
+    """
+    Returns the Cohere model shared by the comparators of the running event loop.
+
+    Its client keeps a pool of HTTP connections, which are bound to the event loop
+    they were opened in, so each loop has its own model. The Celery workers run every
+    task of a thread in one loop (see `backend.task`), so the model lives as long as
+    the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    model = _loop_models.get(loop)
+    if model is None:
+        model = _loop_models[loop] = Cohere()
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def _worker_comparator(tolerance: float) -> LLMAnswerComparator:
+    # One comparator per tolerance, so a worker's parse memo outlives a single comparison
+    return LLMAnswerComparator(tolerance=tolerance)
+
+
+def _sympy_stages(tolerance: float, a: str, b: str) -> ValidationObject:
+    """Runs `LLMAnswerComparator._sympy_stages` in a comparison pool worker."""
+    return _worker_comparator(tolerance)._sympy_stages(a, b)
+
 
 # ---------------------- Example Usage ----------------------
 if __name__ == "__main__":